@@ -0,0 +1,173 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import anyio
+import httpx
+
+from benchmarks.workload import DEFAULT_MIX, Workload, compare, seed_payloads, seeded_links, summarize
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINES_DIR = Path(__file__).resolve().parent / "baselines"
+
+
+async def seed(client: httpx.AsyncClient, count: int, run_id: str) -> list[dict]:
+    links = []
+    for payload in seed_payloads(count, run_id):
+        resp = await client.post("/links/shorten/batch", json=payload)
+        resp.raise_for_status()
+        links.extend(seeded_links(payload, resp.json()))
+    if not links:
+        raise RuntimeError("Не удалось создать ни одной ссылки для нагрузки")
+    return links
+
+
+async def run_workload(
+    client: httpx.AsyncClient,
+    links: int = 1000,
+    requests: int = 10000,
+    concurrency: int = 16,
+    exponent: float = 1.1,
+    seed_value: int = 0,
+    mix: Optional[dict[str, int]] = None,
+) -> dict:
+    run_id = uuid.uuid4().hex[:8]
+    workload = Workload(await seed(client, links, run_id), mix, exponent, seed_value, run_id)
+    # Последовательность запросов фиксируется заранее, чтобы прогоны были воспроизводимыми
+    plan = [workload.next_request() for _ in range(requests)]
+    latencies: dict[str, list[float]] = {}
+    errors: dict[str, int] = {}
+    position = 0
+
+    async def worker():
+        nonlocal position
+        while position < len(plan):
+            operation, method, url, kwargs = plan[position]
+            position += 1
+            started = time.perf_counter()
+            try:
+                resp = await client.request(method, url, **kwargs)
+                failed = resp.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            if failed:
+                errors[operation] = errors.get(operation, 0) + 1
+            else:
+                latencies.setdefault(operation, []).append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with anyio.create_task_group() as tg:
+        for _ in range(concurrency):
+            tg.start_soon(worker)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "links": len(workload.links),
+            "requests": requests,
+            "concurrency": concurrency,
+            "zipf_exponent": exponent,
+            "seed": seed_value,
+            "mix": mix or DEFAULT_MIX,
+            "elapsed_s": round(elapsed, 3),
+            "python": platform.python_version(),
+        },
+        "endpoints": summarize(latencies, errors, elapsed),
+    }
+
+
+@asynccontextmanager
+async def asgi_client():
+    # Приложение в том же процессе на временной SQLite без Redis: кэши в памяти, буфер переходов запущен
+    db_path = Path(tempfile.mkdtemp()) / "bench.db"
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{db_path}"
+    sys.path[:0] = [str(ROOT), str(ROOT / "src")]
+
+    from fastapi_cache import FastAPICache
+    from fastapi_cache.backends.inmemory import InMemoryBackend
+
+    from src import admission
+    from src.cache import CountingBackend
+    from src.clicks import click_buffer
+    from src.database import Base, get_engine
+    from src.main import app
+
+    async with get_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    FastAPICache.init(CountingBackend(InMemoryBackend()), prefix="fastapi-cache")
+    # InMemoryBackend падает с KeyError при удалении отсутствующего ключа, это не ошибка нагрузки
+    logging.getLogger("src.cache").setLevel(logging.ERROR)
+    # Все запросы идут от одного клиента: лимиты на клиента исказили бы замер самих ручек
+    admission.ADMISSION_ENABLED = False
+    click_buffer.start()
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            yield client
+    finally:
+        await click_buffer.stop()
+        await get_engine().dispose()
+        db_path.unlink(missing_ok=True)
+
+
+@asynccontextmanager
+async def http_client(base_url: str, concurrency: int):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        yield client
+
+
+async def _main(args) -> int:
+    target = asgi_client() if args.target == "asgi" else http_client(args.target, args.concurrency)
+    async with target as client:
+        report = await run_workload(
+            client, args.links, args.requests, args.concurrency, args.zipf_exponent, args.seed
+        )
+    report["meta"]["target"] = args.target
+
+    Path(args.report).write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    for operation, result in report["endpoints"].items():
+        print(
+            f"{operation:>8}: n={result['count']} err={result['errors']} p50={result['p50_ms']}ms "
+            f"p95={result['p95_ms']}ms p99={result['p99_ms']}ms {result['throughput_rps']} rps"
+        )
+
+    baseline_path = Path(args.baseline)
+    if args.update_baseline:
+        baseline_path.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+        print(f"Baseline обновлён: {baseline_path}")
+        return 0
+    if not baseline_path.exists():
+        print(f"Baseline {baseline_path} не найден, сравнение пропущено")
+        return 0
+    regressions = compare(report, json.loads(baseline_path.read_text()), args.tolerance, args.min_samples)
+    for regression in regressions:
+        print(f"РЕГРЕССИЯ {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон API с отчётом по перцентилям задержек")
+    parser.add_argument("--target", default="asgi", help="asgi (приложение в процессе, SQLite) или URL, например http://localhost:9999")
+    parser.add_argument("--links", type=int, default=1000, help="сколько ссылок создать перед прогоном")
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--zipf-exponent", type=float, default=1.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", default="bench_report.json")
+    parser.add_argument("--baseline", default=str(BASELINES_DIR / "asgi-sqlite.json"))
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимое ухудшение относительно baseline")
+    parser.add_argument("--min-samples", type=int, default=200, help="минимум замеров для сравнения p95/p99")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+    sys.exit(anyio.run(_main, args))
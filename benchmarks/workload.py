@@ -0,0 +1,115 @@
+import math
+import random
+from bisect import bisect_left
+from itertools import accumulate
+from typing import Optional
+
+# Соотношение операций, близкое к продовому: на одну запись около сотни чтений
+DEFAULT_MIX = {"redirect": 90, "stats": 6, "search": 3, "shorten": 1}
+
+
+class ZipfSampler:
+    # Выбор ссылки по закону Ципфа: k-я по популярности ссылка выбирается с весом 1 / k^s
+
+    def __init__(self, size: int, exponent: float = 1.1, rng: Optional[random.Random] = None):
+        if size <= 0:
+            raise ValueError("size должен быть положительным")
+        self.rng = rng or random.Random()
+        self._cumulative = list(accumulate(1 / rank ** exponent for rank in range(1, size + 1)))
+
+    def sample(self) -> int:
+        point = self.rng.random() * self._cumulative[-1]
+        return min(bisect_left(self._cumulative, point), len(self._cumulative) - 1)
+
+
+class Workload:
+    # Детерминированная (при фиксированном seed) последовательность запросов к API
+
+    def __init__(
+        self,
+        links: list[dict],
+        mix: Optional[dict[str, int]] = None,
+        exponent: float = 1.1,
+        seed: int = 0,
+        run_id: str = "bench",
+    ):
+        self.links = links
+        self.rng = random.Random(seed)
+        self.sampler = ZipfSampler(len(links), exponent, self.rng)
+        mix = mix or DEFAULT_MIX
+        self.operations = list(mix)
+        self.weights = list(mix.values())
+        self.run_id = run_id
+        self._created = 0
+
+    def next_request(self) -> tuple[str, str, str, dict]:
+        # (операция, метод, путь, параметры httpx)
+        operation = self.rng.choices(self.operations, self.weights)[0]
+        link = self.links[self.sampler.sample()]
+        if operation == "redirect":
+            return operation, "GET", f"/links/{link['short_url']}", {"follow_redirects": False}
+        if operation == "stats":
+            return operation, "GET", f"/links/{link['short_url']}/stats", {}
+        if operation == "search":
+            return operation, "GET", "/links/search", {"params": {"full_url": link["full_url"]}}
+        self._created += 1
+        full_url = f"https://bench.example.com/{self.run_id}/new/{self._created}"
+        return operation, "POST", "/links/shorten", {"json": {"full_url": full_url}}
+
+
+def seed_payloads(count: int, run_id: str, batch_size: int = 500) -> list[list[dict]]:
+    urls = [{"full_url": f"https://bench.example.com/{run_id}/{i}"} for i in range(count)]
+    return [urls[i:i + batch_size] for i in range(0, count, batch_size)]
+
+
+def seeded_links(payload: list[dict], response: dict) -> list[dict]:
+    return [
+        {"short_url": result["short_url"], "full_url": payload[result["index"]]["full_url"]}
+        for result in response["results"]
+        if result["status"] == "success"
+    ]
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    # Percentile по методу ближайшего ранга
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(fraction * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: dict[str, list[float]], errors: dict[str, int], elapsed: float) -> dict:
+    endpoints = {}
+    for operation in sorted(set(latencies) | set(errors)):
+        values = sorted(latencies.get(operation, []))
+        endpoints[operation] = {
+            "count": len(values),
+            "errors": errors.get(operation, 0),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+            "throughput_rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+        }
+    return endpoints
+
+
+def compare(report: dict, baseline: dict, tolerance: float, min_samples: int = 200) -> list[str]:
+    # Регрессии относительно сохранённого baseline: рост перцентилей или падение пропускной способности.
+    # На малых выборках хвостовые перцентили шумят, поэтому для них сравнивается только p50.
+    regressions = []
+    for operation, expected in baseline["endpoints"].items():
+        actual = report["endpoints"].get(operation)
+        if actual is None:
+            regressions.append(f"{operation}: нет данных в отчёте")
+            continue
+        metrics = ("p50_ms", "p95_ms", "p99_ms") if actual["count"] >= min_samples else ("p50_ms",)
+        for metric in metrics:
+            limit = expected[metric] * (1 + tolerance)
+            if actual[metric] > limit:
+                regressions.append(f"{operation}: {metric} {actual[metric]} > {limit:.3f}")
+        floor = expected["throughput_rps"] * (1 - tolerance)
+        if actual["throughput_rps"] < floor:
+            regressions.append(f"{operation}: throughput_rps {actual['throughput_rps']} < {floor:.2f}")
+        if actual["errors"] > expected["errors"]:
+            regressions.append(f"{operation}: errors {actual['errors']} > {expected['errors']}")
+    return regressions
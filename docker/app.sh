@@ -6,6 +6,11 @@ export PYTHONPATH=/fastapi_app
 
 cd /fastapi_app/src
 
+# Общий каталог для метрик Prometheus всех воркеров gunicorn
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus_multiproc}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
 alembic upgrade head
 
-exec gunicorn main:app --workers 4 --worker-class uvicorn.workers.UvicornWorker --bind=0.0.0.0:8000
\ No newline at end of file
+exec gunicorn main:app --config gunicorn.conf.py --workers 4 --worker-class uvicorn.workers.UvicornWorker --bind=0.0.0.0:8000
\ No newline at end of file
@@ -1,11 +1,50 @@
-from locust import HttpUser, task, between
+from locust import HttpUser, task, between, events
 import random
+import uuid
+
+import requests
+
+from benchmarks.workload import ZipfSampler, seed_payloads, seeded_links
+
+# Сколько ссылок создаётся перед нагрузкой; переходы распределены по закону Ципфа
+SEED_LINKS = 1000
+links: list[dict] = []
+sampler = None
+
+
+@events.test_start.add_listener
+def seed_links(environment, **kwargs):
+    global sampler
+    run_id = uuid.uuid4().hex[:8]
+    for payload in seed_payloads(SEED_LINKS, run_id):
+        response = requests.post(f"{environment.host}/links/shorten/batch", json=payload, timeout=60)
+        response.raise_for_status()
+        links.extend(seeded_links(payload, response.json()))
+    sampler = ZipfSampler(len(links))
 
 
 class LinkShortenerUser(HttpUser):
-    wait_time = between(1, 5)
+    # Соотношение задач близко к продовому: около сотни чтений на одну запись
+    wait_time = between(0.1, 0.5)
+
+    def _link(self) -> dict:
+        return links[sampler.sample()]
+
+    @task(90)
+    def test_redirect(self):
+        short_url = self._link()["short_url"]
+        self.client.get(f"/links/{short_url}", allow_redirects=False, name="/links/[short_url]")
+
+    @task(6)
+    def get_link_stats(self):
+        short_url = self._link()["short_url"]
+        self.client.get(f"/links/{short_url}/stats", name="/links/[short_url]/stats")
+
+    @task(3)
+    def search_link(self):
+        self.client.get("/links/search", params={"full_url": self._link()["full_url"]}, name="/links/search")
 
-    @task(2)
+    @task(1)
     def create_short_link(self):
         long_url = f"https://example.com/test/{random.randint(1, 1000000)}"
         payload = {"full_url": long_url}
@@ -14,29 +53,3 @@ class LinkShortenerUser(HttpUser):
                 response.success()
             else:
                 response.failure("Failed to create link")
-
-    @task(1)
-    def get_link_stats(self):
-        long_url = f"https://example.com/stats/{random.randint(1, 1000000)}"
-        payload = {"full_url": long_url}
-        with self.client.post("/links/shorten", json=payload, catch_response=True) as create_response:
-            if create_response.status_code == 200:
-                data = create_response.json()
-                short_url = data.get("short_url")
-                if short_url:
-                    self.client.get(f"/links/{short_url}/stats")
-            else:
-                create_response.failure("Failed to create link")
-
-    @task(1)
-    def test_redirect(self):
-        long_url = f"https://example.com/redirect/{random.randint(1, 1000000)}"
-        payload = {"full_url": long_url}
-        with self.client.post("/links/shorten", json=payload, catch_response=True) as create_response:
-            if create_response.status_code == 200:
-                data = create_response.json()
-                short_url = data.get("short_url")
-                if short_url:
-                    self.client.get(f"/links/{short_url}", allow_redirects=False)
-            else:
-                create_response.failure("Failed to create link")
@@ -0,0 +1,76 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query as QueryParam, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.auth.users import current_active_user
+from src.bulk_import import iter_lines, job_summary, run_import
+from src.database import get_async_session
+from src.models import ImportJob, ImportRowError, User
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["Admin"]
+)
+
+
+def require_superuser(current_user: Optional[User]) -> User:
+    if current_user is None:
+        raise HTTPException(status_code=403, detail="Чтобы получить доступ, надо залогиниться.")
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=403, detail="Нет прав.")
+    return current_user
+
+
+# Массовый импорт ссылок: тело запроса (CSV или NDJSON) разбирается потоком.
+# Повторная загрузка того же файла с job_id продолжает прерванный импорт
+@router.post("/imports")
+async def import_links(
+    request: Request,
+    format: str = QueryParam("csv", pattern="^(csv|ndjson)$"),
+    job_id: Optional[str] = None,
+    source: Optional[str] = None,
+    current_user: User = Depends(current_active_user)  # Обязательная авторизация
+):
+    require_superuser(current_user)
+    return await run_import(
+        iter_lines(request.stream()),
+        format,
+        job_id=job_id,
+        source=source,
+        creator_id=current_user.id,
+    )
+
+
+# Прогресс импорта
+@router.get("/imports/{job_id}")
+async def get_import(
+    job_id: str,
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(current_active_user)  # Обязательная авторизация
+):
+    require_superuser(current_user)
+    job = await session.get(ImportJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Импорт не найден.")
+    return job_summary(job)
+
+
+# Строки, не попавшие в urls, по возрастанию номера строки (after_line - для постраничного чтения)
+@router.get("/imports/{job_id}/errors")
+async def get_import_errors(
+    job_id: str,
+    after_line: int = 0,
+    limit: int = QueryParam(100, ge=1, le=1000),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(current_active_user)  # Обязательная авторизация
+):
+    require_superuser(current_user)
+    result = await session.execute(
+        select(ImportRowError.line_no, ImportRowError.reason, ImportRowError.short_url)
+        .where(ImportRowError.job_id == job_id, ImportRowError.line_no > after_line)
+        .order_by(ImportRowError.line_no)
+        .limit(limit)
+    )
+    return [{"line_no": row.line_no, "reason": row.reason, "short_url": row.short_url} for row in result]
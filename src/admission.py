@@ -0,0 +1,310 @@
+import json
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import NamedTuple, Optional
+
+import anyio
+
+from src.metrics import ADMISSION_IN_FLIGHT, ADMISSION_REJECTED, db_pool_wait, db_statement_latency
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+# Целевая задержка БД (сглаженное время SQL-запроса плюс ожидание пула). Выше неё воркер
+# перестаёт принимать записи, выше ADMISSION_STATS_SHED_FACTOR * цели - и чтение статистики
+ADMISSION_DB_LATENCY_TARGET = float(os.getenv("ADMISSION_DB_LATENCY_TARGET", "0.1"))
+ADMISSION_STATS_SHED_FACTOR = float(os.getenv("ADMISSION_STATS_SHED_FACTOR", "3"))
+ADMISSION_MAX_RETRY_AFTER = int(os.getenv("ADMISSION_MAX_RETRY_AFTER", "30"))
+# Заголовок с адресом клиента за балансировщиком (например, x-real-ip); по умолчанию - адрес соединения
+ADMISSION_CLIENT_HEADER = os.getenv("ADMISSION_CLIENT_HEADER", "").lower()
+ADMISSION_LOCAL_BUCKETS = int(os.getenv("ADMISSION_LOCAL_BUCKETS", "10000"))
+
+REDIRECT = "redirect"
+STATS = "stats"
+WRITE = "write"
+EXPORT = "export"
+
+# Одиночные сегменты /links/..., которые не являются короткими кодами (см. src/router.py)
+_STATIC_SEGMENTS = {"check_cache", "search", "mine"}
+_WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+class ClassPolicy(NamedTuple):
+    # Одновременных запросов класса на воркер и сколько ждать свободного места (0 - отказ сразу)
+    concurrency: int
+    queue_timeout: float
+    # Токены на клиента в секунду и размер корзины (0 - без ограничения)
+    rate: float
+    burst: int
+
+
+def _policy(route_class: str, concurrency: int, queue_timeout: float, rate: float, burst: int) -> ClassPolicy:
+    prefix = f"ADMISSION_{route_class.upper()}_"
+    return ClassPolicy(
+        concurrency=int(os.getenv(prefix + "CONCURRENCY", str(concurrency))),
+        queue_timeout=float(os.getenv(prefix + "QUEUE_TIMEOUT", str(queue_timeout))),
+        rate=float(os.getenv(prefix + "RATE", str(rate))),
+        burst=int(os.getenv(prefix + "BURST", str(burst))),
+    )
+
+
+# Приоритет: редирект > статистика > запись и выгрузка. Записи получают меньше соединений пула
+# (DB_POOL_SIZE + DB_MAX_OVERFLOW = 10 по умолчанию), чем его размер, и не ждут в очереди.
+# Выгрузка занимает место на всё время отправки потока, поэтому у неё свой небольшой лимит,
+# и медленные клиенты не вытесняют чтение статистики
+POLICIES = {
+    REDIRECT: _policy(REDIRECT, 200, 1.0, 0, 0),
+    STATS: _policy(STATS, 20, 0.5, 50, 100),
+    WRITE: _policy(WRITE, 4, 0, 10, 30),
+    EXPORT: _policy(EXPORT, 4, 0, 0.2, 5),
+}
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    # Класс маршрута до роутинга. Авторизация, админка и мониторинг не ограничиваются
+    if not path.startswith("/links/"):
+        return None
+    if method in _WRITE_METHODS:
+        return WRITE
+    segments = path[len("/links/"):].strip("/").split("/")
+    if len(segments) == 1 and segments[0] and segments[0] not in _STATIC_SEGMENTS:
+        return REDIRECT
+    if segments[-2:] == ["clicks", "export"]:
+        return EXPORT
+    return STATS
+
+
+def db_latency() -> float:
+    return db_statement_latency.value() + db_pool_wait.value()
+
+
+class ConcurrencyLimiter:
+    # Семафор с очередью FIFO и таймаутом ожидания. События создаются в момент ожидания,
+    # поэтому лимитер не привязан к циклу событий (работает и под asyncio, и под trio)
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._waiters: deque[anyio.Event] = deque()
+
+    async def acquire(self, timeout: float) -> bool:
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return True
+        if timeout <= 0:
+            return False
+        event = anyio.Event()
+        self._waiters.append(event)
+        try:
+            with anyio.move_on_after(timeout):
+                await event.wait()
+        except BaseException:
+            # Отмена во время ожидания: место, переданное нам в последний момент, возвращаем
+            if event.is_set():
+                self.release()
+            else:
+                self._waiters.remove(event)
+            raise
+        if event.is_set():
+            return True
+        self._waiters.remove(event)
+        return False
+
+    def release(self) -> None:
+        # Место передаётся первому ожидающему без уменьшения счётчика
+        if self._waiters:
+            self._waiters.popleft().set()
+        else:
+            self.in_flight -= 1
+
+
+# Атомарная корзина токенов в Redis: одно обращение на запрос, время берётся из Redis,
+# чтобы все воркеры считали по одним часам
+_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class TokenBuckets:
+    # Корзины токенов на клиента: общие для воркеров в Redis, при недоступности Redis -
+    # локальные в памяти воркера (ограничение становится мягче в число воркеров раз)
+
+    def __init__(self, max_local: int = 10000, key_prefix: str = "admission"):
+        self.max_local = max_local
+        self.key_prefix = key_prefix
+        self.redis = None
+        self._local: OrderedDict[tuple[str, str], tuple[float, float]] = OrderedDict()
+
+    async def take(self, route_class: str, client: str, rate: float, burst: int) -> float:
+        # 0 - токен выдан, иначе через сколько секунд появится следующий
+        if self.redis is not None:
+            try:
+                wait = await self.redis.eval(
+                    _TOKEN_BUCKET_SCRIPT, 1, f"{self.key_prefix}:{route_class}:{client}", rate, burst
+                )
+                return float(wait)
+            except Exception:
+                logger.warning("Не удалось проверить лимит %s в Redis", client, exc_info=True)
+        return self._take_local(route_class, client, rate, burst)
+
+    def _take_local(self, route_class: str, client: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        key = (route_class, client)
+        tokens, updated = self._local.pop(key, (float(burst), now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        self._local[key] = (tokens, now)
+        if len(self._local) > self.max_local:
+            self._local.popitem(last=False)
+        return wait
+
+    def clear(self) -> None:
+        self._local.clear()
+
+
+class Rejection(NamedTuple):
+    status: int
+    reason: str
+    retry_after: int
+    detail: str
+
+
+class AdmissionController:
+
+    def __init__(self, policies: dict[str, ClassPolicy], buckets: TokenBuckets):
+        self.policies = policies
+        self.buckets = buckets
+        self.limiters = {name: ConcurrencyLimiter(policy.concurrency) for name, policy in policies.items()}
+        self.rejected: dict[str, int] = {}
+
+    def stats(self) -> dict:
+        return {
+            "enabled": ADMISSION_ENABLED,
+            "db_latency": db_latency(),
+            "db_latency_target": ADMISSION_DB_LATENCY_TARGET,
+            "in_flight": {name: limiter.in_flight for name, limiter in self.limiters.items()},
+            "rejected": dict(self.rejected),
+        }
+
+    def reset(self) -> None:
+        self.buckets.clear()
+        self.rejected.clear()
+        db_statement_latency.reset()
+        db_pool_wait.reset()
+
+    def _latency_shed(self, route_class: str) -> Optional[Rejection]:
+        # Записи и выгрузки отсекаются первыми, статистика - при кратно большей задержке, редиректы - никогда
+        if route_class == REDIRECT:
+            return None
+        latency = db_latency()
+        threshold = ADMISSION_DB_LATENCY_TARGET
+        if route_class == STATS:
+            threshold *= ADMISSION_STATS_SHED_FACTOR
+        if latency <= threshold:
+            return None
+        # Чем сильнее перегружена БД, тем дольше клиенту стоит подождать
+        retry_after = min(ADMISSION_MAX_RETRY_AFTER, math.ceil(latency / threshold))
+        if route_class == WRITE:
+            return Rejection(429, "db_latency", retry_after, "Сервис перегружен, повторите запрос позже.")
+        return Rejection(503, "db_latency", retry_after, "Сервис перегружен, повторите запрос позже.")
+
+    async def admit(self, route_class: str, client: str) -> Optional[Rejection]:
+        policy = self.policies[route_class]
+        rejection = self._latency_shed(route_class)
+        if rejection is None and policy.rate > 0:
+            wait = await self.buckets.take(route_class, client, policy.rate, policy.burst)
+            if wait > 0:
+                rejection = Rejection(
+                    429, "rate_limit", min(ADMISSION_MAX_RETRY_AFTER, math.ceil(wait)),
+                    "Слишком много запросов, повторите позже.",
+                )
+        if rejection is None and not await self.limiters[route_class].acquire(policy.queue_timeout):
+            rejection = Rejection(
+                429 if route_class == WRITE else 503, "concurrency", 1,
+                "Сервис перегружен, повторите запрос позже.",
+            )
+        if rejection is not None:
+            self.rejected[route_class] = self.rejected.get(route_class, 0) + 1
+            ADMISSION_REJECTED.labels(route_class, rejection.reason).inc()
+        return rejection
+
+    def release(self, route_class: str) -> None:
+        self.limiters[route_class].release()
+
+
+admission_controller = AdmissionController(POLICIES, TokenBuckets(ADMISSION_LOCAL_BUCKETS))
+
+
+def client_key(scope) -> str:
+    if ADMISSION_CLIENT_HEADER:
+        for name, value in scope.get("headers", []):
+            if name.decode("latin-1") == ADMISSION_CLIENT_HEADER:
+                # X-Forwarded-For: первый адрес в цепочке - исходный клиент
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+class AdmissionMiddleware:
+    # Контроль допуска до роутинга и открытия сессии БД: отказ не занимает соединение из пула
+
+    def __init__(self, app, controller: AdmissionController = admission_controller):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ADMISSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        route_class = classify(scope["method"], scope["path"])
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        rejection = await self.controller.admit(route_class, client_key(scope))
+        if rejection is not None:
+            await _reject(send, rejection)
+            return
+        ADMISSION_IN_FLIGHT.labels(route_class).inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            ADMISSION_IN_FLIGHT.labels(route_class).dec()
+            self.controller.release(route_class)
+
+
+async def _reject(send, rejection: Rejection) -> None:
+    body = json.dumps({"detail": rejection.detail}, ensure_ascii=False).encode()
+    await send({
+        "type": "http.response.start",
+        "status": rejection.status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(rejection.retry_after).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,118 @@
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+import jwt
+from fastapi_users import exceptions, models
+from fastapi_users.authentication import JWTStrategy
+from fastapi_users.jwt import decode_jwt, generate_jwt
+from fastapi_users.manager import BaseUserManager
+
+from src.invalidation import invalidation_bus
+from src.models import User
+
+# Поля пользователя, которые хранятся в кэше и из которых собирается снимок
+USER_FIELDS = ("id", "email", "hashed_password", "is_active", "is_superuser", "is_verified")
+# Флаги, которые в режиме claims-only кладутся прямо в токен
+FLAG_CLAIMS = ("is_active", "is_superuser", "is_verified")
+
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+# Режим claims-only: пользователь собирается из токена без похода в БД,
+# деактивация вступает в силу только после истечения токена
+AUTH_CLAIMS_ONLY = os.getenv("AUTH_CLAIMS_ONLY", "false").lower() in ("1", "true", "yes")
+# Канал рассылки вытеснений пользователей из кэшей воркеров
+INVALIDATION_CHANNEL = "users"
+
+
+class UserCache:
+    # LRU с коротким TTL: id пользователя -> его поля. Кэш локальный для воркера,
+    # изменение или удаление пользователя рассылается остальным воркерам через Redis pub/sub
+    # (если сообщение потеряно, запись всё равно доживёт не дольше ttl секунд)
+
+    def __init__(self, max_size: int = 10000, ttl: float = 30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: OrderedDict[uuid.UUID, tuple[float, dict]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        return {"size": len(self._items), "hits": self.hits, "misses": self.misses}
+
+    def get(self, user_id: uuid.UUID) -> Optional[User]:
+        item = self._items.get(user_id)
+        if item is None or item[0] < time.monotonic():
+            self._items.pop(user_id, None)
+            self.misses += 1
+            return None
+        self._items.move_to_end(user_id)
+        self.hits += 1
+        # Каждый запрос получает свой transient-объект, не привязанный к сессии
+        return User(**item[1])
+
+    def set(self, user: User) -> None:
+        if self.ttl <= 0:
+            return
+        self._items[user.id] = (time.monotonic() + self.ttl, {field: getattr(user, field) for field in USER_FIELDS})
+        self._items.move_to_end(user.id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def evict_local(self, user_ids: list) -> None:
+        for user_id in user_ids:
+            self._items.pop(uuid.UUID(str(user_id)), None)
+
+    async def invalidate(self, user_id: uuid.UUID) -> None:
+        self.evict_local([user_id])
+        await invalidation_bus.publish(INVALIDATION_CHANNEL, [str(user_id)])
+
+    def clear(self) -> None:
+        self._items.clear()
+
+
+user_cache = UserCache(max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+invalidation_bus.subscribe(INVALIDATION_CHANNEL, user_cache.evict_local)
+
+
+class CachedJWTStrategy(JWTStrategy[models.UP, models.ID]):
+    # JWT-стратегия, которая не загружает пользователя из БД на каждый запрос
+
+    def __init__(self, *args, claims_only: Optional[bool] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.claims_only = AUTH_CLAIMS_ONLY if claims_only is None else claims_only
+
+    async def read_token(
+        self, token: Optional[str], user_manager: BaseUserManager[models.UP, models.ID]
+    ) -> Optional[models.UP]:
+        if token is None:
+            return None
+        try:
+            data = decode_jwt(token, self.decode_key, self.token_audience, algorithms=[self.algorithm])
+            if data.get("sub") is None:
+                return None
+            user_id = user_manager.parse_id(data["sub"])
+        except (jwt.PyJWTError, exceptions.InvalidID):
+            return None
+
+        # Токены, выпущенные до включения claims-only, флагов не содержат и идут обычным путём
+        if self.claims_only and all(claim in data for claim in FLAG_CLAIMS):
+            return User(id=user_id, **{claim: bool(data[claim]) for claim in FLAG_CLAIMS})
+
+        user = user_cache.get(user_id)
+        if user is not None:
+            return user
+        try:
+            user = await user_manager.get(user_id)
+        except exceptions.UserNotExists:
+            return None
+        user_cache.set(user)
+        return user
+
+    async def write_token(self, user: models.UP) -> str:
+        data = {"sub": str(user.id), "aud": self.token_audience}
+        if self.claims_only:
+            data.update({claim: getattr(user, claim) for claim in FLAG_CLAIMS})
+        return generate_jwt(data, self.encode_key, self.lifetime_seconds, algorithm=self.algorithm)
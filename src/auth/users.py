@@ -12,6 +12,7 @@ from fastapi_users.db import SQLAlchemyUserDatabase
 
 from src.models import User
 from src.auth.db import get_user_db
+from src.auth.cache import CachedJWTStrategy, user_cache
 
 SECRET = "SECRET"
 
@@ -33,6 +34,13 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
     ):
         print(f"Verification requested for user {user.id}. Verification token: {token}")
 
+    # Изменённый или удалённый пользователь не должен дальше отдаваться из кэша
+    async def on_after_update(self, user: User, update_dict: dict, request: Optional[Request] = None):
+        await user_cache.invalidate(user.id)
+
+    async def on_after_delete(self, user: User, request: Optional[Request] = None):
+        await user_cache.invalidate(user.id)
+
 
 async def get_user_manager(user_db: SQLAlchemyUserDatabase = Depends(get_user_db)):
     yield UserManager(user_db)
@@ -42,7 +50,7 @@ bearer_transport = BearerTransport(tokenUrl="auth/jwt/login")
 
 
 def get_jwt_strategy() -> JWTStrategy[models.UP, models.ID]:
-    return JWTStrategy(secret=SECRET, lifetime_seconds=3600)
+    return CachedJWTStrategy(secret=SECRET, lifetime_seconds=3600)
 
 
 auth_backend = AuthenticationBackend(
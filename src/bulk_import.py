@@ -0,0 +1,403 @@
+import argparse
+import asyncio
+import codecs
+import csv
+import json
+import logging
+import os
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import AsyncIterator, Callable, Optional
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import delete, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.codegen import code_generator, CODE_GENERATION_ATTEMPTS
+from src.database import dialect_insert, get_session_maker
+from src.lookup_cache import lookup_cache
+from src.models import ImportJob, ImportRowError, ImportStaging, Url
+from src.schemas import URLCreate
+from src.url_keys import url_columns
+from src.validation import validate_new_url
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+FORMATS = ("csv", "ndjson")
+STAGING_COLUMNS = [
+    "job_id", "line_no", "full_url", "short_url", "generated", "expires_at",
+    "normalized_url", "full_url_hash", "url_host", "url_path",
+]
+# Колонки urls, которые заполняются из промежуточной таблицы
+MERGED_COLUMNS = [
+    "full_url", "short_url", "expires_at", "normalized_url", "full_url_hash", "url_host", "url_path",
+]
+CONFLICT_REASON = "Указанный alias уже существует."
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    # Построчное чтение потока байтов (тело запроса) без загрузки файла целиком
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+
+class _LineFeed:
+    # Источник строк для csv.reader, который пополняется по мере чтения потока
+
+    def __init__(self):
+        self.lines: deque[str] = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+
+async def iter_csv_rows(lines: AsyncIterator[str]) -> AsyncIterator[list[str]]:
+    # Один csv.reader на весь поток. Поле в кавычках может содержать перевод строки, поэтому
+    # reader получает физические строки только целой записью - когда в ней закрыты все кавычки
+    feed = _LineFeed()
+    reader = csv.reader(feed)
+    record: list[str] = []
+    quotes = 0
+    async for line in lines:
+        if not record and not line.strip():
+            continue
+        record.append(line + "\n")
+        quotes += line.count('"')
+        if quotes % 2:
+            continue
+        feed.lines.extend(record)
+        record, quotes = [], 0
+        yield next(reader)
+    if record:
+        # Незакрытая кавычка в конце файла: запись разбирается как есть
+        feed.lines.extend(record)
+        yield next(reader)
+
+
+async def iter_records(
+    lines: AsyncIterator[str], format: str
+) -> AsyncIterator[tuple[int, Optional[dict], Optional[str]]]:
+    # (номер записи, запись, ошибка разбора). Пустые строки не нумеруются,
+    # чтобы при продолжении импорта номера совпадали
+    header = None
+    line_no = 0
+    if format == "csv":
+        async for values in iter_csv_rows(lines):
+            if header is None:
+                header = ["custom_alias" if name.strip() == "alias" else name.strip() for name in values]
+                continue
+            line_no += 1
+            yield line_no, dict(zip(header, values)), None
+        return
+    async for line in lines:
+        if not line.strip():
+            continue
+        line_no += 1
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError(line)
+        except ValueError:
+            yield line_no, None, "Строка не является JSON-объектом."
+            continue
+        if "alias" in record and "custom_alias" not in record:
+            record["custom_alias"] = record.pop("alias")
+        yield line_no, record, None
+
+
+def validate_record(record: dict) -> tuple[URLCreate, Optional[datetime]]:
+    # Те же правила, что и у POST /links/shorten
+    try:
+        new_url = URLCreate(
+            full_url=record.get("full_url") or "",
+            custom_alias=record.get("custom_alias") or None,
+            expires_at=record.get("expires_at") or None,
+        )
+    except ValidationError:
+        raise HTTPException(status_code=400, detail="Неверный формат строки.")
+    return new_url, validate_new_url(new_url)
+
+
+async def _stage(session: AsyncSession, rows: list[dict]) -> None:
+    if session.bind.dialect.name == "postgresql":
+        # COPY в промежуточную таблицу внутри текущей транзакции сессии
+        connection = await (await session.connection()).get_raw_connection()
+        await connection.driver_connection.copy_records_to_table(
+            ImportStaging.__tablename__,
+            records=[tuple(row[column] for column in STAGING_COLUMNS) for row in rows],
+            columns=STAGING_COLUMNS,
+        )
+    else:
+        await session.execute(dialect_insert(session, ImportStaging), rows)
+
+
+async def _merge(
+    session: AsyncSession, job: ImportJob, first: int, last: int, line_nos: Optional[list[int]] = None
+) -> set[str]:
+    # Слияние пачки (или отдельных её строк) в urls одним INSERT ... SELECT,
+    # занятые коды пропускаются через ON CONFLICT
+    staged = (
+        select(
+            *(getattr(ImportStaging, column) for column in MERGED_COLUMNS),
+            literal(datetime.now(), Url.creation_time.type),
+            literal(job.creator_id, Url.creator_id.type),
+        )
+        .where(ImportStaging.job_id == job.id, ImportStaging.line_no >= first, ImportStaging.line_no <= last)
+        .order_by(ImportStaging.line_no)
+    )
+    if line_nos is not None:
+        staged = staged.where(ImportStaging.line_no.in_(line_nos))
+    stmt = (
+        dialect_insert(session, Url)
+        .from_select(MERGED_COLUMNS + ["creation_time", "creator_id"], staged)
+        .on_conflict_do_nothing(index_elements=[Url.short_url])
+        .returning(Url.short_url)
+    )
+    return set((await session.execute(stmt)).scalars().all())
+
+
+async def _process_batch(job: ImportJob, batch: list[tuple[int, Optional[dict], Optional[str]]]) -> dict:
+    errors: list[dict] = []
+    prepared = []
+    for line_no, record, error in batch:
+        if error is None:
+            try:
+                new_url, expires_at = validate_record(record)
+                prepared.append((line_no, new_url, expires_at))
+                continue
+            except HTTPException as e:
+                error = e.detail
+        errors.append({"job_id": job.id, "line_no": line_no, "reason": error, "short_url": None})
+    invalid = len(errors)
+
+    generated = iter(await code_generator.next_codes(sum(1 for _, new_url, _ in prepared if not new_url.custom_alias)))
+    rows = [
+        {
+            "job_id": job.id,
+            "line_no": line_no,
+            "full_url": new_url.full_url,
+            "short_url": new_url.custom_alias or next(generated),
+            "generated": not new_url.custom_alias,
+            "expires_at": expires_at,
+            **url_columns(new_url.full_url),
+        }
+        for line_no, new_url, expires_at in prepared
+    ]
+    first, last = batch[0][0], batch[-1][0]
+
+    async with get_session_maker()() as session:
+        # Остатки пачки после сбоя убираем первым запросом: он же открывает транзакцию
+        # в драйвере, без неё COPY asyncpg зафиксировался бы сам по себе
+        await session.execute(
+            delete(ImportStaging).where(ImportStaging.job_id == job.id, ImportStaging.line_no >= first)
+        )
+        inserted: set[str] = set()
+        if rows:
+            await _stage(session, rows)
+            inserted = await _merge(session, job, first, last)
+        # Повтор кода внутри файла: строка с меньшим номером побеждает, остальные - конфликты.
+        # Конфликт бывает только у alias'а из файла: сгенерированный код, совпавший с занятым,
+        # перевыпускается, как в POST /links/shorten
+        claimed: set[str] = set()
+        pending = rows
+        for attempt in range(CODE_GENERATION_ATTEMPTS):
+            reissue = []
+            for row in pending:
+                if row["short_url"] in inserted and row["short_url"] not in claimed:
+                    claimed.add(row["short_url"])
+                elif row["generated"]:
+                    reissue.append(row)
+                else:
+                    errors.append({"job_id": job.id, "line_no": row["line_no"], "reason": CONFLICT_REASON, "short_url": row["short_url"]})
+            if not reissue:
+                break
+            if attempt == CODE_GENERATION_ATTEMPTS - 1:
+                raise RuntimeError("Не удалось сгенерировать уникальный короткий URL.")
+            for row, code in zip(reissue, await code_generator.next_codes(len(reissue))):
+                row["short_url"] = code
+            # Новые коды в промежуточной таблице одним UPDATE по первичному ключу
+            await session.execute(
+                update(ImportStaging),
+                [{"job_id": job.id, "line_no": row["line_no"], "short_url": row["short_url"]} for row in reissue],
+            )
+            inserted |= await _merge(session, job, first, last, [row["line_no"] for row in reissue])
+            pending = reissue
+        if errors:
+            await session.execute(
+                dialect_insert(session, ImportRowError).on_conflict_do_nothing(
+                    index_elements=[ImportRowError.job_id, ImportRowError.line_no]
+                ),
+                errors,
+            )
+        await session.execute(
+            delete(ImportStaging).where(ImportStaging.job_id == job.id, ImportStaging.line_no <= last)
+        )
+        # Прогресс фиксируется в той же транзакции, что и ссылки: после сбоя пачка либо целиком
+        # применена и учтена в rows_processed, либо не применена вовсе
+        await session.execute(
+            update(ImportJob)
+            .where(ImportJob.id == job.id)
+            .values(
+                rows_processed=last,
+                imported=ImportJob.imported + len(inserted),
+                conflicts=ImportJob.conflicts + len(errors) - invalid,
+                invalid=ImportJob.invalid + invalid,
+                updated_at=datetime.now(),
+            )
+        )
+        await session.commit()
+
+    # Новые коды могли быть закэшированы как несуществующие. Кэш поиска не чистится:
+    # на миллионах строк это дороже, чем дождаться истечения его TTL
+    if inserted:
+        await lookup_cache.invalidate(*inserted)
+    return {"imported": len(inserted), "conflicts": len(errors) - invalid, "invalid": invalid}
+
+
+async def _start_job(job_id: Optional[str], format: str, source: Optional[str], creator_id) -> ImportJob:
+    async with get_session_maker()() as session:
+        job = await session.get(ImportJob, job_id) if job_id else None
+        if job is None:
+            now = datetime.now()
+            job = ImportJob(
+                id=job_id or uuid.uuid4().hex,
+                source=source,
+                format=format,
+                status="running",
+                creator_id=creator_id,
+                rows_processed=0,
+                imported=0,
+                conflicts=0,
+                invalid=0,
+                created_at=now,
+                updated_at=now,
+            )
+            session.add(job)
+        elif job.status != "completed":
+            job.status = "running"
+            job.error = None
+        await session.commit()
+        return job
+
+
+async def _finish_job(job_id: str, status: str, error: Optional[str] = None) -> ImportJob:
+    async with get_session_maker()() as session:
+        job = await session.get(ImportJob, job_id)
+        job.status = status
+        job.error = error
+        job.updated_at = datetime.now()
+        await session.commit()
+        return job
+
+
+def job_summary(job: ImportJob) -> dict:
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "source": job.source,
+        "format": job.format,
+        "rows_processed": job.rows_processed,
+        "imported": job.imported,
+        "conflicts": job.conflicts,
+        "invalid": job.invalid,
+        "error": job.error,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    }
+
+
+async def run_import(
+    lines: AsyncIterator[str],
+    format: str,
+    job_id: Optional[str] = None,
+    source: Optional[str] = None,
+    creator_id=None,
+    batch_size: int = IMPORT_BATCH_SIZE,
+    progress: Optional[Callable[[ImportJob], None]] = None,
+) -> dict:
+    # Потоковый импорт пачками. Повторный запуск с тем же job_id и тем же файлом
+    # пропускает уже обработанные строки и продолжает с места сбоя
+    job = await _start_job(job_id, format, source, creator_id)
+    if job.status == "completed":
+        return job_summary(job)
+
+    batch = []
+    try:
+        async for item in iter_records(lines, format):
+            if item[0] <= job.rows_processed:
+                continue
+            batch.append(item)
+            if len(batch) >= batch_size:
+                await _process_batch(job, batch)
+                batch = []
+                if progress:
+                    progress(await _reload(job.id))
+        if batch:
+            await _process_batch(job, batch)
+    except Exception as e:
+        await _finish_job(job.id, "failed", str(e))
+        raise
+    job = await _finish_job(job.id, "completed")
+    if progress:
+        progress(job)
+    return job_summary(job)
+
+
+async def _reload(job_id: str) -> ImportJob:
+    async with get_session_maker()() as session:
+        return await session.get(ImportJob, job_id)
+
+
+async def _file_lines(path: str) -> AsyncIterator[str]:
+    with open(path, encoding="utf-8-sig") as file:
+        for line in file:
+            yield line.rstrip("\r\n")
+
+
+async def _main(args) -> None:
+    format = args.format or ("ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv")
+
+    def progress(job: ImportJob) -> None:
+        print(
+            f"[{job.id}] обработано строк: {job.rows_processed}, импортировано: {job.imported}, "
+            f"конфликтов: {job.conflicts}, с ошибками: {job.invalid}"
+        )
+
+    summary = await run_import(
+        _file_lines(args.path),
+        format,
+        job_id=args.job_id,
+        source=os.path.basename(args.path),
+        creator_id=uuid.UUID(args.creator_id) if args.creator_id else None,
+        batch_size=args.batch_size,
+        progress=progress,
+    )
+    print(f"Импорт {summary['job_id']} завершён со статусом {summary['status']}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Массовый импорт ссылок из CSV или NDJSON (full_url, custom_alias, expires_at)")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="по умолчанию - по расширению файла")
+    parser.add_argument("--job-id", default=None, help="продолжить прерванный импорт")
+    parser.add_argument("--creator-id", default=None)
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(args))
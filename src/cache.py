@@ -0,0 +1,110 @@
+import logging
+import time
+from collections import Counter
+from hashlib import sha256
+from typing import Any, Callable, Optional
+
+from fastapi_cache import FastAPICache
+from fastapi_cache.types import Backend
+
+from src.lookup_cache import lookup_cache
+from src.metrics import CACHE_DURATION, CACHE_REQUESTS
+from src.url_keys import normalize_url
+
+logger = logging.getLogger(__name__)
+
+# Неймспейсы кэшируемых ручек
+SEARCH_NAMESPACE = "search"
+STATS_NAMESPACE = "stats"
+
+
+def _digest(value: Optional[str]) -> str:
+    return sha256((value or "").encode("utf-8")).hexdigest()[:32]
+
+
+def cache_key(namespace: str, value: Optional[str] = None) -> str:
+    return f"{FastAPICache.get_prefix()}:{namespace}:{_digest(value)}"
+
+
+def key_by(arg_name: Optional[str] = None, transform: Optional[Callable[[str], str]] = None) -> Callable[..., str]:
+    # Ключ строится только по смысловому аргументу ручки (short_url, full_url),
+    # сессия БД и прочие зависимости в ключ не попадают.
+    # transform приводит значение к канонической форме, чтобы эквивалентные запросы делили ключ
+    def builder(
+        func: Callable[..., Any],
+        namespace: str = "",
+        *,
+        request=None,
+        response=None,
+        args: tuple = (),
+        kwargs: dict,
+    ) -> str:
+        value = kwargs.get(arg_name) if arg_name else None
+        if transform and value is not None:
+            value = transform(value)
+        return f"{namespace}:{_digest(value)}"
+
+    return builder
+
+
+async def invalidate_links(short_urls=(), full_urls=()) -> None:
+    # Удаляем только ключи, которые касаются изменённых ссылок
+    keys = [cache_key(STATS_NAMESPACE, short_url) for short_url in short_urls]
+    keys += [cache_key(SEARCH_NAMESPACE, normalized) for normalized in {normalize_url(url) for url in full_urls}]
+
+    backend = FastAPICache.get_backend()
+    for key in keys:
+        try:
+            await backend.clear(key=key)
+        except Exception:
+            logger.warning("Не удалось удалить ключ %s из кэша", key, exc_info=True)
+
+    await lookup_cache.invalidate(*short_urls)
+
+
+class CountingBackend(Backend):
+    # Обёртка над бэкендом fastapi-cache, считающая попадания и промахи по неймспейсам
+
+    def __init__(self, backend: Backend):
+        self.backend = backend
+        self.hits: Counter = Counter()
+        self.misses: Counter = Counter()
+
+    @staticmethod
+    def _namespace(key: str) -> str:
+        parts = key.split(":")
+        return parts[1] if len(parts) > 2 else ""
+
+    def _count(self, key: str, value, started: float) -> None:
+        namespace = self._namespace(key)
+        if value is None:
+            self.misses[namespace] += 1
+        else:
+            self.hits[namespace] += 1
+        CACHE_REQUESTS.labels(namespace, "miss" if value is None else "hit").inc()
+        CACHE_DURATION.labels(namespace).observe(time.perf_counter() - started)
+
+    def stats(self) -> dict:
+        namespaces = sorted(set(self.hits) | set(self.misses))
+        return {
+            namespace: {"hits": self.hits[namespace], "misses": self.misses[namespace]}
+            for namespace in namespaces
+        }
+
+    async def get_with_ttl(self, key: str):
+        started = time.perf_counter()
+        ttl, value = await self.backend.get_with_ttl(key)
+        self._count(key, value, started)
+        return ttl, value
+
+    async def get(self, key: str):
+        started = time.perf_counter()
+        value = await self.backend.get(key)
+        self._count(key, value, started)
+        return value
+
+    async def set(self, key: str, value, expire: Optional[int] = None) -> None:
+        await self.backend.set(key, value, expire)
+
+    async def clear(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        return await self.backend.clear(namespace, key)
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.counters import apply_clicks
+from src.database import get_session_maker
+from src.models import Query, Url
+from src.rollups import apply_rollups
+
+logger = logging.getLogger(__name__)
+
+# Маркер остановки в очереди буфера: фоновая задача сбрасывает текущую пачку и завершается
+_STOP = object()
+
+
+async def write_clicks(session: AsyncSession, clicks: list[dict]) -> None:
+    # Один многострочный INSERT на всю пачку переходов, счётчики и агрегаты по времени
+    # обновляются в той же транзакции
+    if not clicks:
+        return
+    await session.execute(insert(Query).values(clicks))
+    await apply_clicks(session, clicks)
+    await apply_rollups(session, clicks)
+
+
+async def existing_clicks(session: AsyncSession, clicks: list[dict]) -> list[dict]:
+    # Оставляем переходы только по существующим ссылкам и подставляем актуальный short_url
+    # (ссылку могли удалить или переименовать, пока переход ждал в очереди)
+    url_ids = {click["url_id"] for click in clicks}
+    result = await session.execute(select(Url.id, Url.short_url).where(Url.id.in_(url_ids)))
+    short_urls = dict(result.all())
+    return [
+        {**click, "short_url": short_urls[click["url_id"]]}
+        for click in clicks
+        if click["url_id"] in short_urls
+    ]
+
+
+class ClickBuffer:
+    # Буфер переходов по коротким ссылкам (один на воркер).
+    # Редирект кладёт переход в очередь и сразу отвечает, а фоновая задача
+    # сбрасывает накопленное в таблицу queries пачками: по размеру пачки или по таймеру.
+    # Очередь ограничена, при переполнении переходы отбрасываются и считаются в dropped.
+
+    def __init__(
+        self,
+        max_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+    ):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop_requested = False
+        self.accepted = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.failed_flushes = 0
+        self.orphaned = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "accepted": self.accepted,
+            "dropped": self.dropped,
+            "flushed": self.flushed,
+            "failed_flushes": self.failed_flushes,
+            "orphaned": self.orphaned,
+        }
+
+    def add(self, click: dict) -> bool:
+        try:
+            self._queue.put_nowait(click)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self.accepted += 1
+        return True
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        # Просим фоновую задачу сбросить накопленную пачку и завершиться (текущий сброс
+        # при этом дорабатывает до конца), затем сбрасываем всё, что осталось в очереди
+        if self._task is None:
+            return
+        if not self._task.done():
+            await self._queue.put(_STOP)
+            await self._task
+        self._task = None
+        self._stop_requested = False
+        while not self._queue.empty():
+            await self._flush(self._drain(self.batch_size))
+
+    def _drain(self, limit: int) -> list[dict]:
+        batch = []
+        while len(batch) < limit and not self._queue.empty():
+            click = self._queue.get_nowait()
+            if click is _STOP:
+                self._stop_requested = True
+                break
+            batch.append(click)
+        return batch
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while not self._stop_requested:
+            first = await self._queue.get()
+            if first is _STOP:
+                return
+            batch = [first]
+            deadline = loop.time() + self.flush_interval
+            # Копим пачку, пока она не наполнится, не выйдет время или не придёт остановка
+            while len(batch) < self.batch_size and not self._stop_requested:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    click = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if click is _STOP:
+                    self._stop_requested = True
+                    break
+                batch.append(click)
+                batch.extend(self._drain(self.batch_size - len(batch)))
+            await self._flush(batch)
+
+    async def _write(self, batch: list[dict], only_existing: bool = False) -> int:
+        async with get_session_maker()() as session:
+            if only_existing:
+                batch = await existing_clicks(session, batch)
+            await write_clicks(session, batch)
+            await session.commit()
+        return len(batch)
+
+    async def _flush(self, batch: list[dict]) -> None:
+        if not batch:
+            return
+        try:
+            try:
+                written = await self._write(batch)
+            except IntegrityError:
+                # Внешние ключи отвергли пачку: повторяем без переходов по удалённым ссылкам,
+                # чтобы из-за одной ссылки не терять переходы по всем остальным
+                written = await self._write(batch, only_existing=True)
+            self.flushed += written
+            self.orphaned += len(batch) - written
+        except Exception:
+            # БД недоступна или тормозит: пачку теряем, но не копим память бесконечно
+            self.failed_flushes += 1
+            self.dropped += len(batch)
+            logger.exception("Не удалось сохранить %d переходов", len(batch))
+
+
+click_buffer = ClickBuffer(
+    max_size=int(os.getenv("CLICK_BUFFER_SIZE", "10000")),
+    batch_size=int(os.getenv("CLICK_BATCH_SIZE", "500")),
+    flush_interval=float(os.getenv("CLICK_FLUSH_INTERVAL", "1.0")),
+)
+
+
+def make_click(url_id: int, full_url: str, short_url: str) -> dict:
+    return {
+        "url_id": url_id,
+        "full_url": full_url,
+        "short_url": short_url,
+        "access_time": datetime.now(),
+    }
@@ -0,0 +1,149 @@
+import logging
+import os
+import uuid
+from collections import deque
+from hashlib import sha256
+from typing import Optional
+
+from src.database import dialect_insert, get_session_maker
+from src.models import CodeAllocator
+
+logger = logging.getLogger(__name__)
+
+BASE62_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+# Сколько раз перевыпускается сгенерированный код, совпавший с чужим кастомным alias'ом
+CODE_GENERATION_ATTEMPTS = 3
+
+
+def encode_base62(value: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        value, rem = divmod(value, 62)
+        chars.append(BASE62_ALPHABET[rem])
+    if value:
+        raise ValueError("Значение не помещается в код заданной длины.")
+    return "".join(reversed(chars))
+
+
+class FeistelPermutation:
+    # Биекция на [0, domain): сеть Фейстеля по битам + cycle-walking,
+    # чтобы последовательные номера превращались в неугадываемые коды
+
+    def __init__(self, domain: int, key: str, rounds: int = 4):
+        self.domain = domain
+        self.half_bits = ((domain - 1).bit_length() + 1) // 2
+        self.mask = (1 << self.half_bits) - 1
+        self.keys = [sha256(f"{key}:{i}".encode("utf-8")).digest() for i in range(rounds)]
+
+    def _round(self, value: int, key: bytes) -> int:
+        digest = sha256(key + value.to_bytes(16, "big")).digest()
+        return int.from_bytes(digest[:16], "big") & self.mask
+
+    def _encrypt(self, value: int) -> int:
+        left, right = value >> self.half_bits, value & self.mask
+        for key in self.keys:
+            left, right = right, left ^ self._round(right, key)
+        return (left << self.half_bits) | right
+
+    def __call__(self, value: int) -> int:
+        value = self._encrypt(value)
+        while value >= self.domain:
+            value = self._encrypt(value)
+        return value
+
+
+class CodeGenerator:
+    # Базовый класс генераторов коротких кодов
+
+    def __init__(self, length: int):
+        self.length = length
+
+    async def next_codes(self, count: int) -> list[str]:
+        raise NotImplementedError
+
+    async def next_code(self) -> str:
+        return (await self.next_codes(1))[0]
+
+
+class RandomCodeGenerator(CodeGenerator):
+    # Случайные коды (соленый хэш), коллизии ловятся уникальным индексом при вставке
+
+    async def next_codes(self, count: int) -> list[str]:
+        return [sha256(uuid.uuid4().hex.encode("utf-8")).hexdigest()[:self.length] for _ in range(count)]
+
+
+class CounterCodeGenerator(CodeGenerator):
+    # Коды из счётчика в base62. Каждый воркер заранее резервирует в БД блок номеров
+    # и выдаёт коды из него без обращений к БД, поэтому воркеры не конкурируют между собой.
+
+    def __init__(self, length: int, block_size: int = 1000, scramble_key: Optional[str] = None, name: str = "urls"):
+        super().__init__(length)
+        self.block_size = block_size
+        self.name = name
+        self.domain = 62 ** length
+        self.permutation = FeistelPermutation(self.domain, scramble_key) if scramble_key else None
+        self._ranges: deque = deque()
+
+    async def _reserve(self, size: int) -> None:
+        # Один upsert на блок: сдвигаем счётчик и получаем конец зарезервированного диапазона
+        async with get_session_maker()() as session:
+            stmt = dialect_insert(session, CodeAllocator).values(name=self.name, next_value=size)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[CodeAllocator.name],
+                set_={"next_value": CodeAllocator.next_value + stmt.excluded.next_value},
+            ).returning(CodeAllocator.next_value)
+            end = (await session.execute(stmt)).scalar_one()
+            await session.commit()
+        if end > self.domain:
+            raise RuntimeError("Исчерпано пространство коротких кодов заданной длины.")
+        self._ranges.append([end - size, end])
+
+    def _take(self, count: int) -> list[int]:
+        values = []
+        while self._ranges and len(values) < count:
+            current = self._ranges[0]
+            taken = min(count - len(values), current[1] - current[0])
+            values.extend(range(current[0], current[0] + taken))
+            current[0] += taken
+            if current[0] == current[1]:
+                self._ranges.popleft()
+        return values
+
+    def _encode(self, value: int) -> str:
+        if self.permutation:
+            value = self.permutation(value)
+        return encode_base62(value, self.length)
+
+    async def next_codes(self, count: int) -> list[str]:
+        # Номера выдаются синхронно между await'ами, поэтому конкурентные запросы
+        # воркера не получат один и тот же номер
+        values = self._take(count)
+        while len(values) < count:
+            await self._reserve(max(self.block_size, count - len(values)))
+            values.extend(self._take(count - len(values)))
+        return [self._encode(value) for value in values]
+
+
+def build_code_generator() -> CodeGenerator:
+    length = int(os.getenv("SHORT_CODE_LENGTH", "10"))
+    if os.getenv("SHORT_CODE_GENERATOR", "counter") == "random":
+        return RandomCodeGenerator(length)
+    # Ключ перемешивания - секрет: зная его, коды можно обратить и перебрать по порядку,
+    # поэтому значения по умолчанию нет. Без ключа счётчик выдавал бы коды по порядку,
+    # так что вместо него используются случайные коды
+    scramble_key = os.getenv("SHORT_CODE_SCRAMBLE_KEY")
+    if not scramble_key:
+        logger.warning(
+            "SHORT_CODE_SCRAMBLE_KEY не задан: вместо кодов из счётчика выдаются случайные. "
+            "Задайте секретный ключ в окружении, чтобы включить генератор на счётчике."
+        )
+        return RandomCodeGenerator(length)
+    return CounterCodeGenerator(
+        length,
+        block_size=int(os.getenv("SHORT_CODE_BLOCK_SIZE", "1000")),
+        scramble_key=scramble_key,
+    )
+
+
+code_generator = build_code_generator()
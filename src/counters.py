@@ -0,0 +1,115 @@
+import argparse
+import asyncio
+from typing import Optional
+
+from sqlalchemy import case, delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database import dialect_insert, get_session_maker
+from src.models import Query, Url, UrlStats
+from src.partitions import RETENTION_MONTHS
+
+# Счётчики url_stats - пожизненные, а пересчёт видит только переходы, которые ещё хранятся в queries
+PARTIAL_REBUILD_WARNING = (
+    "Включён срок хранения переходов (QUERIES_RETENTION_MONTHS > 0): партиции queries старше него "
+    "выведены, и пересчёт по оставшимся переходам занизит пожизненные счётчики url_stats. "
+    "Запустите с --allow-partial, если это ожидаемо."
+)
+
+
+def aggregate_clicks(clicks: list[dict]) -> list[dict]:
+    # Схлопываем пачку переходов в одну строку на ссылку
+    totals: dict[int, dict] = {}
+    for click in clicks:
+        row = totals.setdefault(
+            click["url_id"],
+            {"url_id": click["url_id"], "access_count": 0, "last_access": click["access_time"]},
+        )
+        row["access_count"] += 1
+        row["last_access"] = max(row["last_access"], click["access_time"])
+    # Сортировка по url_id даёт одинаковый порядок блокировок у всех воркеров
+    return [totals[url_id] for url_id in sorted(totals)]
+
+
+async def apply_clicks(session: AsyncSession, clicks: list[dict]) -> None:
+    # Инкрементально обновляем счётчики url_stats одним upsert'ом на пачку
+    rows = aggregate_clicks(clicks)
+    if not rows:
+        return
+    stmt = dialect_insert(session, UrlStats).values(rows)
+    excluded = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UrlStats.url_id],
+        set_={
+            "access_count": UrlStats.access_count + excluded.access_count,
+            "last_access": case(
+                (
+                    UrlStats.last_access.is_(None) | (excluded.last_access > UrlStats.last_access),
+                    excluded.last_access,
+                ),
+                else_=UrlStats.last_access,
+            ),
+        },
+    )
+    await session.execute(stmt)
+
+
+async def rebuild_counters(
+    session: AsyncSession,
+    batch_size: int = 10000,
+    allow_partial: bool = False,
+    retention_months: int = RETENTION_MONTHS,
+) -> int:
+    # Пересчёт счётчиков по таблице queries (после инцидентов или потери пачек),
+    # диапазонами url_id, чтобы не держать длинные блокировки
+    if retention_months > 0 and not allow_partial:
+        raise RuntimeError(PARTIAL_REBUILD_WARNING)
+    max_id = (await session.execute(select(func.max(Url.id)))).scalar_one_or_none() or 0
+    rebuilt = 0
+    for start in range(0, max_id + 1, batch_size):
+        end = start + batch_size
+        await session.execute(
+            delete(UrlStats).where(UrlStats.url_id >= start, UrlStats.url_id < end)
+        )
+        aggregated = (
+            select(
+                Query.url_id,
+                func.count(Query.id),
+                func.max(Query.access_time),
+            )
+            .where(Query.url_id >= start, Query.url_id < end)
+            .group_by(Query.url_id)
+        )
+        result = await session.execute(
+            insert(UrlStats).from_select(["url_id", "access_count", "last_access"], aggregated)
+        )
+        await session.commit()
+        rebuilt += max(result.rowcount or 0, 0)
+    return rebuilt
+
+
+async def _main(batch_size: Optional[int], allow_partial: bool) -> None:
+    async with get_session_maker()() as session:
+        rebuilt = await rebuild_counters(session, batch_size, allow_partial)
+    print(f"Пересчитаны счётчики для {rebuilt} ссылок.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Пересчёт счётчиков переходов url_stats по таблице queries",
+        epilog=(
+            "Пересчёт учитывает только переходы, которые ещё хранятся в queries. При включённом сроке "
+            "хранения (QUERIES_RETENTION_MONTHS > 0) старые партиции выведены, и пожизненные счётчики "
+            "уменьшатся, поэтому без --allow-partial команда в этом режиме не запускается."
+        ),
+    )
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument(
+        "--allow-partial", action="store_true",
+        help="пересчитать, даже если часть переходов уже удалена по сроку хранения",
+    )
+    args = parser.parse_args()
+    try:
+        asyncio.run(_main(args.batch_size, args.allow_partial))
+    except RuntimeError as e:
+        parser.exit(1, f"{e}\n")
@@ -1,7 +1,13 @@
 import os
+import time
 from typing import AsyncGenerator
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy import exc
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.dialects import postgresql, sqlite
+
+from src.metrics import db_pool_wait, request_db_stats
 
 
 _engine = None
@@ -12,14 +18,107 @@ class Base(DeclarativeBase):
     pass
 
 
+def dialect_insert(session: AsyncSession, table):
+    # INSERT с поддержкой ON CONFLICT для текущего диалекта (PostgreSQL в проде, SQLite в тестах)
+    if session.bind.dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
+class PoolMetrics:
+    # Счётчики ожидания соединений из пула (в рамках воркера)
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def record(self, wait_time: float) -> None:
+        self.checkouts += 1
+        self.wait_time_total += wait_time
+        self.wait_time_max = max(self.wait_time_max, wait_time)
+
+
+pool_metrics = PoolMetrics()
+
+
+def _observe_pool_wait(wait_time: float) -> None:
+    # В сигнал контроля допуска идёт только ожидание обработчиков запросов, как и время SQL (src/metrics.py)
+    if request_db_stats.get() is not None:
+        db_pool_wait.observe(wait_time)
+
+
+class PoolMetricsMixin:
+    # Замеряет время получения соединения из пула и считает таймауты
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.timeouts += 1
+            _observe_pool_wait(time.perf_counter() - started)
+            raise
+        wait_time = time.perf_counter() - started
+        pool_metrics.record(wait_time)
+        _observe_pool_wait(wait_time)
+        return connection
+
+
+class InstrumentedAsyncPool(PoolMetricsMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def engine_options(db_url: str) -> dict:
+    # Настройки пула из окружения. Итоговое число соединений к PostgreSQL:
+    # (DB_POOL_SIZE + DB_MAX_OVERFLOW) * число воркеров gunicorn
+    if db_url.startswith("sqlite"):
+        return {}
+    options = {
+        "poolclass": InstrumentedAsyncPool,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "5")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "10")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") == "1",
+    }
+    if "+asyncpg" in db_url:
+        options["connect_args"] = {
+            # Кэш подготовленных выражений SQLAlchemy и собственный кэш asyncpg
+            # (оба нужно обнулять при работе через pgbouncer в режиме transaction)
+            "prepared_statement_cache_size": int(os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", "100")),
+            "statement_cache_size": int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100")),
+        }
+    return options
+
+
 def get_engine():
     global _engine
     if _engine is None:
         db_url = os.getenv("DATABASE_URL")
-        _engine = create_async_engine(db_url, future=True, echo=False)
+        _engine = create_async_engine(db_url, future=True, echo=False, **engine_options(db_url))
     return _engine
 
 
+def pool_stats() -> dict:
+    pool = get_engine().pool
+    stats = {
+        "checkouts": pool_metrics.checkouts,
+        "timeouts": pool_metrics.timeouts,
+        "wait_time_total": pool_metrics.wait_time_total,
+        "wait_time_max": pool_metrics.wait_time_max,
+    }
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+            idle=pool.checkedin(),
+        )
+    return stats
+
+
 def get_session_maker():
     global _session_maker
     if _session_maker is None:
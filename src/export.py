@@ -0,0 +1,94 @@
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import and_, or_, select
+
+from src.database import get_session_maker
+from src.models import Query, Url
+
+# Сколько переходов читается за одно соединение из пула
+EXPORT_CHUNK_SIZE = int(os.getenv("CLICKS_EXPORT_CHUNK_SIZE", "5000"))
+# Сколько строк драйвер забирает с серверного курсора за раз
+EXPORT_FETCH_SIZE = int(os.getenv("CLICKS_EXPORT_FETCH_SIZE", "1000"))
+
+EXPORT_COLUMNS = ("short_url", "full_url", "access_time")
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def _encode(rows, format: str, header: bool) -> str:
+    if format == "ndjson":
+        return "".join(
+            json.dumps(
+                {"short_url": row.short_url, "full_url": row.full_url, "access_time": row.access_time.isoformat()},
+                ensure_ascii=False,
+            ) + "\n"
+            for row in rows
+        )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows((row.short_url, row.full_url, row.access_time.isoformat()) for row in rows)
+    return buffer.getvalue()
+
+
+async def _click_chunks(condition, chunk_size: int, join_urls: bool = False) -> AsyncIterator[list]:
+    # Переходы кусками по chunk_size одним keyset-запросом по (url_id, access_time, id):
+    # для одной ссылки он идёт по индексу ix_queries_url_id_access_time, для всех ссылок
+    # пользователя - через соединение с urls, без отдельного запроса на каждую ссылку.
+    # Каждый кусок читается серверным курсором в своей сессии, соединение возвращается
+    # в пул до того, как кусок уходит медленному клиенту
+    after: Optional[tuple[int, datetime, int]] = None
+    while True:
+        query = (
+            select(Query.url_id, Query.id, Query.short_url, Query.full_url, Query.access_time)
+            .where(condition)
+            .order_by(Query.url_id, Query.access_time, Query.id)
+            .limit(chunk_size)
+            .execution_options(yield_per=EXPORT_FETCH_SIZE)
+        )
+        if join_urls:
+            query = query.join(Url, Url.id == Query.url_id)
+        if after is not None:
+            query = query.where(or_(
+                Query.url_id > after[0],
+                and_(Query.url_id == after[0], Query.access_time > after[1]),
+                and_(Query.url_id == after[0], Query.access_time == after[1], Query.id > after[2]),
+            ))
+        async with get_session_maker()() as session:
+            result = await session.stream(query)
+            rows = [row async for row in result]
+        if rows:
+            yield rows
+        if len(rows) < chunk_size:
+            return
+        after = (rows[-1].url_id, rows[-1].access_time, rows[-1].id)
+
+
+async def _export(chunks: AsyncIterator[list], format: str) -> AsyncIterator[str]:
+    header = True
+    async for rows in chunks:
+        yield _encode(rows, format, header)
+        header = False
+    if header and format == "csv":
+        yield _encode([], format, True)
+
+
+async def export_link_clicks(
+    url_id: int, format: str, chunk_size: int = EXPORT_CHUNK_SIZE
+) -> AsyncIterator[str]:
+    async for chunk in _export(_click_chunks(Query.url_id == url_id, chunk_size), format):
+        yield chunk
+
+
+async def export_user_clicks(
+    user_id, format: str, chunk_size: int = EXPORT_CHUNK_SIZE
+) -> AsyncIterator[str]:
+    # Переходы всех ссылок пользователя: по ссылкам, внутри ссылки - в порядке времени
+    chunks = _click_chunks(Url.creator_id == user_id, chunk_size, join_urls=True)
+    async for chunk in _export(chunks, format):
+        yield chunk
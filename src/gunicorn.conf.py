@@ -0,0 +1,6 @@
+from prometheus_client import multiprocess
+
+
+def child_exit(server, worker):
+    # Метрики завершившегося воркера больше не должны учитываться как живые gauge
+    multiprocess.mark_process_dead(worker.pid)
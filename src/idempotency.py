@@ -0,0 +1,76 @@
+import json
+import os
+from datetime import datetime, timedelta
+from hashlib import sha256
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database import dialect_insert
+from src.models import IdempotencyKey
+
+# Сколько хранится ответ по ключу Idempotency-Key (старые ключи удаляет src/sweeper.py)
+IDEMPOTENCY_KEY_TTL = timedelta(hours=float(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24")))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+
+def key_scope(user_id, client: str) -> str:
+    # Ключи разных пользователей не пересекаются. Анонимные ключи разделены по клиенту
+    # (тот же ключ клиента, что и у контроля допуска, src/admission.py), иначе чужой запрос
+    # с тем же ключом получил бы 422 или сохранённый ответ другого клиента
+    return str(user_id) if user_id else f"anonymous:{client}"
+
+
+def request_fingerprint(payload: dict) -> bytes:
+    return sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).digest()
+
+
+def validate_key(key: str) -> None:
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Idempotency-Key должен быть непустой строкой не длиннее {IDEMPOTENCY_KEY_MAX_LENGTH} символов."
+        )
+
+
+async def load_response(session: AsyncSession, scope: str, key: str, fingerprint: bytes) -> Optional[dict]:
+    # Сохранённый ответ на повтор запроса; тот же ключ с другим телом запроса - ошибка клиента
+    result = await session.execute(
+        select(IdempotencyKey.request_hash, IdempotencyKey.response)
+        .where(IdempotencyKey.scope == scope, IdempotencyKey.key == key)
+    )
+    row = result.one_or_none()
+    if row is None:
+        return None
+    if row.request_hash != fingerprint:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key уже использован для другого запроса."
+        )
+    return json.loads(row.response)
+
+
+async def save_response(session: AsyncSession, scope: str, key: str, fingerprint: bytes, response: dict) -> bool:
+    # Выполняется в транзакции основной записи. False - ключ уже занят параллельным повтором,
+    # тогда транзакцию нужно откатить и вернуть его ответ
+    stmt = (
+        dialect_insert(session, IdempotencyKey)
+        .values(
+            scope=scope,
+            key=key,
+            request_hash=fingerprint,
+            response=json.dumps(response, default=str),
+            created_at=datetime.now(),
+        )
+        .on_conflict_do_nothing(index_elements=[IdempotencyKey.scope, IdempotencyKey.key])
+        .returning(IdempotencyKey.key)
+    )
+    return (await session.execute(stmt)).scalar_one_or_none() is not None
+
+
+async def purge_idempotency_keys(session: AsyncSession, before: datetime) -> int:
+    result = await session.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < before))
+    await session.commit()
+    return max(result.rowcount or 0, 0)
@@ -0,0 +1,77 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL_PREFIX = os.getenv("INVALIDATION_CHANNEL_PREFIX", "invalidate")
+INVALIDATION_RECONNECT_DELAY = float(os.getenv("INVALIDATION_RECONNECT_DELAY", "1.0"))
+
+
+class InvalidationBus:
+    # Рассылка инвалидаций локальных (в памяти воркера) кэшей всем воркерам через Redis pub/sub.
+    # Каждый кэш подписывает обработчик на свой канал; воркер, изменивший данные, публикует ключи,
+    # а фоновая задача каждого воркера (и его самого) вытесняет их из своего кэша.
+    # Сообщения, потерянные при разрыве соединения, ограничены TTL локальных кэшей.
+
+    def __init__(self, channel_prefix: str = "invalidate", reconnect_delay: float = 1.0):
+        self.channel_prefix = channel_prefix
+        self.reconnect_delay = reconnect_delay
+        self.redis = None
+        self._handlers: dict[str, Callable[[list[str]], None]] = {}
+        self.published = 0
+        self.received = 0
+
+    def stats(self) -> dict:
+        return {"channels": sorted(self._handlers), "published": self.published, "received": self.received}
+
+    def _channel(self, name: str) -> str:
+        return f"{self.channel_prefix}:{name}"
+
+    def subscribe(self, name: str, handler: Callable[[list[str]], None]) -> None:
+        self._handlers[self._channel(name)] = handler
+
+    async def publish(self, name: str, keys: list[str]) -> None:
+        if self.redis is None or not keys:
+            return
+        try:
+            await self.redis.publish(self._channel(name), json.dumps(keys))
+            self.published += 1
+        except Exception:
+            logger.warning("Не удалось разослать инвалидацию %s: %s", name, keys, exc_info=True)
+
+    def dispatch(self, channel, data) -> None:
+        if isinstance(channel, bytes):
+            channel = channel.decode()
+        handler = self._handlers.get(channel)
+        if handler is None:
+            return
+        self.received += 1
+        handler(json.loads(data))
+
+    async def run(self) -> None:
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(*self._handlers)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.dispatch(message["channel"], message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("Подписка на инвалидации прервана, переподключаемся", exc_info=True)
+            finally:
+                try:
+                    await pubsub.reset()
+                except Exception:
+                    pass
+            await asyncio.sleep(self.reconnect_delay)
+
+
+invalidation_bus = InvalidationBus(
+    channel_prefix=INVALIDATION_CHANNEL_PREFIX,
+    reconnect_delay=INVALIDATION_RECONNECT_DELAY,
+)
@@ -0,0 +1,222 @@
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from src.invalidation import invalidation_bus
+from src.metrics import CACHE_DURATION, CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+class LinkEntry(NamedTuple):
+    id: int
+    full_url: str
+    expires_at: Optional[datetime]
+
+
+# Маркер промаха: None в кэше означает "такого кода нет" (негативное кэширование)
+MISSING = object()
+# Канал рассылки вытеснений из LRU воркеров
+INVALIDATION_CHANNEL = "links"
+
+# Запись в Redis только если под ключом всё ещё то, что видел промах (ничего или то же надгробие):
+# значение, прочитанное из БД до инвалидации, не перезапишет более новое надгробие
+_COMPARE_AND_SET_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if (current == false and ARGV[1] == '') or current == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+
+class Tombstone(NamedTuple):
+    # Надгробие на месте инвалидированного кода с уникальной меткой инвалидации
+    mark: str
+
+
+class LinkLookupCache:
+    # Двухуровневый кэш short_url -> (id, full_url, expires_at) для редиректа.
+    # Первый уровень - LRU в памяти воркера с коротким TTL,
+    # второй - общий для всех воркеров Redis с более длинным TTL.
+    # Инвалидация оставляет на обоих уровнях надгробие на tombstone_ttl секунд и рассылает
+    # вытеснение из LRU остальным воркерам. Промах возвращает метку (что лежало под ключом),
+    # и set записывает значение из БД, только если с тех пор ключ не инвалидировали.
+
+    def __init__(
+        self,
+        max_size: int = 10000,
+        local_ttl: float = 5.0,
+        redis_ttl: int = 300,
+        negative_ttl: int = 30,
+        tombstone_ttl: int = 10,
+        key_prefix: str = "link",
+    ):
+        self.max_size = max_size
+        self.local_ttl = local_ttl
+        self.redis_ttl = redis_ttl
+        self.negative_ttl = negative_ttl
+        self.tombstone_ttl = tombstone_ttl
+        self.key_prefix = key_prefix
+        self.redis = None
+        self._local: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.stale_sets = 0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._local),
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "stale_sets": self.stale_sets,
+        }
+
+    def _key(self, short_url: str) -> str:
+        return f"{self.key_prefix}:{short_url}"
+
+    def _get_local_item(self, short_url: str):
+        item = self._local.get(short_url)
+        if item is None:
+            return MISSING
+        expires, entry = item
+        if expires < time.monotonic():
+            del self._local[short_url]
+            return MISSING
+        return entry
+
+    def _get_local(self, short_url: str):
+        entry = self._get_local_item(short_url)
+        if entry is MISSING or isinstance(entry, Tombstone):
+            return MISSING
+        self._local.move_to_end(short_url)
+        return entry
+
+    def _set_local(self, short_url: str, entry: Optional[LinkEntry]) -> None:
+        ttl = self.local_ttl if entry is not None else min(self.local_ttl, self.negative_ttl)
+        self._store_local(short_url, ttl, entry)
+
+    def _store_local(self, short_url: str, ttl: float, entry) -> None:
+        self._local[short_url] = (time.monotonic() + ttl, entry)
+        self._local.move_to_end(short_url)
+        while len(self._local) > self.max_size:
+            self._local.popitem(last=False)
+
+    def evict_local(self, short_urls: list[str]) -> None:
+        for short_url in short_urls:
+            self._store_local(short_url, self.tombstone_ttl, Tombstone(uuid.uuid4().hex))
+
+    @staticmethod
+    def _dump(entry) -> str:
+        if entry is None:
+            return "null"
+        if isinstance(entry, Tombstone):
+            return json.dumps({"invalidated": entry.mark})
+        return json.dumps([
+            entry.id,
+            entry.full_url,
+            entry.expires_at.isoformat() if entry.expires_at else None,
+        ])
+
+    @staticmethod
+    def _load(raw):
+        data = json.loads(raw)
+        if data is None:
+            return None
+        if isinstance(data, dict):
+            return Tombstone(data["invalidated"])
+        url_id, full_url, expires_at = data
+        return LinkEntry(url_id, full_url, datetime.fromisoformat(expires_at) if expires_at else None)
+
+    async def lookup(self, short_url: str) -> tuple[object, str]:
+        # (запись или MISSING, метка для set): метка - надгробие под ключом или "" если пусто
+        entry = self._get_local(short_url)
+        if entry is not MISSING:
+            self.local_hits += 1
+            CACHE_REQUESTS.labels("links_local", "hit").inc()
+            return entry, ""
+        if self.redis is None:
+            self.misses += 1
+            CACHE_REQUESTS.labels("links_local", "miss").inc()
+            tombstone = self._get_local_item(short_url)
+            return MISSING, tombstone.mark if isinstance(tombstone, Tombstone) else ""
+        started = time.perf_counter()
+        try:
+            raw = await self.redis.get(self._key(short_url))
+        except Exception:
+            logger.warning("Не удалось прочитать %s из Redis", short_url, exc_info=True)
+            raw = None
+        CACHE_DURATION.labels("links_redis").observe(time.perf_counter() - started)
+        entry = self._load(raw) if raw is not None else MISSING
+        if entry is MISSING or isinstance(entry, Tombstone):
+            self.misses += 1
+            CACHE_REQUESTS.labels("links_redis", "miss").inc()
+            return MISSING, raw.decode() if isinstance(raw, bytes) else (raw or "")
+        self.redis_hits += 1
+        CACHE_REQUESTS.labels("links_redis", "hit").inc()
+        if not isinstance(self._get_local_item(short_url), Tombstone):
+            self._set_local(short_url, entry)
+        return entry, ""
+
+    async def get(self, short_url: str):
+        entry, _ = await self.lookup(short_url)
+        return entry
+
+    async def set(self, short_url: str, entry: Optional[LinkEntry], seen: str = "") -> None:
+        # seen - метка, которую вернул lookup до чтения из БД
+        if self.redis is None:
+            tombstone = self._get_local_item(short_url)
+            if isinstance(tombstone, Tombstone) and tombstone.mark != seen:
+                self.stale_sets += 1
+                return
+            self._set_local(short_url, entry)
+            return
+        ttl = self.redis_ttl if entry is not None else self.negative_ttl
+        try:
+            stored = await self.redis.eval(
+                _COMPARE_AND_SET_SCRIPT, 1, self._key(short_url), seen, self._dump(entry), ttl
+            )
+        except Exception:
+            logger.warning("Не удалось записать %s в Redis", short_url, exc_info=True)
+            return
+        if not int(stored):
+            self.stale_sets += 1
+            return
+        self._set_local(short_url, entry)
+
+    async def invalidate(self, *short_urls: str) -> None:
+        if not short_urls:
+            return
+        self.evict_local(list(short_urls))
+        if self.redis is None:
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for short_url in short_urls:
+                    pipe.set(self._key(short_url), self._dump(Tombstone(uuid.uuid4().hex)), ex=self.tombstone_ttl)
+                await pipe.execute()
+        except Exception:
+            logger.warning("Не удалось инвалидировать %s в Redis", short_urls, exc_info=True)
+        # LRU остальных воркеров вытесняются по рассылке, а не по истечении local_ttl
+        await invalidation_bus.publish(INVALIDATION_CHANNEL, list(short_urls))
+
+    def clear(self) -> None:
+        self._local.clear()
+
+
+lookup_cache = LinkLookupCache(
+    max_size=int(os.getenv("LINK_CACHE_SIZE", "10000")),
+    local_ttl=float(os.getenv("LINK_CACHE_LOCAL_TTL", "5")),
+    redis_ttl=int(os.getenv("LINK_CACHE_REDIS_TTL", "300")),
+    negative_ttl=int(os.getenv("LINK_CACHE_NEGATIVE_TTL", "30")),
+    tombstone_ttl=int(os.getenv("LINK_CACHE_TOMBSTONE_TTL", "10")),
+)
+invalidation_bus.subscribe(INVALIDATION_CHANNEL, lookup_cache.evict_local)
@@ -0,0 +1,139 @@
+import logging
+import math
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+import anyio
+
+from src.metrics import EVENT_LOOP_BLOCKS, EVENT_LOOP_LAG, EVENT_LOOP_LAG_QUANTILES
+
+logger = logging.getLogger(__name__)
+
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "1") == "1"
+# Период пульса цикла событий и задержка, после которой цикл считается заблокированным
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.1"))
+LOOP_MONITOR_THRESHOLD = float(os.getenv("LOOP_MONITOR_THRESHOLD", "0.25"))
+LOOP_MONITOR_STACK_DEPTH = int(os.getenv("LOOP_MONITOR_STACK_DEPTH", "30"))
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+class LoopMonitor:
+    # Пульс в цикле событий спит interval секунд и замеряет, насколько позже он проснулся.
+    # Сторожевой поток следит за пульсом: если цикл не отвечает дольше threshold, он снимает
+    # стек потока цикла (sys._current_frames) - в нём виден обработчик с блокирующим вызовом
+
+    def __init__(
+        self,
+        interval: float = 0.1,
+        threshold: float = 0.25,
+        stack_depth: int = 30,
+        samples: int = 1000,
+        history: int = 20,
+    ):
+        self.interval = interval
+        self.threshold = threshold
+        self.stack_depth = stack_depth
+        self._lags: deque[float] = deque(maxlen=samples)
+        self.blocks: deque[dict] = deque(maxlen=history)
+        self.blocked_total = 0
+        self._beats = 0
+        self._last_beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._stopped = threading.Event()
+
+    def max_lag(self) -> float:
+        return max(self._lags, default=0.0)
+
+    def stats(self) -> dict:
+        lags = list(self._lags)
+        return {
+            "samples": len(lags),
+            "lag_max": max(lags, default=0.0),
+            **{f"lag_p{round(q * 100)}": _percentile(lags, q) for q in QUANTILES},
+            "blocked_total": self.blocked_total,
+            "blocks": list(self.blocks),
+        }
+
+    def reset(self) -> None:
+        self._lags.clear()
+        self.blocks.clear()
+        self.blocked_total = 0
+
+    def _record(self, lag: float) -> None:
+        self._lags.append(lag)
+        EVENT_LOOP_LAG.observe(lag)
+        # Перцентили для Prometheus пересчитываются примерно раз в секунду
+        if self._beats % max(1, round(1 / self.interval)) == 0:
+            lags = list(self._lags)
+            for q in QUANTILES:
+                EVENT_LOOP_LAG_QUANTILES.labels(str(q)).set(_percentile(lags, q))
+
+    async def run(self, watchdog: bool = True) -> None:
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        if watchdog:
+            self._stopped.clear()
+            threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        try:
+            while True:
+                started = time.monotonic()
+                await anyio.sleep(self.interval)
+                now = time.monotonic()
+                self._beats += 1
+                self._last_beat = now
+                self._record(max(0.0, now - started - self.interval))
+        finally:
+            self._stopped.set()
+
+    def _watch(self) -> None:
+        reported = None
+        while not self._stopped.wait(self.threshold / 2):
+            beat = self._beats
+            stalled = time.monotonic() - self._last_beat - self.interval
+            # Об одной блокировке сообщаем один раз, пока пульс не возобновится
+            if stalled > self.threshold and reported != beat:
+                reported = beat
+                self._report(stalled)
+
+    def _report(self, stalled: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = "".join(traceback.format_stack(frame, limit=self.stack_depth)) if frame else ""
+        self.blocked_total += 1
+        self.blocks.append({"detected_at": datetime.now(), "blocked_for": stalled, "stack": stack})
+        EVENT_LOOP_BLOCKS.inc()
+        logger.warning(
+            "Цикл событий заблокирован уже %.3f с, стек потока цикла:\n%s", stalled, stack,
+            extra={"loop_block": {"blocked_for": stalled}},
+        )
+
+
+loop_monitor = LoopMonitor(LOOP_MONITOR_INTERVAL, LOOP_MONITOR_THRESHOLD, LOOP_MONITOR_STACK_DEPTH)
+
+
+@asynccontextmanager
+async def loop_lag_probe(interval: float = 0.005) -> AsyncIterator[LoopMonitor]:
+    # Для тестов: частый пульс без сторожевого потока на время блока, после выхода
+    # probe.max_lag() - самая долгая блокировка цикла внутри блока
+    probe = LoopMonitor(interval=interval)
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(probe.run, False)
+        await anyio.sleep(interval)
+        yield probe
+        # Даём пульсу проснуться после последней блокировки и записать её
+        await anyio.sleep(interval)
+        tg.cancel_scope.cancel()
@@ -4,21 +4,51 @@ from contextlib import asynccontextmanager
 from auth.users import auth_backend, fastapi_users
 from auth.schemas import UserCreate, UserRead
 from router import router as urls_router
+from src.monitoring import router as monitoring_router, metrics_router
+from src.admin import router as admin_router
+from src.metrics import MetricsMiddleware
+from src.profiling import SqlProfilerMiddleware
+from src.admission import AdmissionMiddleware, admission_controller
 from redis import asyncio as aioredis
 from fastapi_cache import FastAPICache
 from fastapi_cache.backends.redis import RedisBackend
+from src.clicks import click_buffer
+from src.lookup_cache import lookup_cache
+from src.invalidation import invalidation_bus
+from src.cache import CountingBackend
+from src.partitions import maintenance_loop
+from src.sweeper import sweeper_loop, SWEEPER_ENABLED
+from src.loop_monitor import loop_monitor, LOOP_MONITOR_ENABLED
 
+import asyncio
 import uvicorn
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI) -> AsyncIterator[None]:
     redis = aioredis.from_url("redis://redis:6379")
-    FastAPICache.init(RedisBackend(redis), prefix="fastapi-cache")
+    FastAPICache.init(CountingBackend(RedisBackend(redis)), prefix="fastapi-cache")
+    lookup_cache.redis = redis
+    invalidation_bus.redis = redis
+    admission_controller.buckets.redis = redis
+    click_buffer.start()
+    tasks = [asyncio.create_task(maintenance_loop()), asyncio.create_task(invalidation_bus.run())]
+    if SWEEPER_ENABLED:
+        tasks.append(asyncio.create_task(sweeper_loop()))
+    if LOOP_MONITOR_ENABLED:
+        tasks.append(asyncio.create_task(loop_monitor.run()))
     yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)  # Дожидаемся завершения отменённых задач
+    await click_buffer.stop()  # Сбрасываем накопленные переходы перед остановкой воркера
 
 
 app = FastAPI(lifespan=lifespan, debug=True)
+# Отказы контроля допуска тоже попадают в метрики и профилировщик
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(SqlProfilerMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(
     fastapi_users.get_auth_router(auth_backend), prefix="/auth/jwt", tags=["auth"]
@@ -30,6 +60,9 @@ app.include_router(
 )
 
 app.include_router(urls_router)
+app.include_router(monitoring_router)
+app.include_router(admin_router)
+app.include_router(metrics_router)
 
 
 if __name__ == "__main__":
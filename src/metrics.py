@@ -0,0 +1,201 @@
+import os
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# При запуске под gunicorn метрики воркеров пишутся в PROMETHEUS_MULTIPROC_DIR
+# и агрегируются при каждом запросе /metrics (см. docker/app.sh и src/gunicorn.conf.py)
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки HTTP-запроса",
+    ["method", "route", "status"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUEST_DB_STATEMENTS = Histogram(
+    "http_request_db_statements",
+    "Количество SQL-запросов на один HTTP-запрос",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100),
+)
+REQUEST_DB_DURATION = Histogram(
+    "http_request_db_duration_seconds",
+    "Суммарное время SQL-запросов на один HTTP-запрос",
+    ["route"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+DB_STATEMENT_DURATION = Histogram(
+    "db_statement_duration_seconds",
+    "Время выполнения одного SQL-запроса",
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "Обращения к кэшам",
+    ["cache", "result"],
+)
+CACHE_DURATION = Histogram(
+    "cache_operation_duration_seconds",
+    "Время чтения из кэша",
+    ["cache"],
+    buckets=(0.00005, 0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1),
+)
+REDIRECTS = Counter(
+    "redirects_total",
+    "Редиректы по коротким ссылкам",
+    ["result"],
+)
+QUERIES_PARTITION_MONTHS_AHEAD = Gauge(
+    "queries_partition_months_ahead",
+    "На сколько месяцев вперёд созданы партиции queries (src/partitions.py), алерт при < 1",
+    multiprocess_mode="livemax",
+)
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total",
+    "Запросы, отклонённые контролем допуска (src/admission.py)",
+    ["route_class", "reason"],
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "admission_in_flight",
+    "Запросы в обработке по классам маршрутов",
+    ["route_class"],
+    multiprocess_mode="livesum",
+)
+
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "Задержка срабатывания таймера цикла событий (src/loop_monitor.py)",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+EVENT_LOOP_LAG_QUANTILES = Gauge(
+    "event_loop_lag_quantile_seconds",
+    "Перцентили задержки цикла событий за последние замеры (худший воркер)",
+    ["quantile"],
+    multiprocess_mode="livemax",
+)
+EVENT_LOOP_BLOCKS = Counter(
+    "event_loop_blocked_total",
+    "Блокировки цикла событий дольше порога",
+)
+
+
+class LatencyEwma:
+    # Экспоненциальное сглаживание задержки по последним наблюдениям.
+    # Без новых наблюдений оценка затухает вдвое каждые half_life секунд,
+    # чтобы после сброса нагрузки она не застревала на старом значении
+    __slots__ = ("alpha", "half_life", "_value", "_updated")
+
+    def __init__(self, alpha: float = 0.1, half_life: float = 5.0):
+        self.alpha = alpha
+        self.half_life = half_life
+        self._value = 0.0
+        self._updated = time.monotonic()
+
+    def observe(self, duration: float) -> None:
+        self._value = self.value() * (1 - self.alpha) + duration * self.alpha
+        self._updated = time.monotonic()
+
+    def value(self) -> float:
+        return self._value * 0.5 ** ((time.monotonic() - self._updated) / self.half_life)
+
+    def reset(self) -> None:
+        self._value = 0.0
+        self._updated = time.monotonic()
+
+
+# Оценки задержки БД в текущем воркере по запросам обработчиков: время SQL-запроса и ожидание соединения из пула
+DB_LATENCY_ALPHA = float(os.getenv("DB_LATENCY_EWMA_ALPHA", "0.1"))
+DB_LATENCY_HALF_LIFE = float(os.getenv("DB_LATENCY_HALF_LIFE", "5"))
+db_statement_latency = LatencyEwma(DB_LATENCY_ALPHA, DB_LATENCY_HALF_LIFE)
+db_pool_wait = LatencyEwma(DB_LATENCY_ALPHA, DB_LATENCY_HALF_LIFE)
+
+
+class RequestDbStats:
+    __slots__ = ("statements", "duration", "shapes")
+
+    def __init__(self):
+        self.statements = 0
+        self.duration = 0.0
+        # Счётчик форм запросов, заполняется только при включённом профилировщике (src/profiling.py)
+        self.shapes: Optional[dict[str, int]] = None
+
+
+# Статистика SQL текущего HTTP-запроса (контекст пробрасывается SQLAlchemy в greenlet)
+request_db_stats: ContextVar[Optional[RequestDbStats]] = ContextVar("request_db_stats", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_started"].pop()
+    DB_STATEMENT_DURATION.observe(duration)
+    stats = request_db_stats.get()
+    if stats is not None:
+        # Сигнал контроля допуска - только запросы обработчиков: фоновые сброс переходов, чистка,
+        # импорт, DDL партиций и пересчёты бывают долгими и не должны отсекать трафик
+        db_statement_latency.observe(duration)
+        stats.statements += 1
+        stats.duration += duration
+        if stats.shapes is not None:
+            stats.shapes[statement] = stats.shapes.get(statement, 0) + 1
+
+
+class MetricsMiddleware:
+    # Чистый ASGI-middleware: на каждый запрос только замер времени и запись в гистограммы
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        stats = RequestDbStats()
+        token = request_db_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - started
+            request_db_stats.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            REQUEST_DURATION.labels(scope["method"], path, str(status_code)).observe(duration)
+            REQUEST_DB_STATEMENTS.labels(path).observe(stats.statements)
+            REQUEST_DB_DURATION.labels(path).observe(stats.duration)
+
+
+def metrics_payload() -> tuple[bytes, str]:
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
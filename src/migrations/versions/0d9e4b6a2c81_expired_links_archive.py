@@ -0,0 +1,39 @@
+"""archive of purged expired links
+
+Revision ID: 0d9e4b6a2c81
+Revises: f1a6c8e2d4b3
+Create Date: 2026-10-17 15:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+import sqlalchemy.dialects.postgresql as pg
+
+revision = '0d9e4b6a2c81'
+down_revision = 'f1a6c8e2d4b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'expired_links_archive',
+        sa.Column('url_id', sa.Integer(), primary_key=True),
+        sa.Column('creator_id', pg.UUID(as_uuid=True), nullable=True),
+        sa.Column('full_url', sa.String(), nullable=False),
+        sa.Column('short_url', sa.String(), nullable=False),
+        sa.Column('creation_time', sa.DateTime(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.Column('access_count', sa.BigInteger(), nullable=False, server_default=sa.text('0')),
+        sa.Column('last_access', sa.DateTime(), nullable=True),
+        sa.Column('purged_at', sa.DateTime(), nullable=False),
+    )
+    # keyset-пагинация GET /links/expired/archive
+    op.create_index(
+        'ix_expired_links_archive_expires_at_url_id', 'expired_links_archive', ['expires_at', 'url_id']
+    )
+
+
+def downgrade():
+    op.drop_index('ix_expired_links_archive_expires_at_url_id', table_name='expired_links_archive')
+    op.drop_table('expired_links_archive')
@@ -0,0 +1,42 @@
+"""url_stats counters
+
+Revision ID: 7a3c9e51b2d4
+Revises: d4f9b2a1c3e8
+Create Date: 2026-10-17 10:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = '7a3c9e51b2d4'
+down_revision = 'd4f9b2a1c3e8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'url_stats',
+        sa.Column('url_id', sa.Integer(), primary_key=True),
+        sa.Column('access_count', sa.BigInteger(), nullable=False, server_default=sa.text('0')),
+        sa.Column('last_access', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ['url_id'], ['urls.id'],
+            ondelete='CASCADE',
+            name='fk_url_stats_url_id'
+        ),
+    )
+
+    # Начальное заполнение счётчиков по уже накопленным переходам
+    op.execute(
+        """
+        INSERT INTO url_stats (url_id, access_count, last_access)
+        SELECT url_id, COUNT(id), MAX(access_time)
+        FROM queries
+        GROUP BY url_id
+        """
+    )
+
+
+def downgrade():
+    op.drop_table('url_stats')
@@ -0,0 +1,53 @@
+"""full_url hash for idempotent shorten and idempotency keys
+
+Revision ID: 9c4d2e7f1a35
+Revises: 0d9e4b6a2c81
+Create Date: 2026-10-17 16:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = '9c4d2e7f1a35'
+down_revision = '0d9e4b6a2c81'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 10000
+
+
+def upgrade():
+    op.add_column('urls', sa.Column('full_url_hash', sa.LargeBinary(length=32), nullable=True))
+    op.create_table(
+        'idempotency_keys',
+        sa.Column('scope', sa.String(), primary_key=True),
+        sa.Column('key', sa.String(), primary_key=True),
+        sa.Column('request_hash', sa.LargeBinary(length=32), nullable=False),
+        sa.Column('response', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_idempotency_keys_created_at', 'idempotency_keys', ['created_at'])
+
+    # Заполняем хэши диапазонами id, каждая пачка в своей транзакции, чтобы не держать блокировки
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        max_id = conn.execute(sa.text("SELECT coalesce(max(id), 0) FROM urls")).scalar_one()
+        for start in range(0, max_id + 1, BACKFILL_BATCH_SIZE):
+            conn.execute(
+                sa.text(
+                    "UPDATE urls SET full_url_hash = sha256(convert_to(full_url, 'UTF8')) "
+                    "WHERE id >= :start AND id < :end AND full_url_hash IS NULL"
+                ),
+                {"start": start, "end": start + BACKFILL_BATCH_SIZE},
+            )
+        op.create_index(
+            'ix_urls_creator_id_full_url_hash', 'urls', ['creator_id', 'full_url_hash'],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    op.drop_index('ix_urls_creator_id_full_url_hash', table_name='urls')
+    op.drop_index('ix_idempotency_keys_created_at', table_name='idempotency_keys')
+    op.drop_table('idempotency_keys')
+    op.drop_column('urls', 'full_url_hash')
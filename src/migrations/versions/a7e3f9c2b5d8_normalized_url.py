@@ -0,0 +1,93 @@
+"""normalized full_url with hash computed over the canonical form
+
+Revision ID: a7e3f9c2b5d8
+Revises: 9c4d2e7f1a35
+Create Date: 2026-10-17 17:00:00.000000
+"""
+
+from hashlib import sha256
+from urllib.parse import urlsplit, urlunsplit
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'a7e3f9c2b5d8'
+down_revision = '9c4d2e7f1a35'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 5000
+
+# Замороженная копия нормализации из src/url_keys.py на момент миграции:
+# повторный прогон не должен зависеть от текущего кода приложения
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(full_url: str) -> str:
+    full_url = full_url.strip()
+    try:
+        parts = urlsplit(full_url)
+        port = parts.port
+    except ValueError:
+        return full_url
+    scheme = parts.scheme.lower()
+
+    host = (parts.hostname or "").lower()
+    if ":" in host:
+        host = f"[{host}]"  # IPv6
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+    userinfo, at, _ = parts.netloc.rpartition("@")
+    netloc = f"{userinfo}{at}{host}"
+
+    path = parts.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/") or "/"
+    query = "&".join(sorted(param for param in parts.query.split("&") if param))
+    return urlunsplit((scheme, netloc, path, query, parts.fragment))
+
+
+def url_columns(full_url: str) -> dict:
+    normalized = normalize_url(full_url)
+    return {"normalized_url": normalized, "full_url_hash": sha256(normalized.encode("utf-8")).digest()}
+
+
+def upgrade():
+    op.add_column('urls', sa.Column('normalized_url', sa.String(), nullable=True))
+
+    # Нормализация выполняется в Python, поэтому заполняем пачками по id (keyset),
+    # каждая пачка фиксируется отдельно и не держит блокировки на всей таблице
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                sa.text("SELECT id, full_url FROM urls WHERE id > :last_id ORDER BY id LIMIT :limit"),
+                {"last_id": last_id, "limit": BACKFILL_BATCH_SIZE},
+            ).all()
+            if not rows:
+                break
+            conn.execute(
+                sa.text(
+                    "UPDATE urls SET normalized_url = :normalized_url, full_url_hash = :full_url_hash "
+                    "WHERE id = :id"
+                ),
+                [{"id": row.id, **url_columns(row.full_url)} for row in rows],
+            )
+            last_id = rows[-1].id
+
+        op.create_index('ix_urls_full_url_hash', 'urls', ['full_url_hash'], postgresql_concurrently=True)
+        op.drop_index('ix_urls_full_url', table_name='urls', postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_urls_full_url', 'urls', ['full_url'],
+            postgresql_using='hash',
+            postgresql_concurrently=True,
+        )
+        op.drop_index('ix_urls_full_url_hash', table_name='urls', postgresql_concurrently=True)
+    # Возвращаем хэш по исходному full_url, как в 9c4d2e7f1a35
+    op.execute("UPDATE urls SET full_url_hash = sha256(convert_to(full_url, 'UTF8'))")
+    op.drop_column('urls', 'normalized_url')
@@ -0,0 +1,97 @@
+"""host and path columns for domain and prefix search
+
+Revision ID: b2f8d4a6c1e9
+Revises: a7e3f9c2b5d8
+Create Date: 2026-10-17 18:00:00.000000
+"""
+
+from urllib.parse import urlsplit, urlunsplit
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'b2f8d4a6c1e9'
+down_revision = 'a7e3f9c2b5d8'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 5000
+
+# Замороженная копия src/url_keys.py на момент миграции: повторный прогон не должен
+# зависеть от текущего кода приложения. Хост и путь обрезаются, чтобы строка btree-индекса
+# не превышала предельный размер
+URL_HOST_MAX_LENGTH = 255
+URL_PATH_MAX_LENGTH = 256
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(full_url: str) -> str:
+    full_url = full_url.strip()
+    try:
+        parts = urlsplit(full_url)
+        port = parts.port
+    except ValueError:
+        return full_url
+    scheme = parts.scheme.lower()
+
+    host = (parts.hostname or "").lower()
+    if ":" in host:
+        host = f"[{host}]"  # IPv6
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+    userinfo, at, _ = parts.netloc.rpartition("@")
+    netloc = f"{userinfo}{at}{host}"
+
+    path = parts.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/") or "/"
+    query = "&".join(sorted(param for param in parts.query.split("&") if param))
+    return urlunsplit((scheme, netloc, path, query, parts.fragment))
+
+
+def url_columns(full_url: str) -> dict:
+    normalized = normalize_url(full_url)
+    try:
+        host = (urlsplit(normalized).hostname or "").lower()[:URL_HOST_MAX_LENGTH]
+    except ValueError:
+        host = ""
+    return {"url_host": host, "url_path": urlsplit(normalized).path[:URL_PATH_MAX_LENGTH]}
+
+
+def upgrade():
+    op.add_column('urls', sa.Column('url_host', sa.String(), nullable=True))
+    # Побайтовая сортировка, чтобы btree обслуживал диапазоны префиксов пути
+    op.add_column('urls', sa.Column('url_path', sa.String(collation='C'), nullable=True))
+
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                sa.text("SELECT id, full_url FROM urls WHERE id > :last_id ORDER BY id LIMIT :limit"),
+                {"last_id": last_id, "limit": BACKFILL_BATCH_SIZE},
+            ).all()
+            if not rows:
+                break
+            params = []
+            for row in rows:
+                columns = url_columns(row.full_url)
+                params.append({"id": row.id, "url_host": columns["url_host"], "url_path": columns["url_path"]})
+            conn.execute(
+                sa.text("UPDATE urls SET url_host = :url_host, url_path = :url_path WHERE id = :id"),
+                params,
+            )
+            last_id = rows[-1].id
+
+        op.create_index(
+            'ix_urls_url_host_url_path_id', 'urls', ['url_host', 'url_path', 'id'],
+            postgresql_concurrently=True,
+        )
+        op.create_index('ix_urls_url_path_id', 'urls', ['url_path', 'id'], postgresql_concurrently=True)
+
+
+def downgrade():
+    op.drop_index('ix_urls_url_path_id', table_name='urls')
+    op.drop_index('ix_urls_url_host_url_path_id', table_name='urls')
+    op.drop_column('urls', 'url_path')
+    op.drop_column('urls', 'url_host')
@@ -0,0 +1,26 @@
+"""code_allocator for short code blocks
+
+Revision ID: b81f4d07e6a2
+Revises: 7a3c9e51b2d4
+Create Date: 2026-10-17 11:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'b81f4d07e6a2'
+down_revision = '7a3c9e51b2d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'code_allocator',
+        sa.Column('name', sa.String(), primary_key=True),
+        sa.Column('next_value', sa.BigInteger(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('code_allocator')
@@ -0,0 +1,44 @@
+"""indexes for hot queries
+
+Revision ID: c5e2a9f13d70
+Revises: b81f4d07e6a2
+Create Date: 2026-10-17 12:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'c5e2a9f13d70'
+down_revision = 'b81f4d07e6a2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CONCURRENTLY нельзя выполнять внутри транзакции миграции
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_queries_url_id_access_time', 'queries', ['url_id', 'access_time'],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_queries_short_url', 'queries', ['short_url'],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_urls_full_url', 'urls', ['full_url'],
+            postgresql_using='hash',
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_urls_expires_at_id', 'urls', ['expires_at', 'id'],
+            postgresql_where=sa.text('expires_at IS NOT NULL'),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    op.drop_index('ix_urls_expires_at_id', table_name='urls')
+    op.drop_index('ix_urls_full_url', table_name='urls')
+    op.drop_index('ix_queries_short_url', table_name='queries')
+    op.drop_index('ix_queries_url_id_access_time', table_name='queries')
@@ -0,0 +1,27 @@
+"""index for the caller's links
+
+Revision ID: c8a1e5f3d7b2
+Revises: b2f8d4a6c1e9
+Create Date: 2026-10-17 19:00:00.000000
+"""
+
+from alembic import op
+
+revision = 'c8a1e5f3d7b2'
+down_revision = 'b2f8d4a6c1e9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_urls_creator_id_creation_time_id', 'urls', ['creator_id', 'creation_time', 'id'],
+            # full_url неограничен по длине и в INCLUDE не попадает, его дочитываем из таблицы
+            postgresql_include=['short_url', 'expires_at'],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    op.drop_index('ix_urls_creator_id_creation_time_id', table_name='urls')
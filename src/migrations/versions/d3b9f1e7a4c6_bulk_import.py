@@ -0,0 +1,61 @@
+"""bulk import jobs, staging table and row errors
+
+Revision ID: d3b9f1e7a4c6
+Revises: c8a1e5f3d7b2
+Create Date: 2026-10-17 20:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+import sqlalchemy.dialects.postgresql as pg
+
+revision = 'd3b9f1e7a4c6'
+down_revision = 'c8a1e5f3d7b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'import_jobs',
+        sa.Column('id', sa.String(), primary_key=True),
+        sa.Column('source', sa.String(), nullable=True),
+        sa.Column('format', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('creator_id', pg.UUID(as_uuid=True), nullable=True),
+        sa.Column('rows_processed', sa.BigInteger(), nullable=False, server_default=sa.text('0')),
+        sa.Column('imported', sa.BigInteger(), nullable=False, server_default=sa.text('0')),
+        sa.Column('conflicts', sa.BigInteger(), nullable=False, server_default=sa.text('0')),
+        sa.Column('invalid', sa.BigInteger(), nullable=False, server_default=sa.text('0')),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+    )
+    # Промежуточные строки живут одну транзакцию, журналирование WAL им не нужно
+    op.create_table(
+        'import_staging',
+        sa.Column('job_id', sa.String(), primary_key=True),
+        sa.Column('line_no', sa.BigInteger(), primary_key=True),
+        sa.Column('full_url', sa.String(), nullable=False),
+        sa.Column('short_url', sa.String(), nullable=False),
+        sa.Column('generated', sa.Boolean(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=True),
+        sa.Column('normalized_url', sa.String(), nullable=False),
+        sa.Column('full_url_hash', sa.LargeBinary(length=32), nullable=False),
+        sa.Column('url_host', sa.String(), nullable=False),
+        sa.Column('url_path', sa.String(), nullable=False),
+        prefixes=['UNLOGGED'],
+    )
+    op.create_table(
+        'import_errors',
+        sa.Column('job_id', sa.String(), primary_key=True),
+        sa.Column('line_no', sa.BigInteger(), primary_key=True),
+        sa.Column('reason', sa.Text(), nullable=False),
+        sa.Column('short_url', sa.String(), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table('import_errors')
+    op.drop_table('import_staging')
+    op.drop_table('import_jobs')
@@ -0,0 +1,117 @@
+"""range partitioning of queries by access_time
+
+Revision ID: e3b7d1c4a9f5
+Revises: c5e2a9f13d70
+Create Date: 2026-10-17 13:00:00.000000
+"""
+
+from datetime import datetime
+from typing import Optional
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'e3b7d1c4a9f5'
+down_revision = 'c5e2a9f13d70'
+branch_labels = None
+depends_on = None
+
+# Замороженная копия src/partitions.py на момент миграции: повторный прогон не должен
+# зависеть от текущего кода приложения и от окружения (QUERIES_PARTITIONS_AHEAD)
+MONTHS_AHEAD = 3
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_ddl(month: datetime) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS queries_p{month:%Y%m} PARTITION OF queries "
+        f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+    )
+
+
+def months_to_create(now: datetime, since: Optional[datetime]) -> list[datetime]:
+    # Месячные партиции от since (или текущего месяца) до now + MONTHS_AHEAD включительно
+    moment = since or now
+    month = datetime(moment.year, moment.month, 1)
+    last = add_months(datetime(now.year, now.month, 1), MONTHS_AHEAD)
+    months = []
+    while month <= last:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def upgrade():
+    op.execute("ALTER TABLE queries RENAME TO queries_legacy")
+    op.execute("ALTER TABLE queries_legacy RENAME CONSTRAINT queries_pkey TO queries_legacy_pkey")
+    op.drop_index('ix_queries_url_id_access_time', table_name='queries_legacy')
+    op.drop_index('ix_queries_short_url', table_name='queries_legacy')
+
+    # Ключ партиционирования обязан входить в первичный ключ
+    op.execute(
+        """
+        CREATE TABLE queries (
+            id BIGINT NOT NULL DEFAULT nextval('queries_id_seq'),
+            url_id INTEGER NOT NULL,
+            full_url VARCHAR NOT NULL,
+            short_url VARCHAR NOT NULL,
+            access_time TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            CONSTRAINT queries_pkey PRIMARY KEY (id, access_time),
+            CONSTRAINT fk_queries_url_id FOREIGN KEY (url_id) REFERENCES urls (id)
+                ON DELETE CASCADE ON UPDATE CASCADE,
+            CONSTRAINT fk_queries_short_url FOREIGN KEY (short_url) REFERENCES urls (short_url)
+                ON DELETE CASCADE ON UPDATE CASCADE
+        ) PARTITION BY RANGE (access_time)
+        """
+    )
+    op.execute("ALTER SEQUENCE queries_id_seq AS BIGINT OWNED BY queries.id")
+
+    # Партиции на весь период уже накопленных переходов и на несколько месяцев вперёд.
+    # DEFAULT-партиции нет: при ней невозможен DETACH PARTITION ... CONCURRENTLY,
+    # а покрытие следующих месяцев поддерживает src/partitions.py
+    since = op.get_bind().execute(sa.text("SELECT MIN(access_time) FROM queries_legacy")).scalar()
+    for month in months_to_create(datetime.now(), since):
+        op.execute(partition_ddl(month))
+
+    op.execute(
+        "INSERT INTO queries (id, url_id, full_url, short_url, access_time) "
+        "SELECT id, url_id, full_url, short_url, access_time FROM queries_legacy"
+    )
+    op.drop_table('queries_legacy')
+
+    op.create_index('ix_queries_url_id_access_time', 'queries', ['url_id', 'access_time'])
+    op.create_index('ix_queries_short_url', 'queries', ['short_url'])
+
+
+def downgrade():
+    op.execute("ALTER TABLE queries RENAME TO queries_partitioned")
+    op.execute("ALTER TABLE queries_partitioned RENAME CONSTRAINT queries_pkey TO queries_partitioned_pkey")
+    op.drop_index('ix_queries_url_id_access_time', table_name='queries_partitioned')
+    op.drop_index('ix_queries_short_url', table_name='queries_partitioned')
+    op.execute(
+        """
+        CREATE TABLE queries (
+            id INTEGER NOT NULL DEFAULT nextval('queries_id_seq') PRIMARY KEY,
+            url_id INTEGER NOT NULL,
+            full_url VARCHAR NOT NULL,
+            short_url VARCHAR NOT NULL,
+            access_time TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            CONSTRAINT fk_queries_url_id FOREIGN KEY (url_id) REFERENCES urls (id)
+                ON DELETE CASCADE ON UPDATE CASCADE,
+            CONSTRAINT fk_queries_short_url FOREIGN KEY (short_url) REFERENCES urls (short_url)
+                ON DELETE CASCADE ON UPDATE CASCADE
+        )
+        """
+    )
+    op.execute("ALTER SEQUENCE queries_id_seq AS INTEGER OWNED BY queries.id")
+    op.execute(
+        "INSERT INTO queries (id, url_id, full_url, short_url, access_time) "
+        "SELECT id, url_id, full_url, short_url, access_time FROM queries_partitioned"
+    )
+    op.execute("DROP TABLE queries_partitioned CASCADE")
+    op.create_index('ix_queries_url_id_access_time', 'queries', ['url_id', 'access_time'])
+    op.create_index('ix_queries_short_url', 'queries', ['short_url'])
@@ -0,0 +1,43 @@
+"""hourly and daily click rollups
+
+Revision ID: f1a6c8e2d4b3
+Revises: e3b7d1c4a9f5
+Create Date: 2026-10-17 14:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'f1a6c8e2d4b3'
+down_revision = 'e3b7d1c4a9f5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table, granularity in (('click_rollup_hourly', 'hour'), ('click_rollup_daily', 'day')):
+        op.create_table(
+            table,
+            sa.Column('url_id', sa.Integer(), primary_key=True),
+            sa.Column('bucket', sa.DateTime(), primary_key=True),
+            sa.Column('clicks', sa.BigInteger(), nullable=False, server_default=sa.text('0')),
+            sa.ForeignKeyConstraint(
+                ['url_id'], ['urls.id'],
+                ondelete='CASCADE',
+                name=f'fk_{table}_url_id'
+            ),
+        )
+        # Начальное заполнение по уже накопленным переходам
+        op.execute(
+            f"""
+            INSERT INTO {table} (url_id, bucket, clicks)
+            SELECT url_id, date_trunc('{granularity}', access_time), COUNT(id)
+            FROM queries
+            GROUP BY url_id, date_trunc('{granularity}', access_time)
+            """
+        )
+
+
+def downgrade():
+    op.drop_table('click_rollup_daily')
+    op.drop_table('click_rollup_hourly')
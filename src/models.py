@@ -1,5 +1,5 @@
 from fastapi_users.db import SQLAlchemyBaseUserTableUUID
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey
+from sqlalchemy import Boolean, Column, String, Integer, BigInteger, DateTime, ForeignKey, Index, LargeBinary, Text
 from sqlalchemy.dialects.postgresql import UUID
 from src.database import Base
 
@@ -18,13 +18,155 @@ class Url(Base):
     short_url = Column(String, unique=True, nullable=False)
     creation_time = Column(DateTime, nullable=False)
     expires_at = Column(DateTime, nullable=True)
+    # Каноническая форма full_url и её sha256 (src/url_keys.py): поиск по ключу фиксированной длины
+    normalized_url = Column(String, nullable=True)
+    full_url_hash = Column(LargeBinary(32), nullable=True)
+    # Хост и путь нормализованного URL для поиска по домену и префиксу пути.
+    # Побайтовая сортировка ("C") позволяет btree-индексу обслуживать диапазоны префиксов
+    url_host = Column(String, nullable=True)
+    url_path = Column(String().with_variant(String(collation="C"), "postgresql"), nullable=True)
+
+    __table_args__ = (
+        Index("ix_urls_full_url_hash", "full_url_hash"),
+        Index("ix_urls_url_host_url_path_id", "url_host", "url_path", "id"),
+        Index("ix_urls_url_path_id", "url_path", "id"),
+        Index("ix_urls_creator_id_full_url_hash", "creator_id", "full_url_hash"),
+        # Индекс для GET /links/mine: порядок совпадает с keyset-пагинацией, в INCLUDE только колонки
+        # ограниченного размера - full_url неограничен и не должен попадать в строку btree
+        # (длинный URL ломал бы любую вставку), его страница дочитывает из таблицы
+        Index(
+            "ix_urls_creator_id_creation_time_id", "creator_id", "creation_time", "id",
+            postgresql_include=["short_url", "expires_at"],
+        ),
+        # Частичный индекс только по протухающим ссылкам, порядок совпадает с keyset-пагинацией
+        Index(
+            "ix_urls_expires_at_id", "expires_at", "id",
+            postgresql_where=expires_at.isnot(None),
+            sqlite_where=expires_at.isnot(None),
+        ),
+    )
 
 
 class Query(Base):
     __tablename__ = "queries"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    # В PostgreSQL таблица партиционирована по access_time (см. src/partitions.py)
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
     url_id = Column(Integer, ForeignKey('urls.id', ondelete='CASCADE', onupdate='CASCADE'), nullable=False)
     full_url = Column(String, nullable=False)
     short_url = Column(String, ForeignKey('urls.short_url', ondelete='CASCADE', onupdate='CASCADE'), nullable=False)
     access_time = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_queries_url_id_access_time", "url_id", "access_time"),
+        # Нужен каскадам ON UPDATE/ON DELETE по urls.short_url
+        Index("ix_queries_short_url", "short_url"),
+    )
+
+
+class UrlStats(Base):
+    __tablename__ = "url_stats"
+
+    url_id = Column(Integer, ForeignKey('urls.id', ondelete='CASCADE'), primary_key=True)
+    access_count = Column(BigInteger, nullable=False, default=0)
+    last_access = Column(DateTime, nullable=True)
+
+
+class CodeAllocator(Base):
+    __tablename__ = "code_allocator"
+
+    name = Column(String, primary_key=True)
+    next_value = Column(BigInteger, nullable=False)
+
+
+class HourlyClicks(Base):
+    __tablename__ = "click_rollup_hourly"
+
+    url_id = Column(Integer, ForeignKey('urls.id', ondelete='CASCADE'), primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    clicks = Column(BigInteger, nullable=False, default=0)
+
+
+class DailyClicks(Base):
+    __tablename__ = "click_rollup_daily"
+
+    url_id = Column(Integer, ForeignKey('urls.id', ondelete='CASCADE'), primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    clicks = Column(BigInteger, nullable=False, default=0)
+
+
+class ArchivedLink(Base):
+    # Итоговая статистика ссылок, удалённых фоновой очисткой протухших ссылок
+    __tablename__ = "expired_links_archive"
+
+    url_id = Column(Integer, primary_key=True)
+    creator_id = Column(UUID(as_uuid=True), nullable=True)
+    full_url = Column(String, nullable=False)
+    short_url = Column(String, nullable=False)
+    creation_time = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    access_count = Column(BigInteger, nullable=False, default=0)
+    last_access = Column(DateTime, nullable=True)
+    purged_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        # keyset-пагинация GET /links/expired/archive
+        Index("ix_expired_links_archive_expires_at_url_id", "expires_at", "url_id"),
+    )
+
+
+class IdempotencyKey(Base):
+    # Ответы POST /links/shorten по заголовку Idempotency-Key для повторов запросов клиентом
+    __tablename__ = "idempotency_keys"
+
+    scope = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    request_hash = Column(LargeBinary(32), nullable=False)
+    response = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, index=True)
+
+
+class ImportJob(Base):
+    # Задание массового импорта ссылок (src/bulk_import.py): прогресс и точка продолжения после сбоя
+    __tablename__ = "import_jobs"
+
+    id = Column(String, primary_key=True)
+    source = Column(String, nullable=True)
+    format = Column(String, nullable=False)
+    status = Column(String, nullable=False)  # running, completed, failed
+    creator_id = Column(UUID(as_uuid=True), nullable=True)
+    # Сколько строк входного файла уже обработано, при продолжении они пропускаются
+    rows_processed = Column(BigInteger, nullable=False, default=0)
+    imported = Column(BigInteger, nullable=False, default=0)
+    conflicts = Column(BigInteger, nullable=False, default=0)
+    invalid = Column(BigInteger, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+
+class ImportStaging(Base):
+    # Промежуточная таблица импорта: пачка загружается сюда через COPY и сливается в urls одним запросом.
+    # В PostgreSQL таблица UNLOGGED (см. миграцию)
+    __tablename__ = "import_staging"
+
+    job_id = Column(String, primary_key=True)
+    line_no = Column(BigInteger, primary_key=True)
+    full_url = Column(String, nullable=False)
+    short_url = Column(String, nullable=False)
+    generated = Column(Boolean, nullable=False)
+    expires_at = Column(DateTime, nullable=True)
+    normalized_url = Column(String, nullable=False)
+    full_url_hash = Column(LargeBinary(32), nullable=False)
+    url_host = Column(String, nullable=False)
+    url_path = Column(String, nullable=False)
+
+
+class ImportRowError(Base):
+    # Строки импорта, которые не попали в urls: ошибка валидации или занятый alias
+    __tablename__ = "import_errors"
+
+    job_id = Column(String, primary_key=True)
+    line_no = Column(BigInteger, primary_key=True)
+    reason = Column(Text, nullable=False)
+    short_url = Column(String, nullable=True)
@@ -0,0 +1,56 @@
+from fastapi import APIRouter, Response
+from fastapi_cache import FastAPICache
+
+from src.admission import admission_controller
+from src.auth.cache import user_cache
+from src.clicks import click_buffer
+from src.database import pool_stats
+from src.invalidation import invalidation_bus
+from src.lookup_cache import lookup_cache
+from src.loop_monitor import loop_monitor
+from src.metrics import metrics_payload
+
+router = APIRouter(
+    prefix="/monitoring",
+    tags=["Monitoring"]
+)
+
+metrics_router = APIRouter(tags=["Monitoring"])
+
+
+# Счётчики кэшей и буфера переходов текущего воркера
+@router.get("/cache")
+async def cache_stats():
+    backend = FastAPICache.get_backend()
+    return {
+        "responses": backend.stats() if hasattr(backend, "stats") else {},
+        "links": lookup_cache.stats(),
+        "clicks": click_buffer.stats(),
+        "users": user_cache.stats(),
+        "invalidations": invalidation_bus.stats(),
+    }
+
+
+# Состояние пула соединений с БД текущего воркера
+@router.get("/pool")
+async def db_pool_stats():
+    return pool_stats()
+
+
+# Контроль допуска текущего воркера: задержка БД, запросы в обработке и отказы по классам
+@router.get("/admission")
+async def admission_stats():
+    return admission_controller.stats()
+
+
+# Задержка цикла событий текущего воркера и последние блокировки со стеками
+@router.get("/loop")
+async def loop_stats():
+    return loop_monitor.stats()
+
+
+# Метрики в формате Prometheus (в multiprocess-режиме - по всем воркерам gunicorn)
+@metrics_router.get("/metrics", include_in_schema=False)
+async def metrics():
+    payload, content_type = metrics_payload()
+    return Response(content=payload, media_type=content_type)
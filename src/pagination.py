@@ -0,0 +1,27 @@
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException
+
+# Заголовок, в котором отдаётся курсор следующей страницы
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(*values) -> str:
+    # Курсор keyset-пагинации: значения ключа сортировки последней строки страницы
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, *types) -> tuple:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if len(payload) != len(types):
+            raise ValueError(cursor)
+        return tuple(
+            None if value is None else datetime.fromisoformat(value) if type_ is datetime else type_(value)
+            for value, type_ in zip(payload, types)
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail="Неверный курсор пагинации.") from e
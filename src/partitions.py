@@ -0,0 +1,171 @@
+import argparse
+import asyncio
+import logging
+import os
+import re
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from src.database import get_engine
+from src.metrics import QUERIES_PARTITION_MONTHS_AHEAD
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = "queries"
+PARTITION_NAME = re.compile(rf"^{PARENT_TABLE}_p(\d{{4}})(\d{{2}})$")
+
+# Произвольный ключ advisory-lock, чтобы обслуживание выполнял только один воркер
+MAINTENANCE_LOCK_ID = 72390517
+
+MONTHS_AHEAD = int(os.getenv("QUERIES_PARTITIONS_AHEAD", "3"))
+RETENTION_MONTHS = int(os.getenv("QUERIES_RETENTION_MONTHS", "0"))  # 0 - хранить всё
+RETENTION_ACTION = os.getenv("QUERIES_RETENTION_ACTION", "detach")  # detach или drop
+MAINTENANCE_INTERVAL = float(os.getenv("QUERIES_PARTITION_MAINTENANCE_INTERVAL", "3600"))
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def month_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"{PARENT_TABLE}_p{month:%Y%m}"
+
+
+def partition_ddl(month: datetime) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {PARENT_TABLE} "
+        f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+    )
+
+
+def months_to_create(now: datetime, months_ahead: int, since: Optional[datetime] = None) -> list[datetime]:
+    # Месячные партиции от since (или текущего месяца) до now + months_ahead включительно
+    month = month_start(since or now)
+    last = add_months(month_start(now), months_ahead)
+    months = []
+    while month <= last:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def partitions_to_retire(names: list[str], now: datetime, retention_months: int) -> list[str]:
+    # Партиции, все строки которых старше срока хранения
+    if retention_months <= 0:
+        return []
+    border = add_months(month_start(now), -retention_months)
+    retired = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match and add_months(datetime(int(match[1]), int(match[2]), 1), 1) <= border:
+            retired.append(name)
+    return sorted(retired)
+
+
+def months_covered(names: list[str], now: datetime) -> int:
+    # Сколько месяцев после текущего подряд покрыто партициями (-1 - нет даже текущего).
+    # DEFAULT-партиции нет (с ней невозможен DETACH ... CONCURRENTLY), и переход вне созданных
+    # диапазонов не запишется, поэтому это значение выгружается в метрику и на него ставится алерт
+    months = {
+        datetime(int(match[1]), int(match[2]), 1)
+        for match in map(PARTITION_NAME.match, names) if match
+    }
+    month, covered = month_start(now), -1
+    while month in months:
+        covered += 1
+        month = add_months(month, 1)
+    return covered
+
+
+async def list_partitions(conn: AsyncConnection) -> dict[str, bool]:
+    # Имя партиции -> не завершён ли её DETACH ... CONCURRENTLY (прерванный отсоединением)
+    result = await conn.execute(text(
+        "SELECT child.relname, pg_inherits.inhdetachpending FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :parent"
+    ), {"parent": PARENT_TABLE})
+    return {name: pending for name, pending in result.all()}
+
+
+async def maintain_partitions(
+    conn: AsyncConnection,
+    months_ahead: int = MONTHS_AHEAD,
+    retention_months: int = RETENTION_MONTHS,
+    action: str = RETENTION_ACTION,
+) -> tuple[list[str], list[str]]:
+    # conn - в режиме AUTOCOMMIT: DETACH PARTITION ... CONCURRENTLY нельзя выполнять в транзакции,
+    # а обычный DETACH берёт ACCESS EXCLUSIVE на queries и останавливает редиректы и запись переходов
+    now = datetime.now()
+    partitions = await list_partitions(conn)
+    created = []
+    for month in months_to_create(now, months_ahead):
+        if partition_name(month) not in partitions:
+            await conn.execute(text(partition_ddl(month)))
+            created.append(partition_name(month))
+
+    covered = months_covered(list(partitions) + created, now)
+    QUERIES_PARTITION_MONTHS_AHEAD.set(covered)
+    if covered < 1:
+        logger.error("Партиции queries созданы только на %d мес. вперёд, переходы скоро перестанут записываться", covered)
+
+    retired = partitions_to_retire(list(partitions), now, retention_months)
+    for name in retired:
+        # Отсоединение, прерванное на полпути, дозавершается через FINALIZE
+        mode = "FINALIZE" if partitions[name] else "CONCURRENTLY"
+        await conn.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name} {mode}"))
+        if action == "drop":
+            await conn.execute(text(f"DROP TABLE {name}"))
+    return created, retired
+
+
+async def run_maintenance(**options) -> None:
+    engine = get_engine()
+    if engine.dialect.name != "postgresql":
+        return
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        # Блокировка уровня сессии: работа идёт вне транзакции, снимаем её явно
+        locked = (await conn.execute(
+            text("SELECT pg_try_advisory_lock(:lock_id)"), {"lock_id": MAINTENANCE_LOCK_ID}
+        )).scalar_one()
+        if not locked:
+            return
+        try:
+            created, retired = await maintain_partitions(conn, **options)
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:lock_id)"), {"lock_id": MAINTENANCE_LOCK_ID})
+    if created or retired:
+        logger.info("Партиции queries: созданы %s, выведены %s", created, retired)
+
+
+async def maintenance_loop() -> None:
+    # Фоновая задача lifespan: заранее создаёт партиции и выводит старые по сроку хранения
+    while True:
+        try:
+            await run_maintenance()
+        except Exception:
+            logger.exception("Ошибка обслуживания партиций queries")
+        await asyncio.sleep(MAINTENANCE_INTERVAL)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Обслуживание партиций таблицы queries")
+    parser.add_argument("--months-ahead", type=int, default=MONTHS_AHEAD)
+    parser.add_argument("--retention-months", type=int, default=RETENTION_MONTHS)
+    parser.add_argument("--action", choices=["detach", "drop"], default=RETENTION_ACTION)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_maintenance(
+        months_ahead=args.months_ahead,
+        retention_months=args.retention_months,
+        action=args.action,
+    ))
@@ -0,0 +1,96 @@
+import logging
+import os
+import re
+import time
+
+from src.metrics import RequestDbStats, request_db_stats
+
+logger = logging.getLogger(__name__)
+
+# Профилировщик SQL включается отдельно (например, на стенде) - в проде хватает метрик из src/metrics.py
+SQL_PROFILER_ENABLED = os.getenv("SQL_PROFILER_ENABLED", "false").lower() in ("1", "true", "yes")
+# Сколько раз одна и та же форма запроса может повториться за запрос до предупреждения о N+1
+SQL_PROFILER_REPEAT_THRESHOLD = int(os.getenv("SQL_PROFILER_REPEAT_THRESHOLD", "5"))
+
+STATEMENTS_HEADER = "X-DB-Statements"
+DB_TIME_HEADER = "X-DB-Time-Ms"
+
+_IN_LIST = re.compile(r"\((?:\s*(?:\?|\$\d+|%\(\w+\)s|:\w+)\s*,)*\s*(?:\?|\$\d+|%\(\w+\)s|:\w+)\s*\)")
+_NUMBER = re.compile(r"\b\d+\b")
+_SPACES = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    # Форма запроса без значений: списки параметров IN (...) и числа схлопываются
+    shape = _SPACES.sub(" ", statement).strip()
+    shape = _IN_LIST.sub("(?)", shape)
+    return _NUMBER.sub("N", shape)
+
+
+def repeated_shapes(shapes: dict[str, int], threshold: int) -> dict[str, int]:
+    totals: dict[str, int] = {}
+    for statement, count in shapes.items():
+        shape = statement_shape(statement)
+        totals[shape] = totals.get(shape, 0) + count
+    return {shape: count for shape, count in totals.items() if count > threshold}
+
+
+class SqlProfilerMiddleware:
+    # Считает SQL-запросы и время в БД на HTTP-запрос, отдаёт их в заголовках ответа
+    # и в структурированном логе, предупреждает о повторяющихся запросах (N+1).
+    # Заголовки отражают запросы до начала ответа, лог - все запросы, включая стриминг.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not SQL_PROFILER_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        # Переиспользуем статистику MetricsMiddleware, если он стоит снаружи
+        stats = request_db_stats.get()
+        token = None
+        if stats is None:
+            stats = RequestDbStats()
+            token = request_db_stats.set(stats)
+        statements_before, duration_before = stats.statements, stats.duration
+        stats.shapes = {}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((STATEMENTS_HEADER.lower().encode(), str(stats.statements - statements_before).encode()))
+                headers.append((
+                    DB_TIME_HEADER.lower().encode(),
+                    f"{(stats.duration - duration_before) * 1000:.3f}".encode(),
+                ))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if token is not None:
+                request_db_stats.reset(token)
+            shapes, stats.shapes = stats.shapes, None
+            route = getattr(scope.get("route"), "path", "unmatched")
+            profile = {
+                "method": scope["method"],
+                "route": route,
+                "statements": stats.statements - statements_before,
+                "db_time_ms": round((stats.duration - duration_before) * 1000, 3),
+                "total_time_ms": round((time.perf_counter() - started) * 1000, 3),
+            }
+            logger.info(
+                "SQL %s %s: %d запросов, %.3f мс в БД",
+                profile["method"], route, profile["statements"], profile["db_time_ms"],
+                extra={"sql_profile": profile},
+            )
+            for shape, count in repeated_shapes(shapes, SQL_PROFILER_REPEAT_THRESHOLD).items():
+                logger.warning(
+                    "Возможный N+1 в %s %s: запрос повторился %d раз: %s",
+                    profile["method"], route, count, shape,
+                    extra={"sql_profile": {**profile, "shape": shape, "repeats": count}},
+                )
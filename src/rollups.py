@@ -0,0 +1,107 @@
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database import dialect_insert, get_session_maker
+from src.models import DailyClicks, HourlyClicks, Query
+
+ROLLUPS = {"hour": HourlyClicks, "day": DailyClicks}
+STEPS = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+
+
+def bucket_start(moment: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def aggregate_rollups(clicks: list[dict], granularity: str) -> list[dict]:
+    # Переход попадает в корзину по своему access_time, а не по времени обработки,
+    # поэтому опоздавшие переходы досчитываются в правильные корзины
+    totals: dict[tuple, int] = {}
+    for click in clicks:
+        key = (click["url_id"], bucket_start(click["access_time"], granularity))
+        totals[key] = totals.get(key, 0) + 1
+    return [
+        {"url_id": url_id, "bucket": bucket, "clicks": totals[(url_id, bucket)]}
+        for url_id, bucket in sorted(totals)
+    ]
+
+
+async def apply_rollups(session: AsyncSession, clicks: list[dict]) -> None:
+    # Инкрементальное обновление почасовых и подневных агрегатов пачкой переходов
+    for granularity, model in ROLLUPS.items():
+        rows = aggregate_rollups(clicks, granularity)
+        if not rows:
+            continue
+        stmt = dialect_insert(session, model).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[model.url_id, model.bucket],
+            set_={"clicks": model.clicks + stmt.excluded.clicks},
+        )
+        await session.execute(stmt)
+
+
+def _bucket_expr(session: AsyncSession, granularity: str):
+    if session.bind.dialect.name == "postgresql":
+        return func.date_trunc(granularity, Query.access_time)
+    # Формат совпадает с тем, как SQLAlchemy хранит DateTime в SQLite
+    pattern = "%Y-%m-%d %H:00:00.000000" if granularity == "hour" else "%Y-%m-%d 00:00:00.000000"
+    return func.strftime(pattern, Query.access_time)
+
+
+async def rebuild_rollups(session: AsyncSession, since: datetime, until: datetime) -> None:
+    # Пересчёт агрегатов за период по сырым переходам (с отсечением партиций по access_time)
+    for granularity, model in ROLLUPS.items():
+        start, end = bucket_start(since, granularity), bucket_start(until, granularity) + STEPS[granularity]
+        await session.execute(delete(model).where(model.bucket >= start, model.bucket < end))
+        bucket = _bucket_expr(session, granularity)
+        aggregated = (
+            select(Query.url_id, bucket, func.count(Query.id))
+            .where(Query.access_time >= start, Query.access_time < end)
+            .group_by(Query.url_id, bucket)
+        )
+        await session.execute(insert(model).from_select(["url_id", "bucket", "clicks"], aggregated))
+    await session.commit()
+
+
+async def read_timeseries(
+    session: AsyncSession,
+    url_id: int,
+    granularity: str,
+    since: datetime,
+    until: datetime,
+) -> list[dict]:
+    # Читаем только агрегаты, пустые корзины заполняем нулями
+    model = ROLLUPS[granularity]
+    start = bucket_start(since, granularity)
+    result = await session.execute(
+        select(model.bucket, model.clicks)
+        .where(model.url_id == url_id, model.bucket >= start, model.bucket <= until)
+        .order_by(model.bucket)
+    )
+    clicks = {row.bucket: row.clicks for row in result}
+    points = []
+    bucket = start
+    while bucket <= until:
+        points.append({"bucket": bucket, "clicks": clicks.get(bucket, 0)})
+        bucket += STEPS[granularity]
+    return points
+
+
+async def _main(since: datetime, until: Optional[datetime]) -> None:
+    async with get_session_maker()() as session:
+        await rebuild_rollups(session, since, until or datetime.now())
+    print("Агрегаты переходов пересчитаны.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Пересчёт почасовых и подневных агрегатов переходов по queries")
+    parser.add_argument("--since", type=datetime.fromisoformat, required=True)
+    parser.add_argument("--until", type=datetime.fromisoformat, default=None)
+    args = parser.parse_args()
+    asyncio.run(_main(args.since, args.until))
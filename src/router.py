@@ -1,21 +1,32 @@
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import RedirectResponse
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response, Query as QueryParam
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import RedirectResponse, StreamingResponse
 from typing import Optional
-from sqlalchemy import select, insert, delete, update, func
+from sqlalchemy import select, delete, update, func, or_, and_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from database import get_async_session
+from src.database import get_async_session, get_session_maker, dialect_insert
 from fastapi_cache.decorator import cache
-from fastapi_cache import FastAPICache
-from hashlib import sha256
-from datetime import datetime
-import time
-import uuid
-import re
-from urllib.parse import urlparse
+from datetime import datetime, timedelta
+import anyio
+import json
+import os
 
 from src.auth.users import current_active_user
-from src.models import Url, Query, User
+from src.models import ArchivedLink, Url, UrlStats, User
 from src.schemas import URLCreate
+from src.validation import alias_pattern, validate_new_url
+from src.clicks import click_buffer, make_click, write_clicks
+from src.lookup_cache import lookup_cache, LinkEntry, MISSING
+from src.cache import invalidate_links, key_by, SEARCH_NAMESPACE, STATS_NAMESPACE
+from src.codegen import code_generator, CODE_GENERATION_ATTEMPTS
+from src.rollups import read_timeseries, STEPS
+from src.pagination import encode_cursor, decode_cursor, NEXT_CURSOR_HEADER
+from src.metrics import REDIRECTS
+from src.url_keys import normalize_url, prefix_upper_bound, url_columns, url_hash, URL_HOST_MAX_LENGTH, URL_PATH_MAX_LENGTH
+from src.export import export_link_clicks, export_user_clicks, MEDIA_TYPES
+from src.admission import client_key
+from src.idempotency import key_scope, load_response, request_fingerprint, save_response, validate_key
 
 router = APIRouter(
     prefix="/links",
@@ -23,97 +34,203 @@ router = APIRouter(
 )
 
 
-# Функция для проверки url
-def valid_url(url: str) -> bool:
-    try:
-        result = urlparse(url)
-        return all([result.scheme, result.netloc])
-    except Exception:
-        return False
+# Режим по умолчанию для POST /links/shorten: вернуть существующий активный код для того же URL и автора
+SHORTEN_REUSE_EXISTING = os.getenv("SHORTEN_REUSE_EXISTING", "false").lower() in ("1", "true", "yes")
 
 
-# Паттерн для alias'a
-alias_pattern = re.compile(r'^[A-Za-z0-9_-]{1,20}$')
+# Максимальный размер батча для POST /links/shorten/batch
+SHORTEN_BATCH_MAX_SIZE = int(os.getenv("SHORTEN_BATCH_MAX_SIZE", "1000"))
 
-# Паттерн для expires_at
-datetime_pattern = re.compile(
-    r"^(?P<year>\d{4})-(?P<month>0[1-9]|1[0-2])-(?P<day>0[1-9]|[12]\d|3[01])\s(?P<hour>[01]\d|2[0-3]):(?P<minute>[0-5]\d)$"
-)
+
+# Период по умолчанию и ограничение на число точек для /{short_url}/stats/timeseries
+TIMESERIES_DEFAULT_PERIODS = {"hour": timedelta(hours=48), "day": timedelta(days=90)}
+TIMESERIES_MAX_POINTS = 2000
+
+
+# Корзины агрегатов и expires_at хранятся в наивном локальном времени,
+# поэтому границы с часовым поясом (например, ...Z) переводим в него же
+def _to_local_naive(moment: Optional[datetime]) -> Optional[datetime]:
+    if moment is None or moment.tzinfo is None:
+        return moment
+    return moment.astimezone().replace(tzinfo=None)
 
 
 # Ручка для проверки корректности работы кэша
 @router.get("/check_cache")
 @cache(expire=60)
 async def check_cache():
-    time.sleep(3)
+    # Неблокирующая пауза: time.sleep остановил бы цикл событий воркера вместе со всеми запросами
+    await anyio.sleep(3)
     return {"status": "success"}
 
 
+# Существующая активная ссылка того же автора на тот же (с точностью до нормализации) URL с тем же сроком жизни
+async def find_existing_link(
+    session: AsyncSession,
+    creator_id,
+    full_url: str,
+    expires_at: Optional[datetime],
+) -> Optional[str]:
+    normalized = normalize_url(full_url)
+    query = (
+        select(Url.short_url)
+        .where(
+            Url.creator_id.is_(None) if creator_id is None else Url.creator_id == creator_id,
+            Url.full_url_hash == url_hash(normalized),
+            Url.normalized_url == normalized,  # защита от коллизий, сравниваются только строки с тем же хэшем
+            Url.expires_at.is_(None) if expires_at is None else Url.expires_at == expires_at,
+            or_(Url.expires_at.is_(None), Url.expires_at > datetime.now()),
+        )
+        .order_by(Url.id)
+        .limit(1)
+    )
+    return (await session.execute(query)).scalar_one_or_none()
+
+
 @router.post("/shorten")
 async def shorten_url(
     new_url: URLCreate,
+    request: Request,
+    reuse_existing: Optional[bool] = None,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     session: AsyncSession = Depends(get_async_session),
     current_user: Optional[User] = Depends(current_active_user)  # Необязательная авторизация
 ):
-    # Проверка полного url'a
-    if not valid_url(new_url.full_url):
-        raise HTTPException(status_code=400, detail="Неверный формат URL.")
-
-    expires_at_dt = None
-    if new_url.expires_at:
-        # Проверка формата expires_at
-        if not datetime_pattern.match(new_url.expires_at):
-            raise HTTPException(
-                status_code=400,
-                detail=("Неверный формат expires_at. Ожидается формат YYYY-MM-DD HH:MM.")
-            )
-        expires_at_dt = datetime.fromisoformat(new_url.expires_at)
-
-    # Если задан кастомный alias, валидируем его формат
-    if new_url.custom_alias:
-        if not alias_pattern.match(new_url.custom_alias):
-            raise HTTPException(
-                status_code=400,
-                detail=("Неверный формат кастомного alias. Разрешены символы A-Z, a-z, 0-9, "
-                        "'-' и '_', длина 1-20 символов.")
-            )
-        short_url = new_url.custom_alias
-
-        # Проверка наличия данного alias'a в базе данных
-        query = select(Url).where(Url.short_url == short_url)
-        result = await session.execute(query)
-        if result.scalar_one_or_none():
-            raise HTTPException(
-                status_code=400,
-                detail="Указанный alias уже существует."
-            )
-    else:
-        # Если кастосный alias не задан, то делаем 3 попытки посолить и захэшировать ссылку
-        for i in range(3):
-            salt = uuid.uuid4().hex
-            salted_url = new_url.full_url + salt
-            short_url = sha256(salted_url.encode('utf-8')).hexdigest()[:10]
-            query = select(Url).where(Url.short_url == short_url)
-            result = await session.execute(query)
-            if not result.scalar_one_or_none():
-                break
-            if i == 2:
-                raise HTTPException(
-                    status_code=500,
-                    detail="Не удалось сгенерировать уникальный короткий URL. Попробуйте повторить запрос позже."
-                )
+    expires_at_dt = validate_new_url(new_url)
+    creator_id = current_user.id if current_user else None
+    if reuse_existing is None:
+        reuse_existing = SHORTEN_REUSE_EXISTING
+
+    # Повтор запроса с тем же Idempotency-Key получает исходный ответ без новой записи
+    if idempotency_key is not None:
+        validate_key(idempotency_key)
+        scope = key_scope(creator_id, client_key(request.scope))
+        fingerprint = request_fingerprint({**new_url.model_dump(), "reuse_existing": reuse_existing})
+        stored = await load_response(session, scope, idempotency_key, fingerprint)
+        if stored is not None:
+            return stored
+
+    if reuse_existing and not new_url.custom_alias:
+        existing = await find_existing_link(session, creator_id, new_url.full_url, expires_at_dt)
+        if existing is not None:
+            response = {"status": "success", "short_url": existing}
+            if idempotency_key is not None:
+                if not await save_response(session, scope, idempotency_key, fingerprint, response):
+                    await session.rollback()
+                    return await load_response(session, scope, idempotency_key, fingerprint)
+                await session.commit()
+            return response
 
     values = new_url.model_dump(exclude={"custom_alias", "expires_at"})
-    values["short_url"] = short_url
     values["creation_time"] = datetime.now()
-    values["creator_id"] = current_user.id if current_user else None
+    values["creator_id"] = creator_id
+    values.update(url_columns(new_url.full_url))
     if expires_at_dt:
         values["expires_at"] = expires_at_dt
 
-    # Сохраняем новый шорткат
-    statement = insert(Url).values(**values)
+    # Один INSERT ... ON CONFLICT DO NOTHING RETURNING вместо проверки alias'а отдельным SELECT:
+    # пустой RETURNING означает, что код уже занят. Сгенерированный код уникален по построению,
+    # редкое совпадение с чужим кастомным alias'ом повторяется с новым кодом
+    for attempt in range(CODE_GENERATION_ATTEMPTS):
+        short_url = new_url.custom_alias or await code_generator.next_code()
+        values["short_url"] = short_url
+        response = {"status": "success", "short_url": short_url}
+        stmt = dialect_insert(session, Url).values(**values)
+        stmt = stmt.on_conflict_do_nothing(index_elements=[Url.short_url]).returning(Url.short_url)
+        key_taken = False
+        try:
+            inserted = (await session.execute(stmt)).scalar_one_or_none()
+            # Ответ по ключу сохраняется в той же транзакции, что и ссылка
+            if inserted is not None and idempotency_key is not None:
+                key_taken = not await save_response(session, scope, idempotency_key, fingerprint, response)
+            if key_taken:
+                await session.rollback()
+            else:
+                await session.commit()
+        except Exception as e:
+            await session.rollback()
+            raise HTTPException(
+                status_code=500,
+                detail=f"Произошла непредвиденная ошибка. Попробуйте повторить запрос позже. {e}"
+            ) from e
+        if key_taken:
+            # Параллельный повтор с тем же ключом успел первым
+            return await load_response(session, scope, idempotency_key, fingerprint)
+        if inserted is not None:
+            break
+        if new_url.custom_alias:
+            raise HTTPException(status_code=400, detail="Указанный alias уже существует.")
+        if attempt == CODE_GENERATION_ATTEMPTS - 1:
+            raise HTTPException(
+                status_code=500,
+                detail="Не удалось сгенерировать уникальный короткий URL. Попробуйте повторить запрос позже."
+            )
+    # Код мог быть закэширован как несуществующий, а поиск по full_url - без новой ссылки
+    await invalidate_links([short_url], [new_url.full_url])
+    return response
+
+
+@router.post("/shorten/batch")
+async def shorten_urls_batch(
+    new_urls: list[URLCreate],
+    session: AsyncSession = Depends(get_async_session),
+    current_user: Optional[User] = Depends(current_active_user)  # Необязательная авторизация
+):
+    if len(new_urls) > SHORTEN_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Слишком много ссылок в одном запросе, максимум {SHORTEN_BATCH_MAX_SIZE}."
+        )
+
+    # Валидируем все ссылки за один проход, ошибки возвращаются по каждой ссылке отдельно
+    results: list[dict] = [{"index": i} for i in range(len(new_urls))]
+    rows: dict[int, dict] = {}
+    aliases: set[str] = set()
+    creation_time = datetime.now()
+    for i, new_url in enumerate(new_urls):
+        try:
+            expires_at_dt = validate_new_url(new_url)
+        except HTTPException as e:
+            results[i].update(status="error", detail=e.detail)
+            continue
+        if new_url.custom_alias:
+            if new_url.custom_alias in aliases:
+                results[i].update(status="error", detail="Указанный alias уже существует.")
+                continue
+            aliases.add(new_url.custom_alias)
+        rows[i] = {
+            "full_url": new_url.full_url,
+            **url_columns(new_url.full_url),
+            "short_url": new_url.custom_alias,
+            "creation_time": creation_time,
+            "creator_id": current_user.id if current_user else None,
+            "expires_at": expires_at_dt,
+        }
+
+    # Одна многострочная вставка на весь батч; занятые alias'ы пропускаются через ON CONFLICT.
+    # Сгенерированные коды, совпавшие с чужим alias'ом, перевыпускаются в той же транзакции.
+    pending = dict(rows)
     try:
-        await session.execute(statement)
+        for attempt in range(CODE_GENERATION_ATTEMPTS):
+            generated = [i for i in pending if not new_urls[i].custom_alias]
+            for i, code in zip(generated, await code_generator.next_codes(len(generated))):
+                pending[i]["short_url"] = code
+            if not pending:
+                break
+            stmt = (
+                dialect_insert(session, Url)
+                .values(list(pending.values()))
+                .on_conflict_do_nothing(index_elements=[Url.short_url])
+                .returning(Url.short_url)
+            )
+            inserted = set((await session.execute(stmt)).scalars().all())
+            for i, row in list(pending.items()):
+                if row["short_url"] in inserted:
+                    results[i].update(status="success", short_url=row["short_url"])
+                    del pending[i]
+                elif new_urls[i].custom_alias:
+                    results[i].update(status="error", detail="Указанный alias уже существует.")
+                    del pending[i]
         await session.commit()
     except Exception as e:
         await session.rollback()
@@ -121,17 +238,32 @@ async def shorten_url(
             status_code=500,
             detail=f"Произошла непредвиденная ошибка. Попробуйте повторить запрос позже. {e}"
         ) from e
-    await FastAPICache.clear()  # Очистка кэша
-    return {"status": "success", "short_url": short_url}
+
+    for i in pending:
+        results[i].update(
+            status="error",
+            detail="Не удалось сгенерировать уникальный короткий URL. Попробуйте повторить запрос позже."
+        )
+
+    created = [i for i in rows if results[i]["status"] == "success"]
+    # Одна инвалидация кэша на весь батч
+    await invalidate_links(
+        [results[i]["short_url"] for i in created],
+        [new_urls[i].full_url for i in created]
+    )
+    return {"status": "success", "results": results}
 
 
 @router.get("/search")
-@cache(expire=60)
+@cache(expire=60, namespace=SEARCH_NAMESPACE, key_builder=key_by("full_url", normalize_url))
 async def search_link(
     full_url: str,
     session: AsyncSession = Depends(get_async_session)
 ):
-    query = select(Url).where(Url.full_url == full_url)
+    # Поиск по хэшу нормализованного URL: стоимость не зависит от длины URL,
+    # эквивалентные записи (регистр хоста, слэш в конце, порядок параметров) совпадают
+    normalized = normalize_url(full_url)
+    query = select(Url).where(Url.full_url_hash == url_hash(normalized), Url.normalized_url == normalized)
     result = await session.execute(query)
     records = result.scalars().all()  # Было сделано так, что одна ссылка может иметь множество alias'ов, поэтому выводится список всех
 
@@ -149,27 +281,156 @@ async def search_link(
     ]
 
 
+# Поиск ссылок по домену и/или префиксу пути, keyset-пагинация по (url_path, id)
+@router.get("/search/domain")
+async def search_by_domain(
+    response: Response,
+    host: Optional[str] = None,
+    path_prefix: Optional[str] = None,
+    limit: int = QueryParam(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    session: AsyncSession = Depends(get_async_session)
+):
+    if not host and not path_prefix:
+        raise HTTPException(status_code=400, detail="Нужно указать host и/или path_prefix.")
+
+    query = (
+        select(Url.id, Url.short_url, Url.full_url, Url.url_path, Url.creation_time, Url.expires_at)
+        .order_by(Url.url_path, Url.id)
+        .limit(limit)
+    )
+    if host:
+        query = query.where(Url.url_host == host.strip().lower()[:URL_HOST_MAX_LENGTH])
+    if path_prefix:
+        if not path_prefix.startswith("/"):
+            path_prefix = "/" + path_prefix
+        if len(path_prefix) <= URL_PATH_MAX_LENGTH:
+            query = query.where(Url.url_path >= path_prefix, Url.url_path < prefix_upper_bound(path_prefix))
+        else:
+            # В url_path хранится только начало пути: индекс сужает выборку до ссылок с тем же началом,
+            # остаток префикса проверяется по нормализованному URL
+            query = query.where(
+                Url.url_path == path_prefix[:URL_PATH_MAX_LENGTH],
+                Url.normalized_url.contains(path_prefix, autoescape=True),
+            )
+    if cursor:
+        url_path, url_id = decode_cursor(cursor, str, int)
+        query = query.where(or_(Url.url_path > url_path, and_(Url.url_path == url_path, Url.id > url_id)))
+
+    rows = (await session.execute(query)).all()
+    if len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1].url_path, rows[-1].id)
+    return [
+        {
+            "full_url": row.full_url,
+            "short_url": row.short_url,
+            "creation_time": row.creation_time,
+            "expires_at": row.expires_at
+        }
+        for row in rows
+    ]
+
+
+# Ссылки текущего пользователя со счётчиками переходов одним запросом,
+# keyset-пагинация по (creation_time, id) от новых к старым
+@router.get("/mine")
+async def get_my_links(
+    response: Response,
+    limit: int = QueryParam(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(current_active_user)  # Обязательная авторизация
+):
+    if current_user is None:
+        raise HTTPException(status_code=403, detail="Чтобы получить доступ, надо залогиниться.")
+
+    query = (
+        select(
+            Url.id,
+            Url.short_url,
+            Url.full_url,
+            Url.creation_time,
+            Url.expires_at,
+            func.coalesce(UrlStats.access_count, 0).label("access_count"),
+            UrlStats.last_access
+        )
+        .outerjoin(UrlStats, UrlStats.url_id == Url.id)
+        .where(Url.creator_id == current_user.id)
+        .order_by(Url.creation_time.desc(), Url.id.desc())
+        .limit(limit)
+    )
+    if cursor:
+        creation_time, url_id = decode_cursor(cursor, datetime, int)
+        query = query.where(
+            or_(Url.creation_time < creation_time, and_(Url.creation_time == creation_time, Url.id < url_id))
+        )
+
+    rows = (await session.execute(query)).all()
+    if len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1].creation_time, rows[-1].id)
+    return [
+        {
+            "short_url": row.short_url,
+            "full_url": row.full_url,
+            "creation_time": row.creation_time,
+            "expires_at": row.expires_at,
+            "access_count": row.access_count,
+            "last_access": row.last_access
+        }
+        for row in rows
+    ]
+
+
+# Выгрузка всех переходов по ссылкам текущего пользователя (CSV или NDJSON потоком)
+@router.get("/mine/clicks/export")
+async def export_my_clicks(
+    format: str = QueryParam("csv", pattern="^(csv|ndjson)$"),
+    current_user: User = Depends(current_active_user)  # Обязательная авторизация
+):
+    if current_user is None:
+        raise HTTPException(status_code=403, detail="Чтобы получить доступ, надо залогиниться.")
+    return StreamingResponse(
+        export_user_clicks(current_user.id, format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="clicks.{format}"'}
+    )
+
+
+# Поиск ссылки по короткому коду через кэш (в т.ч. кэшируется отсутствие ссылки).
+# Метка промаха не даёт записать в кэш ссылку, изменённую между чтением из БД и записью
+async def resolve_link(short_url: str, session: AsyncSession) -> Optional[LinkEntry]:
+    record, seen = await lookup_cache.lookup(short_url)
+    if record is MISSING:
+        query = select(Url.id, Url.full_url, Url.expires_at).where(Url.short_url == short_url)
+        result = await session.execute(query)
+        row = result.one_or_none()
+        record = LinkEntry(*row) if row else None
+        await lookup_cache.set(short_url, record, seen)
+    return record
+
+
 @router.get("/{short_url}")
-@cache(expire=60)
 async def redirect(short_url: str, session: AsyncSession = Depends(get_async_session)):
-    query = select(Url).where(Url.short_url == short_url)
-    result = await session.execute(query)
-    record = result.scalar_one_or_none()
+    # Ответ редиректа не кэшируется целиком, иначе переход не будет засчитан
+    record = await resolve_link(short_url, session)
 
     if record is None:
+        REDIRECTS.labels("not_found").inc()
         raise HTTPException(status_code=404, detail="Короткий URL не найден.")
 
     if record.expires_at and record.expires_at < datetime.now():
+        REDIRECTS.labels("expired").inc()
         raise HTTPException(status_code=404, detail="Ссылка больше недоступна.")
 
+    REDIRECTS.labels("ok").inc()
+    click = make_click(record.id, record.full_url, short_url)
+    # Если фоновый буфер запущен, переход запишется пачкой без ожидания БД
+    if click_buffer.running:
+        click_buffer.add(click)
+        return RedirectResponse(url=record.full_url)
+
     try:
-        insert_query = insert(Query).values(
-            url_id=record.id,
-            full_url=record.full_url,
-            short_url=record.short_url,
-            access_time=datetime.now()
-        )
-        await session.execute(insert_query)
+        await write_clicks(session, [click])
         await session.commit()
 
         return RedirectResponse(url=record.full_url)
@@ -181,31 +442,39 @@ async def redirect(short_url: str, session: AsyncSession = Depends(get_async_ses
         ) from e
 
 
+# Условие "ссылку может менять текущий пользователь": анонимные ссылки может менять любой авторизованный
+def _owned_by(short_url: str, current_user: User):
+    return and_(
+        Url.short_url == short_url,
+        or_(Url.creator_id.is_(None), Url.creator_id == current_user.id),
+    )
+
+
+# Проверка доступа для путей с ошибкой: SELECT нужен только чтобы отличить 404 от 403,
+# успешные изменения проверяют владельца прямо в UPDATE/DELETE
+async def _check_access(session: AsyncSession, short_url: str, current_user: User) -> None:
+    result = await session.execute(select(Url.creator_id).where(Url.short_url == short_url))
+    row = result.one_or_none()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Короткий URL не найден.")
+    if row.creator_id is not None and row.creator_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Нет прав.")
+
+
 @router.delete("/{short_url}")
 async def delete_url(
     short_url: str,
     session: AsyncSession = Depends(get_async_session),
     current_user: User = Depends(current_active_user)  # Обязательная авторизация
 ):
-    query = select(Url).where(Url.short_url == short_url)
-    result = await session.execute(query)
-    record = result.scalar_one_or_none()
-
     if current_user is None:
         raise HTTPException(status_code=403, detail="Чтобы получить доступ, надо залогиниться.")
 
-    if record is None:
-        raise HTTPException(status_code=404, detail="Короткий URL не найден.")
-
-    if record.creator_id is not None and record.creator_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Нет прав.")
-
+    # Проверка владельца и удаление одним запросом
+    stmt = delete(Url).where(_owned_by(short_url, current_user)).returning(Url.full_url)
     try:
-        stmt = delete(Url).where(Url.short_url == short_url)
-        await session.execute(stmt)
+        full_url = (await session.execute(stmt)).scalar_one_or_none()
         await session.commit()
-        await FastAPICache.clear()  # Очистка кэша
-        return {"status": "success", "message": "Ссылка удалена."}
     except Exception as e:
         await session.rollback()
         raise HTTPException(
@@ -213,6 +482,14 @@ async def delete_url(
             detail="Произошла непредвиденная ошибка. Попробуйте повторить запрос позже. {e}"
         ) from e
 
+    if full_url is None:
+        await _check_access(session, short_url, current_user)
+        # Ссылку успели удалить или создать заново между запросами
+        raise HTTPException(status_code=404, detail="Короткий URL не найден.")
+
+    await invalidate_links([short_url], [full_url])
+    return {"status": "success", "message": "Ссылка удалена."}
+
 
 @router.put("/{short_url}")
 async def put_url(
@@ -221,106 +498,134 @@ async def put_url(
     session: AsyncSession = Depends(get_async_session),
     current_user: User = Depends(current_active_user)  # Обязательная авторизация
 ):
-    # Получаем запись из базы по текущему короткому URL
-    query = select(Url).where(Url.short_url == short_url)
-    result = await session.execute(query)
-    record = result.scalar_one_or_none()
-
     if current_user is None:
         raise HTTPException(status_code=403, detail="Чтобы получить доступ, надо залогиниться.")
 
-    if record is None:
-        raise HTTPException(status_code=404, detail="Короткий URL не найден.")
-
-    if record.creator_id is not None and record.creator_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Нет прав.")
-
     if new_alias:
+        # Неверный alias или переименование в самого себя - ошибка, но сначала 404/403, как для любой записи
         if not alias_pattern.match(new_alias):
+            await _check_access(session, short_url, current_user)
             raise HTTPException(
                 status_code=400,
                 detail=("Неверный формат кастомного alias. Разрешены символы A-Z, a-z, 0-9, "
                         "'-' и '_', длина 1-20 символов.")
             )
-
-        # Проверка наличия данного alias'a в базе данных
-        query = select(Url).where(Url.short_url == new_alias)
-        result = await session.execute(query)
-        if result.scalar_one_or_none():
-            raise HTTPException(
-                status_code=400,
-                detail="Указанный alias уже существует."
-            )
-    else:
-        # Если кастосный alias не задан, то делаем 3 попытки посолить и захэшировать ссылку
-        for i in range(3):
-            salt = uuid.uuid4().hex
-            new_alias = sha256(salt.encode('utf-8')).hexdigest()[:10]
-            query = select(Url).where(Url.short_url == new_alias)
-            result = await session.execute(query)
-            if not result.scalar_one_or_none():
-                break
-            if i == 2:
+        if new_alias == short_url:
+            await _check_access(session, short_url, current_user)
+            raise HTTPException(status_code=400, detail="Указанный alias уже существует.")
+
+    # Проверка владельца и переименование одним запросом, занятый alias ловит уникальный индекс.
+    # Как и в shorten, сгенерированный код, совпавший с чужим alias'ом, перевыпускается
+    custom_alias = new_alias
+    for attempt in range(CODE_GENERATION_ATTEMPTS):
+        new_alias = custom_alias or await code_generator.next_code()
+        stmt = (
+            update(Url)
+            .where(_owned_by(short_url, current_user))
+            .values(short_url=new_alias, creation_time=datetime.now())
+            .returning(Url.full_url)
+        )
+        try:
+            full_url = (await session.execute(stmt)).scalar_one_or_none()
+            await session.commit()
+        except IntegrityError as e:
+            await session.rollback()
+            if custom_alias:
+                raise HTTPException(status_code=400, detail="Указанный alias уже существует.") from e
+            if attempt == CODE_GENERATION_ATTEMPTS - 1:
                 raise HTTPException(
                     status_code=500,
                     detail="Не удалось сгенерировать уникальный короткий URL. Попробуйте повторить запрос позже."
-                )
+                ) from e
+            continue
+        except Exception as e:
+            await session.rollback()
+            raise HTTPException(
+                status_code=500,
+                detail=f"Произошла непредвиденная ошибка. Попробуйте повторить запрос позже. {str(e)}"
+            ) from e
+        break
+
+    if full_url is None:
+        await _check_access(session, short_url, current_user)
+        # Ссылку успели удалить или создать заново между запросами
+        raise HTTPException(status_code=404, detail="Короткий URL не найден.")
 
-    # Проверяем, не существует ли уже другой записи с таким новым коротким URL
-    query = select(Url).where(Url.short_url == new_alias, Url.id != record.id)
-    result = await session.execute(query)
-    if result.scalar_one_or_none():
-        raise HTTPException(status_code=400, detail="Указанный alias уже существует.")
+    await invalidate_links([short_url, new_alias], [full_url])
+    return {"status": "success", "short_url": new_alias}
 
-    # Подготавливаем данные для обновления записи
-    update_data = {}
-    update_data["short_url"] = new_alias
-    update_data["creation_time"] = datetime.now()
 
-    # Выполняем обновление записи в базе данных
-    stmt = update(Url).where(Url.id == record.id).values(**update_data)
-    try:
-        await session.execute(stmt)
-        await session.commit()
-        await FastAPICache.clear()  # Очистка кэша
-    except Exception as e:
-        await session.rollback()
-        raise HTTPException(
-            status_code=500,
-            detail=f"Произошла непредвиденная ошибка. Попробуйте повторить запрос позже. {str(e)}"
-        ) from e
+def _expired_stats_query(now: datetime, limit: int, after: Optional[tuple] = None):
+    # Одна выборка со счётчиками из url_stats вместо запроса на каждую ссылку,
+    # keyset-пагинация по (expires_at, id)
+    query = (
+        select(
+            Url.id,
+            Url.short_url,
+            Url.full_url,
+            Url.creation_time,
+            Url.expires_at,
+            func.coalesce(UrlStats.access_count, 0).label("access_count"),
+            UrlStats.last_access
+        )
+        .outerjoin(UrlStats, UrlStats.url_id == Url.id)
+        .where(Url.expires_at < now)
+        .order_by(Url.expires_at, Url.id)
+        .limit(limit)
+    )
+    if after is not None:
+        expires_at, url_id = after
+        query = query.where(
+            or_(Url.expires_at > expires_at, and_(Url.expires_at == expires_at, Url.id > url_id))
+        )
+    return query
+
+
+def _expired_stats_row(row) -> dict:
+    return {
+        "short_url": row.short_url,
+        "original_url": row.full_url,
+        "creation_time": row.creation_time,
+        "expires_at": row.expires_at,
+        "access_count": row.access_count,
+        "last_access": row.last_access
+    }
 
-    return {"status": "success", "short_url": new_alias}
+
+async def _stream_expired_stats(now: datetime, after: Optional[tuple], page_size: int):
+    # Постранично отдаём NDJSON, соединение из пула берётся только на время чтения страницы
+    while True:
+        async with get_session_maker()() as session:
+            rows = (await session.execute(_expired_stats_query(now, page_size, after))).all()
+        for row in rows:
+            yield json.dumps(jsonable_encoder(_expired_stats_row(row)), ensure_ascii=False) + "\n"
+        if len(rows) < page_size:
+            break
+        after = (rows[-1].expires_at, rows[-1].id)
 
 
 @router.get("/expired/stats")
-@cache(expire=60)
 async def get_expired_links_stats(
+    response: Response,
+    limit: int = QueryParam(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    format: str = QueryParam("json", pattern="^(json|ndjson)$"),
     session: AsyncSession = Depends(get_async_session)
 ):
-    # Получаем все просроченные ссылки
-    query = select(Url).where(Url.expires_at < datetime.now())
-    result = await session.execute(query)
-    expired_links = result.scalars().all()
+    # Курсор следующей страницы возвращается в заголовке X-Next-Cursor,
+    # format=ndjson отдаёт все протухшие ссылки потоком, начиная с cursor
+    now = datetime.now()
+    after = decode_cursor(cursor, datetime, int) if cursor else None
+
+    if format == "ndjson":
+        return StreamingResponse(
+            _stream_expired_stats(now, after, limit),
+            media_type="application/x-ndjson"
+        )
 
-    stats_list = []
     try:
-        for link in expired_links:
-            stats_query = select(
-                func.count(Query.id).label("access_count"),
-                func.max(Query.access_time).label("last_access")
-            ).where(Query.url_id == link.id)
-            stats_result = await session.execute(stats_query)
-            stats = stats_result.one()
-
-            stats_list.append({
-                "original_url": link.full_url,
-                "creation_time": link.creation_time,
-                "access_count": stats.access_count,
-                "last_access": stats.last_access
-            })
-        return stats_list
-
+        result = await session.execute(_expired_stats_query(now, limit, after))
+        rows = result.all()
     except Exception as e:
         await session.rollback()
         raise HTTPException(
@@ -328,37 +633,139 @@ async def get_expired_links_stats(
             detail=f"Произошла непредвиденная ошибка. Попробуйте повторить запрос позже. {str(e)}"
         ) from e
 
+    if len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1].expires_at, rows[-1].id)
+    return [_expired_stats_row(row) for row in rows]
 
-@router.get("/{short_url}/stats")
-@cache(expire=60)
-async def get_link_stats(
-    short_url: str,
+
+# Итоговая статистика протухших ссылок, которые фоновая очистка уже удалила (src/sweeper.py)
+@router.get("/expired/archive")
+async def get_archived_links_stats(
+    response: Response,
+    limit: int = QueryParam(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
     session: AsyncSession = Depends(get_async_session)
 ):
-    query = select(Url).where(Url.short_url == short_url)
-    result = await session.execute(query)
-    record = result.scalar_one_or_none()
+    # Та же форма запроса, что и для живых протухших ссылок: диапазон по expires_at + keyset
+    query = (
+        select(ArchivedLink)
+        .where(ArchivedLink.expires_at < datetime.now())
+        .order_by(ArchivedLink.expires_at, ArchivedLink.url_id)
+        .limit(limit)
+    )
+    if cursor:
+        expires_at, url_id = decode_cursor(cursor, datetime, int)
+        query = query.where(
+            or_(
+                ArchivedLink.expires_at > expires_at,
+                and_(ArchivedLink.expires_at == expires_at, ArchivedLink.url_id > url_id),
+            )
+        )
+    rows = (await session.execute(query)).scalars().all()
 
-    if record is None:
+    if len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1].expires_at, rows[-1].url_id)
+    return [
+        {
+            "short_url": row.short_url,
+            "original_url": row.full_url,
+            "creation_time": row.creation_time,
+            "expires_at": row.expires_at,
+            "access_count": row.access_count,
+            "last_access": row.last_access,
+            "purged_at": row.purged_at
+        }
+        for row in rows
+    ]
+
+
+# Выгрузка переходов по ссылке (CSV или NDJSON потоком), доступна тем, кто может менять ссылку
+@router.get("/{short_url}/clicks/export")
+async def export_clicks(
+    short_url: str,
+    format: str = QueryParam("csv", pattern="^(csv|ndjson)$"),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(current_active_user)  # Обязательная авторизация
+):
+    if current_user is None:
+        raise HTTPException(status_code=403, detail="Чтобы получить доступ, надо залогиниться.")
+
+    result = await session.execute(select(Url.id).where(_owned_by(short_url, current_user)))
+    url_id = result.scalar_one_or_none()
+    if url_id is None:
+        await _check_access(session, short_url, current_user)
         raise HTTPException(status_code=404, detail="Короткий URL не найден.")
+    # Соединение обработчика освобождается до начала выгрузки, дальше каждый кусок читается в своей сессии
+    await session.close()
+
+    return StreamingResponse(
+        export_link_clicks(url_id, format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{short_url}-clicks.{format}"'}
+    )
+
 
+@router.get("/{short_url}/stats")
+@cache(expire=60, namespace=STATS_NAMESPACE, key_builder=key_by("short_url"))
+async def get_link_stats(
+    short_url: str,
+    session: AsyncSession = Depends(get_async_session)
+):
+    # Счётчики поддерживаются инкрементально в url_stats, поэтому читаем одну строку
+    query = (
+        select(
+            Url.full_url,
+            Url.creation_time,
+            func.coalesce(UrlStats.access_count, 0).label("access_count"),
+            UrlStats.last_access
+        )
+        .outerjoin(UrlStats, UrlStats.url_id == Url.id)
+        .where(Url.short_url == short_url)
+    )
     try:
-        query = select(
-            func.count(Query.id).label("access_count"),
-            func.max(Query.access_time).label("last_access")
-        ).where(Query.url_id == record.id)
         result = await session.execute(query)
-        stats = result.one()
-
-        return {
-            "original_url": record.full_url,
-            "creation_time": record.creation_time,
-            "access_count": stats.access_count,
-            "last_access": stats.last_access
-        }
+        record = result.one_or_none()
     except Exception as e:
         await session.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Произошла непредвиденная ошибка. Попробуйте повторить запрос позже. {str(e)}"
         ) from e
+
+    if record is None:
+        raise HTTPException(status_code=404, detail="Короткий URL не найден.")
+
+    return {
+        "original_url": record.full_url,
+        "creation_time": record.creation_time,
+        "access_count": record.access_count,
+        "last_access": record.last_access
+    }
+
+
+@router.get("/{short_url}/stats/timeseries")
+async def get_link_timeseries(
+    short_url: str,
+    granularity: str = QueryParam("day", pattern="^(hour|day)$"),
+    since: Optional[datetime] = QueryParam(None, alias="from"),
+    until: Optional[datetime] = QueryParam(None, alias="to"),
+    session: AsyncSession = Depends(get_async_session)
+):
+    # Количество переходов по часам или дням, читается только из агрегатов
+    since, until = _to_local_naive(since), _to_local_naive(until)
+    until = until or datetime.now()
+    since = since or until - TIMESERIES_DEFAULT_PERIODS[granularity]
+    if since > until:
+        raise HTTPException(status_code=400, detail="Начало периода должно быть раньше конца.")
+    if (until - since) / STEPS[granularity] > TIMESERIES_MAX_POINTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Слишком длинный период, максимум {TIMESERIES_MAX_POINTS} точек."
+        )
+
+    record = await resolve_link(short_url, session)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Короткий URL не найден.")
+
+    points = await read_timeseries(session, record.id, granularity, since, until)
+    return {"short_url": short_url, "granularity": granularity, "points": points}
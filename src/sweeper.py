@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, func, select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.cache import invalidate_links
+from src.database import dialect_insert, get_session_maker
+from src.idempotency import IDEMPOTENCY_KEY_TTL, purge_idempotency_keys
+from src.models import ArchivedLink, HourlyClicks, Query, Url, UrlStats
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-lock: одновременно очищает только одна пачка во всём кластере
+SWEEPER_LOCK_ID = 72390518
+
+SWEEPER_ENABLED = os.getenv("SWEEPER_ENABLED", "1") == "1"
+SWEEPER_GRACE = timedelta(hours=float(os.getenv("SWEEPER_GRACE_HOURS", "168")))
+SWEEPER_BATCH_SIZE = int(os.getenv("SWEEPER_BATCH_SIZE", "100"))
+# Сколько строк переходов и почасовых агрегатов удаляется одной транзакцией
+SWEEPER_CHUNK_SIZE = int(os.getenv("SWEEPER_CHUNK_SIZE", "5000"))
+SWEEPER_MAX_BATCHES = int(os.getenv("SWEEPER_MAX_BATCHES", "50"))
+SWEEPER_BATCH_PAUSE = float(os.getenv("SWEEPER_BATCH_PAUSE", "0.5"))
+SWEEPER_INTERVAL = float(os.getenv("SWEEPER_INTERVAL", "300"))
+
+
+async def _try_lock(session: AsyncSession) -> bool:
+    # Блокировка на время текущей транзакции, в SQLite (тесты) конкурентов нет
+    if session.bind.dialect.name != "postgresql":
+        return True
+    return (await session.execute(
+        text("SELECT pg_try_advisory_xact_lock(:lock_id)"), {"lock_id": SWEEPER_LOCK_ID}
+    )).scalar_one()
+
+
+async def purge_link_clicks(
+    session: AsyncSession, url_ids: list[int], chunk_size: int = SWEEPER_CHUNK_SIZE
+) -> Optional[int]:
+    # Переходы и почасовые агрегаты ссылок удаляются кусками по chunk_size строк, каждый кусок -
+    # отдельная короткая транзакция. Иначе каскад из DELETE FROM urls удалил бы за одну
+    # транзакцию все переходы пачки (у популярной ссылки их миллионы). Протухшие ссылки
+    # новых переходов не получают, поэтому промежуточные коммиты безопасны.
+    # None - очисткой уже занят другой воркер.
+    deleted = 0
+    for model, key in ((Query, (Query.id,)), (HourlyClicks, (HourlyClicks.url_id, HourlyClicks.bucket))):
+        while True:
+            if not await _try_lock(session):
+                await session.rollback()
+                return None
+            chunk = select(*key).where(model.url_id.in_(url_ids)).limit(chunk_size)
+            result = await session.execute(
+                delete(model).where(model.url_id.in_(url_ids), tuple_(*key).in_(chunk))
+            )
+            await session.commit()
+            deleted += result.rowcount
+            if result.rowcount < chunk_size:
+                break
+    return deleted
+
+
+async def purge_expired_batch(
+    session: AsyncSession,
+    now: datetime,
+    grace: timedelta = SWEEPER_GRACE,
+    batch_size: int = SWEEPER_BATCH_SIZE,
+    chunk_size: int = SWEEPER_CHUNK_SIZE,
+) -> list[tuple[str, str]]:
+    # Архивирует и удаляет одну небольшую пачку ссылок, протухших раньше now - grace.
+    # Возвращает (short_url, full_url) удалённых ссылок.
+    candidates = (await session.execute(
+        select(Url.id).where(Url.expires_at < now - grace).order_by(Url.expires_at, Url.id).limit(batch_size)
+    )).scalars().all()
+    await session.rollback()
+    if not candidates:
+        return []
+    if await purge_link_clicks(session, candidates, chunk_size) is None:
+        return []
+
+    if not await _try_lock(session):
+        await session.rollback()
+        return []
+
+    query = (
+        select(
+            Url.id,
+            Url.creator_id,
+            Url.full_url,
+            Url.short_url,
+            Url.creation_time,
+            Url.expires_at,
+            func.coalesce(UrlStats.access_count, 0).label("access_count"),
+            UrlStats.last_access
+        )
+        .outerjoin(UrlStats, UrlStats.url_id == Url.id)
+        .where(Url.id.in_(candidates), Url.expires_at < now - grace)
+        .order_by(Url.expires_at, Url.id)
+    )
+    if session.bind.dialect.name == "postgresql":
+        query = query.with_for_update(of=Url, skip_locked=True)
+    rows = (await session.execute(query)).all()
+    if not rows:
+        await session.rollback()
+        return []
+
+    archive = dialect_insert(session, ArchivedLink).values([
+        {
+            "url_id": row.id,
+            "creator_id": row.creator_id,
+            "full_url": row.full_url,
+            "short_url": row.short_url,
+            "creation_time": row.creation_time,
+            "expires_at": row.expires_at,
+            "access_count": row.access_count,
+            "last_access": row.last_access,
+            "purged_at": now,
+        }
+        for row in rows
+    ]).on_conflict_do_nothing(index_elements=[ArchivedLink.url_id])
+    await session.execute(archive)
+    # Оставшиеся счётчики и подневные агрегаты (по строке на день) удаляются каскадом
+    await session.execute(delete(Url).where(Url.id.in_([row.id for row in rows])))
+    await session.commit()
+    return [(row.short_url, row.full_url) for row in rows]
+
+
+async def sweep_once(
+    max_batches: int = SWEEPER_MAX_BATCHES,
+    pause: float = SWEEPER_BATCH_PAUSE,
+) -> int:
+    # Один проход очистки: ограниченное число пачек с паузами между ними
+    purged_total = 0
+    for _ in range(max_batches):
+        async with get_session_maker()() as session:
+            purged = await purge_expired_batch(session, datetime.now())
+        if not purged:
+            break
+        purged_total += len(purged)
+        # Из кэша вытесняются только удалённые ссылки
+        await invalidate_links([short_url for short_url, _ in purged], [full_url for _, full_url in purged])
+        await asyncio.sleep(pause)
+    # Заодно удаляем устаревшие ключи Idempotency-Key
+    async with get_session_maker()() as session:
+        keys = await purge_idempotency_keys(session, datetime.now() - IDEMPOTENCY_KEY_TTL)
+    if keys:
+        logger.info("Удалено устаревших ключей идемпотентности: %d", keys)
+    return purged_total
+
+
+async def sweeper_loop() -> None:
+    while True:
+        try:
+            purged = await sweep_once()
+            if purged:
+                logger.info("Удалено протухших ссылок: %d", purged)
+        except Exception:
+            logger.exception("Ошибка фоновой очистки протухших ссылок")
+        await asyncio.sleep(SWEEPER_INTERVAL)
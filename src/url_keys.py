@@ -0,0 +1,72 @@
+from hashlib import sha256
+from urllib.parse import urlsplit, urlunsplit
+
+# Размер дайджеста full_url_hash в байтах
+URL_HASH_SIZE = 32
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# url_host и url_path входят в btree-индексы, а строка индекса PostgreSQL не длиннее ~2.7 КБ:
+# храним ограниченные префиксы, иначе длинный URL ломал бы любую вставку (4 байта на символ в худшем случае)
+URL_HOST_MAX_LENGTH = 255
+URL_PATH_MAX_LENGTH = 256
+
+
+def normalize_url(full_url: str) -> str:
+    # Каноническая форма URL для поиска: регистр схемы и хоста, порт по умолчанию,
+    # завершающий слэш пути и порядок параметров запроса не влияют на результат
+    full_url = full_url.strip()
+    try:
+        parts = urlsplit(full_url)
+        port = parts.port
+    except ValueError:
+        return full_url
+    scheme = parts.scheme.lower()
+
+    host = (parts.hostname or "").lower()
+    if ":" in host:
+        host = f"[{host}]"  # IPv6
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+    userinfo, at, _ = parts.netloc.rpartition("@")
+    netloc = f"{userinfo}{at}{host}"
+
+    path = parts.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/") or "/"
+    query = "&".join(sorted(param for param in parts.query.split("&") if param))
+    return urlunsplit((scheme, netloc, path, query, parts.fragment))
+
+
+def url_hash(full_url: str) -> bytes:
+    # Компактный ключ фиксированной длины по нормализованному URL, строка нормализуется заранее
+    return sha256(full_url.encode("utf-8")).digest()
+
+
+def url_host(full_url: str) -> str:
+    try:
+        return (urlsplit(full_url).hostname or "").lower()[:URL_HOST_MAX_LENGTH]
+    except ValueError:
+        return ""
+
+
+def url_path(full_url: str) -> str:
+    # Префикс пути, который хранится в url_path; поиск по более длинному префиксу дочитывает остаток
+    return urlsplit(full_url).path[:URL_PATH_MAX_LENGTH]
+
+
+def prefix_upper_bound(prefix: str) -> str:
+    # Строки с префиксом prefix лежат в [prefix, prefix_upper_bound(prefix)) при побайтовом сравнении,
+    # такой диапазон обслуживается обычным btree без LIKE
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def url_columns(full_url: str) -> dict:
+    # Производные от full_url колонки urls, которые заполняются при каждой записи ссылки
+    normalized = normalize_url(full_url)
+    return {
+        "normalized_url": normalized,
+        "full_url_hash": url_hash(normalized),
+        "url_host": url_host(normalized),
+        "url_path": url_path(normalized),
+    }
@@ -0,0 +1,57 @@
+import re
+from datetime import datetime
+from typing import Optional
+from urllib.parse import urlparse
+
+from fastapi import HTTPException
+
+from src.schemas import URLCreate
+
+# Общие правила проверки ссылок для ручек (src/router.py) и массового импорта (src/bulk_import.py)
+
+
+# Функция для проверки url
+def valid_url(url: str) -> bool:
+    try:
+        result = urlparse(url)
+        return all([result.scheme, result.netloc])
+    except Exception:
+        return False
+
+
+# Паттерн для alias'a
+alias_pattern = re.compile(r'^[A-Za-z0-9_-]{1,20}$')
+
+# Паттерн для expires_at
+datetime_pattern = re.compile(
+    r"^(?P<year>\d{4})-(?P<month>0[1-9]|1[0-2])-(?P<day>0[1-9]|[12]\d|3[01])\s(?P<hour>[01]\d|2[0-3]):(?P<minute>[0-5]\d)$"
+)
+
+
+# Проверка схемы создания ссылки, возвращает распарсенный expires_at
+def validate_new_url(new_url: URLCreate) -> Optional[datetime]:
+    # Проверка полного url'a
+    if not valid_url(new_url.full_url):
+        raise HTTPException(status_code=400, detail="Неверный формат URL.")
+
+    expires_at_dt = None
+    if new_url.expires_at:
+        # Проверка формата expires_at (и существования даты, например 2025-02-31)
+        try:
+            if not datetime_pattern.match(new_url.expires_at):
+                raise ValueError(new_url.expires_at)
+            expires_at_dt = datetime.fromisoformat(new_url.expires_at)
+        except ValueError:
+            raise HTTPException(
+                status_code=400,
+                detail=("Неверный формат expires_at. Ожидается формат YYYY-MM-DD HH:MM.")
+            )
+
+    # Если задан кастомный alias, валидируем его формат
+    if new_url.custom_alias and not alias_pattern.match(new_url.custom_alias):
+        raise HTTPException(
+            status_code=400,
+            detail=("Неверный формат кастомного alias. Разрешены символы A-Z, a-z, 0-9, "
+                    "'-' и '_', длина 1-20 символов.")
+        )
+    return expires_at_dt
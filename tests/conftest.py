@@ -10,10 +10,14 @@ import random
 from sqlalchemy import delete
 from httpx import AsyncClient, ASGITransport
 
-from src.models import User, Url, Query
+from src.models import User, Url, Query, UrlStats, HourlyClicks, DailyClicks, ArchivedLink, IdempotencyKey, ImportJob, ImportRowError, ImportStaging
 from src.database import get_async_session, Base
 from src.main import app
 from src.auth.users import current_active_user
+from src.lookup_cache import lookup_cache
+from src.auth.cache import user_cache
+from src.admission import admission_controller
+from src.cache import CountingBackend
 
 os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///./test_temp.db"
 
@@ -81,7 +85,7 @@ class InMemoryBackend:
 @pytest_asyncio.fixture(scope="session", autouse=True)
 def override_cache():
     in_memory_backend = InMemoryBackend()
-    FastAPICache.init(in_memory_backend, prefix="fastapi-cache-test")
+    FastAPICache.init(CountingBackend(in_memory_backend), prefix="fastapi-cache-test")
 
 
 transport = None
@@ -108,8 +112,20 @@ async def cleanup_db(db_session):
     yield
     await db_session.execute(delete(User))
     await db_session.execute(delete(Query))
+    await db_session.execute(delete(UrlStats))
+    await db_session.execute(delete(HourlyClicks))
+    await db_session.execute(delete(DailyClicks))
+    await db_session.execute(delete(ArchivedLink))
+    await db_session.execute(delete(IdempotencyKey))
+    await db_session.execute(delete(ImportJob))
+    await db_session.execute(delete(ImportRowError))
+    await db_session.execute(delete(ImportStaging))
     await db_session.execute(delete(Url))
     await db_session.commit()
+    await FastAPICache.clear()
+    lookup_cache.clear()
+    user_cache.clear()
+    admission_controller.reset()
 
 
 @pytest_asyncio.fixture
@@ -1,5 +1,6 @@
+import os
 import pytest
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from fastapi import status
 import uuid
 
@@ -144,19 +145,53 @@ async def test_shorten_link_invalid_alias_format_anonymous(client):
     assert resp.status_code == status.HTTP_400_BAD_REQUEST
 
 
-# Test: shorten URL that exceeds hashing attempts
+# Test: generated codes do not depend on random salts and never collide
 @pytest.mark.anyio
-async def test_shorten_link_exceed_hash_attempts(mocker, authed_client):
+async def test_shorten_link_generated_codes_unique(mocker, authed_client):
+    from src.codegen import code_generator, CounterCodeGenerator
+
+    # Генератор на счётчике включается только с ключом перемешивания
+    counter = CounterCodeGenerator(10, scramble_key="key", name="test-unique")
+    mocker.patch.object(code_generator, "next_code", counter.next_code)
     fake_uuid = uuid.UUID("12345678-1234-5678-1234-567812345678")
-    mocker.patch("uuid.uuid4", return_value=fake_uuid)  # Mock UUID to always generate the same hash
+    mocker.patch("uuid.uuid4", return_value=fake_uuid)
 
     payload = {"full_url": "https://example.com"}
     resp1 = await authed_client.post("/links/shorten", json=payload)
     assert resp1.status_code == status.HTTP_200_OK
 
-    # The next request will attempt to generate the same hash and fail after 3 attempts
     resp2 = await authed_client.post("/links/shorten", json=payload)
-    assert resp2.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
+    assert resp2.status_code == status.HTTP_200_OK
+    assert resp1.json()["short_url"] != resp2.json()["short_url"]
+
+
+# Test: a generated code that collides with an existing alias is retried on insert
+@pytest.mark.anyio
+async def test_shorten_link_generated_code_collision(mocker, authed_client):
+    from src.codegen import code_generator
+
+    resp = await authed_client.post("/links/shorten", json={"full_url": "https://example.com", "custom_alias": "taken"})
+    assert resp.status_code == status.HTTP_200_OK
+
+    mocker.patch.object(code_generator, "next_code", side_effect=["taken", "fresh"])
+    resp = await authed_client.post("/links/shorten", json={"full_url": "https://example.com"})
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.json()["short_url"] == "fresh"
+
+
+# Test: Renaming without an alias retries a generated code that collides with an existing alias
+@pytest.mark.anyio
+async def test_rename_link_generated_code_collision(mocker, authed_client):
+    from src.codegen import code_generator
+
+    for alias in ("taken", "renamed"):
+        resp = await authed_client.post("/links/shorten", json={"full_url": "https://example.com", "custom_alias": alias})
+        assert resp.status_code == status.HTTP_200_OK
+
+    mocker.patch.object(code_generator, "next_code", side_effect=["taken", "fresh"])
+    resp = await authed_client.put("/links/renamed", params={"new_alias": None})
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.json()["short_url"] == "fresh"
 
 
 # Test: Redirecting expired URL
@@ -310,3 +345,1015 @@ async def test_registering(client):
             }
     create_resp = await client.post("/auth/register", json=payload1)
     assert create_resp.status_code == status.HTTP_201_CREATED
+
+
+# Test: Click buffer flushes redirects to the queries table in batches
+# (буфер построен на asyncio.Queue, поэтому только под asyncio)
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_click_buffer_flushes_batch(db_session):
+    from sqlalchemy import select, func
+    from src.clicks import ClickBuffer, make_click
+    from src.models import Query
+
+    buffer = ClickBuffer(max_size=3, batch_size=2, flush_interval=0.01)
+    buffer.start()
+    assert buffer.running
+    assert all(buffer.add(make_click(1, "https://example.com", "abc")) for _ in range(3))
+    await buffer.stop()
+
+    count = (await db_session.execute(select(func.count(Query.id)))).scalar_one()
+    assert count == 3
+    assert buffer.stats()["flushed"] == 3
+    assert buffer.stats()["dropped"] == 0
+
+
+# Test: Stopping the buffer flushes a partial batch already taken from the queue
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_click_buffer_stop_flushes_pending_batch(db_session):
+    import asyncio
+    from sqlalchemy import select, func
+    from src.clicks import ClickBuffer, make_click
+    from src.models import Query
+
+    buffer = ClickBuffer(max_size=10, batch_size=10, flush_interval=60)
+    buffer.start()
+    assert all(buffer.add(make_click(1, "https://example.com", "abc")) for _ in range(3))
+    await asyncio.sleep(0.01)
+    # Фоновая задача уже забрала переходы в пачку и ждёт её наполнения
+    assert buffer.stats()["queued"] == 0
+    await buffer.stop()
+
+    count = (await db_session.execute(select(func.count(Query.id)))).scalar_one()
+    assert count == 3
+    assert buffer.stats()["flushed"] == 3
+    assert buffer.stats()["dropped"] == 0
+    assert not buffer.running
+
+
+# Test: A flush rejected by foreign keys keeps clicks for links that still exist
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_click_buffer_skips_orphan_clicks(db_session, mocker):
+    from sqlalchemy import event, select
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from src import clicks
+    from src.clicks import ClickBuffer, make_click
+    from src.models import Query, Url
+
+    # SQLite проверяет внешние ключи только с PRAGMA foreign_keys=ON на соединении
+    engine = create_async_engine(os.environ["DATABASE_URL"])
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _enable_foreign_keys(connection, _):
+        connection.execute("PRAGMA foreign_keys=ON")
+
+    mocker.patch.object(clicks, "get_session_maker", return_value=lambda: async_sessionmaker(engine)())
+
+    kept = Url(full_url="https://example.com/kept", short_url="kept", creation_time=datetime.now())
+    renamed = Url(full_url="https://example.com/renamed", short_url="renamed_new", creation_time=datetime.now())
+    db_session.add_all([kept, renamed])
+    await db_session.commit()
+
+    buffer = ClickBuffer()
+    await buffer._flush([
+        make_click(kept.id, kept.full_url, "kept"),
+        make_click(renamed.id, renamed.full_url, "renamed_old"),  # переименована после перехода
+        make_click(kept.id + renamed.id + 1000, "https://example.com/gone", "gone"),  # удалена
+    ])
+    await engine.dispose()
+
+    rows = (await db_session.execute(select(Query.short_url).order_by(Query.short_url))).scalars().all()
+    assert rows == ["kept", "renamed_new"]
+    assert buffer.stats()["flushed"] == 2
+    assert buffer.stats()["orphaned"] == 1
+    assert buffer.stats()["dropped"] == 0
+
+
+# Test: Click buffer drops clicks when it is full
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_click_buffer_drops_when_full():
+    from src.clicks import ClickBuffer, make_click
+
+    buffer = ClickBuffer(max_size=1)
+    buffer.start()
+    assert buffer.add(make_click(1, "https://example.com", "abc")) is True
+    assert buffer.add(make_click(1, "https://example.com", "abc")) is False
+    assert buffer.stats()["dropped"] == 1
+    await buffer.stop()
+
+
+# Test: Cached redirects are still counted in stats
+@pytest.mark.anyio
+async def test_redirect_cache_hit_counts_click(authed_client):
+    payload = {"full_url": "https://example.com/hot", "custom_alias": "hot"}
+    resp = await authed_client.post("/links/shorten", json=payload)
+    assert resp.status_code == status.HTTP_200_OK
+
+    for _ in range(3):
+        redirect_resp = await authed_client.get("/links/hot", follow_redirects=False)
+        assert redirect_resp.status_code == status.HTTP_307_TEMPORARY_REDIRECT
+
+    stats_resp = await authed_client.get("/links/hot/stats")
+    assert stats_resp.json()["access_count"] == 3
+
+
+# Test: Unknown code is negatively cached until the alias is created
+@pytest.mark.anyio
+async def test_redirect_negative_cache_invalidated_on_create(authed_client):
+    resp = await authed_client.get("/links/later", follow_redirects=False)
+    assert resp.status_code == status.HTTP_404_NOT_FOUND
+
+    payload = {"full_url": "https://example.com/later", "custom_alias": "later"}
+    resp = await authed_client.post("/links/shorten", json=payload)
+    assert resp.status_code == status.HTTP_200_OK
+
+    resp = await authed_client.get("/links/later", follow_redirects=False)
+    assert resp.status_code == status.HTTP_307_TEMPORARY_REDIRECT
+
+
+# Test: A redirect lookup that read the DB before a delete cannot re-cache the link
+@pytest.mark.anyio
+async def test_deleted_link_not_recached_by_stale_lookup(authed_client, monkeypatch):
+    from src.invalidation import invalidation_bus
+    from src.lookup_cache import lookup_cache, MISSING
+
+    store, published = {}, []
+
+    class FakePipeline:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        def set(self, key, value, ex=None):
+            store[key] = value
+
+        async def execute(self):
+            return []
+
+    class FakeRedis:
+        async def get(self, key):
+            return store.get(key)
+
+        async def eval(self, script, numkeys, key, seen, value, ttl):
+            if store.get(key, "") != seen:
+                return 0
+            store[key] = value
+            return 1
+
+        def pipeline(self, transaction=True):
+            return FakePipeline()
+
+        async def publish(self, channel, message):
+            published.append((channel, message))
+
+    monkeypatch.setattr(lookup_cache, "redis", FakeRedis())
+    monkeypatch.setattr(invalidation_bus, "redis", FakeRedis())
+
+    resp = await authed_client.post("/links/shorten", json={"full_url": "https://example.com/race", "custom_alias": "race"})
+    assert resp.status_code == status.HTTP_200_OK
+    # Редирект после создания кэширует ссылку поверх надгробия
+    resp = await authed_client.get("/links/race", follow_redirects=False)
+    assert resp.status_code == status.HTTP_307_TEMPORARY_REDIRECT
+    stale = await lookup_cache.get("race")
+    assert stale.full_url == "https://example.com/race"
+
+    # Медленный редирект: промах и чтение из БД до удаления ссылки...
+    store.pop("link:race")
+    lookup_cache.clear()
+    record, seen = await lookup_cache.lookup("race")
+    assert record is MISSING
+    stale_sets = lookup_cache.stale_sets
+
+    resp = await authed_client.delete("/links/race")
+    assert resp.status_code == status.HTTP_200_OK
+    # ...и запись прочитанного в кэш уже после удаления
+    await lookup_cache.set("race", stale, seen)
+    assert lookup_cache.stale_sets == stale_sets + 1
+
+    resp = await authed_client.get("/links/race", follow_redirects=False)
+    assert resp.status_code == status.HTTP_404_NOT_FOUND
+    assert ("invalidate:links", '["race"]') in published
+
+
+# Test: Repeated stats requests hit the cache under a stable key
+@pytest.mark.anyio
+async def test_stats_cache_hit_counted(authed_client):
+    payload = {"full_url": "https://example.com/cached", "custom_alias": "cached"}
+    resp = await authed_client.post("/links/shorten", json=payload)
+    assert resp.status_code == status.HTTP_200_OK
+
+    before = (await authed_client.get("/monitoring/cache")).json()["responses"].get("stats", {"hits": 0})
+    first = await authed_client.get("/links/cached/stats")
+    second = await authed_client.get("/links/cached/stats")
+    assert first.headers["X-FastAPI-Cache"] == "MISS"
+    assert second.headers["X-FastAPI-Cache"] == "HIT"
+
+    after = (await authed_client.get("/monitoring/cache")).json()["responses"]["stats"]
+    assert after["hits"] == before["hits"] + 1
+
+
+# Test: Counters can be rebuilt from the raw click log
+@pytest.mark.anyio
+async def test_rebuild_counters(authed_client, db_session):
+    from sqlalchemy import delete, select
+    from src.counters import rebuild_counters
+    from src.models import UrlStats
+
+    payload = {"full_url": "https://example.com/rebuild", "custom_alias": "rebuild"}
+    resp = await authed_client.post("/links/shorten", json=payload)
+    assert resp.status_code == status.HTTP_200_OK
+    for _ in range(2):
+        await authed_client.get("/links/rebuild", follow_redirects=False)
+
+    await db_session.execute(delete(UrlStats))
+    await db_session.commit()
+    assert await rebuild_counters(db_session, batch_size=1) == 1
+
+    # При сроке хранения переходов пересчёт занизил бы пожизненные счётчики
+    with pytest.raises(RuntimeError):
+        await rebuild_counters(db_session, retention_months=6)
+    assert await rebuild_counters(db_session, retention_months=6, allow_partial=True) == 1
+
+    stats = (await db_session.execute(select(UrlStats))).scalar_one()
+    assert stats.access_count == 2
+    assert stats.last_access is not None
+
+
+# Test: Expired stats are paginated with a keyset cursor
+@pytest.mark.anyio
+async def test_get_expired_links_stats_pagination(authed_client):
+    for i in range(3):
+        payload = {"full_url": f"https://example.com/{i}", "custom_alias": f"old{i}",
+                   "expires_at": f"1970-01-0{i + 1} 00:00"}
+        resp = await authed_client.post("/links/shorten", json=payload)
+        assert resp.status_code == status.HTTP_200_OK
+
+    page1 = await authed_client.get("/links/expired/stats", params={"limit": 2})
+    assert [item["short_url"] for item in page1.json()] == ["old0", "old1"]
+    cursor = page1.headers["X-Next-Cursor"]
+
+    page2 = await authed_client.get("/links/expired/stats", params={"limit": 2, "cursor": cursor})
+    assert [item["short_url"] for item in page2.json()] == ["old2"]
+    assert "X-Next-Cursor" not in page2.headers
+
+    bad = await authed_client.get("/links/expired/stats", params={"cursor": "garbage"})
+    assert bad.status_code == status.HTTP_400_BAD_REQUEST
+
+
+# Test: Expired stats can be streamed as NDJSON
+@pytest.mark.anyio
+async def test_get_expired_links_stats_ndjson(authed_client):
+    import json
+
+    for i in range(3):
+        payload = {"full_url": f"https://example.com/{i}", "custom_alias": f"old{i}", "expires_at": "1970-01-01 00:00"}
+        resp = await authed_client.post("/links/shorten", json=payload)
+        assert resp.status_code == status.HTTP_200_OK
+
+    resp = await authed_client.get("/links/expired/stats", params={"format": "ndjson", "limit": 2})
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in resp.text.splitlines()]
+    assert [row["short_url"] for row in rows] == ["old0", "old1", "old2"]
+
+
+# Test: Workers reserve disjoint blocks of code numbers
+@pytest.mark.anyio
+async def test_counter_code_generators_reserve_disjoint_blocks():
+    from src.codegen import CounterCodeGenerator
+
+    worker1 = CounterCodeGenerator(6, block_size=3, scramble_key="key", name="test-blocks")
+    worker2 = CounterCodeGenerator(6, block_size=3, scramble_key="key", name="test-blocks")
+    codes = await worker1.next_codes(4) + await worker2.next_codes(4) + [await worker1.next_code()]
+    assert len(set(codes)) == len(codes)
+    assert all(len(code) == 6 for code in codes)
+
+
+# Test: Batch shortening reports per-item results
+@pytest.mark.anyio
+async def test_shorten_batch(authed_client):
+    resp = await authed_client.post("/links/shorten", json={"full_url": "https://example.com", "custom_alias": "taken"})
+    assert resp.status_code == status.HTTP_200_OK
+
+    batch = [
+        {"full_url": "https://example.com/1"},
+        {"full_url": "https://example.com/2", "custom_alias": "batch2", "expires_at": "2099-01-01 00:00"},
+        {"full_url": "https://example.com/3", "custom_alias": "taken"},
+        {"full_url": "not-a-valid-url"},
+        {"full_url": "https://example.com/5", "custom_alias": "batch2"},
+        {"full_url": "https://example.com/6", "expires_at": "2025-02-31 00:00"},
+    ]
+    resp = await authed_client.post("/links/shorten/batch", json=batch)
+    assert resp.status_code == status.HTTP_200_OK
+    results = resp.json()["results"]
+    assert [item["status"] for item in results] == ["success", "success", "error", "error", "error", "error"]
+    assert results[1]["short_url"] == "batch2"
+    assert results[2]["detail"] == "Указанный alias уже существует."
+
+    redirect_resp = await authed_client.get(f"/links/{results[0]['short_url']}", follow_redirects=False)
+    assert redirect_resp.headers["location"] == "https://example.com/1"
+
+
+# Test: Batch size is limited
+@pytest.mark.anyio
+async def test_shorten_batch_too_large(client, mocker):
+    mocker.patch("router.SHORTEN_BATCH_MAX_SIZE", 1)
+    batch = [{"full_url": "https://example.com/1"}, {"full_url": "https://example.com/2"}]
+    resp = await client.post("/links/shorten/batch", json=batch)
+    assert resp.status_code == status.HTTP_400_BAD_REQUEST
+
+
+# Test: Clicks are rolled up into hourly and daily time series
+@pytest.mark.anyio
+async def test_link_timeseries(authed_client, db_session):
+    from src.rollups import rebuild_rollups
+
+    resp = await authed_client.post("/links/shorten", json={"full_url": "https://example.com", "custom_alias": "series"})
+    assert resp.status_code == status.HTTP_200_OK
+    for _ in range(3):
+        await authed_client.get("/links/series", follow_redirects=False)
+
+    resp = await authed_client.get("/links/series/stats/timeseries", params={"granularity": "hour"})
+    assert resp.status_code == status.HTTP_200_OK
+    points = resp.json()["points"]
+    assert len(points) == 49
+    assert sum(point["clicks"] for point in points) == 3
+
+    # Пересчёт по сырым переходам даёт те же агрегаты
+    await rebuild_rollups(db_session, datetime.now() - timedelta(days=1), datetime.now())
+    resp = await authed_client.get("/links/series/stats/timeseries")
+    assert sum(point["clicks"] for point in resp.json()["points"]) == 3
+
+    resp = await authed_client.get("/links/missing/stats/timeseries")
+    assert resp.status_code == status.HTTP_404_NOT_FOUND
+    resp = await authed_client.get(
+        "/links/series/stats/timeseries", params={"granularity": "hour", "from": "2000-01-01T00:00:00"}
+    )
+    assert resp.status_code == status.HTTP_400_BAD_REQUEST
+
+
+# Test: Timeseries accepts timezone-aware bounds and converts them to local time
+@pytest.mark.anyio
+async def test_link_timeseries_aware_bounds(authed_client):
+    resp = await authed_client.post("/links/shorten", json={"full_url": "https://example.com", "custom_alias": "series_tz"})
+    assert resp.status_code == status.HTTP_200_OK
+    await authed_client.get("/links/series_tz", follow_redirects=False)
+
+    now = datetime.now().astimezone().astimezone(timezone.utc)
+    resp = await authed_client.get(
+        "/links/series_tz/stats/timeseries",
+        params={
+            "granularity": "hour",
+            "from": (now - timedelta(hours=2)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "to": (now + timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        },
+    )
+    assert resp.status_code == status.HTTP_200_OK
+    points = resp.json()["points"]
+    assert len(points) == 4
+    assert sum(point["clicks"] for point in points) == 1
+
+    # Осведомлённое начало позже наивного конца сравнивается без TypeError
+    resp = await authed_client.get(
+        "/links/series_tz/stats/timeseries",
+        params={"from": (now + timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%SZ")},
+    )
+    assert resp.status_code == status.HTTP_400_BAD_REQUEST
+
+
+# Test: Sweeper archives and purges expired links in bounded batches
+@pytest.mark.anyio
+async def test_sweeper_purges_expired_links(authed_client, mocker):
+    from src import sweeper
+
+    mocker.patch.object(sweeper, "SWEEPER_GRACE", timedelta(0))
+    for i in range(3):
+        payload = {"full_url": f"https://example.com/{i}", "custom_alias": f"gone{i}", "expires_at": "1970-01-01 00:00"}
+        assert (await authed_client.post("/links/shorten", json=payload)).status_code == status.HTTP_200_OK
+    payload = {"full_url": "https://example.com/alive", "custom_alias": "alive"}
+    assert (await authed_client.post("/links/shorten", json=payload)).status_code == status.HTTP_200_OK
+
+    # Переходы по ссылке, протухшей уже после них
+    from sqlalchemy import func, select
+    from src.clicks import make_click, write_clicks
+    from src.models import ArchivedLink, HourlyClicks, Query, Url
+    async with sweeper.get_session_maker()() as session:
+        gone0 = (await session.execute(select(Url).where(Url.short_url == "gone0"))).scalar_one()
+        clicks = [make_click(gone0.id, gone0.full_url, "gone0") for _ in range(7)]
+        for i, click in enumerate(clicks):
+            click["access_time"] = datetime(1969, 12, 31) + timedelta(hours=i)
+        await write_clicks(session, clicks)
+        await session.commit()
+
+    async with sweeper.get_session_maker()() as session:
+        purged = await sweeper.purge_expired_batch(session, datetime.now(), timedelta(0), batch_size=2, chunk_size=3)
+    assert [short_url for short_url, _ in purged] == ["gone0", "gone1"]
+    assert await sweeper.sweep_once(max_batches=5, pause=0) == 1
+
+    async with sweeper.get_session_maker()() as session:
+        archived = (await session.execute(select(ArchivedLink.short_url))).scalars().all()
+        remaining = (await session.execute(select(Url.short_url))).scalars().all()
+        clicks_left = (await session.execute(select(func.count(Query.id)))).scalar_one()
+        hourly_left = (await session.execute(select(func.count()).select_from(HourlyClicks))).scalar_one()
+    assert sorted(archived) == ["gone0", "gone1", "gone2"]
+    assert remaining == ["alive"]
+    assert clicks_left == hourly_left == 0
+
+    # Архив удалённых ссылок доступен постранично
+    resp = await authed_client.get("/links/expired/archive", params={"limit": 2})
+    assert resp.status_code == status.HTTP_200_OK
+    first = resp.json()
+    assert [row["short_url"] for row in first] == ["gone0", "gone1"]
+    assert first[0]["access_count"] == 7
+    resp = await authed_client.get("/links/expired/archive", params={"limit": 2, "cursor": resp.headers["X-Next-Cursor"]})
+    assert [row["short_url"] for row in resp.json()] == ["gone2"]
+
+
+# Test: Pool state is exposed for monitoring
+@pytest.mark.anyio
+async def test_pool_stats(client):
+    resp = await client.get("/monitoring/pool")
+    assert resp.status_code == status.HTTP_200_OK
+    assert {"checkouts", "timeouts", "wait_time_max"} <= set(resp.json())
+
+
+# Test: Prometheus metrics expose request latency by route template, SQL counts and redirects
+@pytest.mark.anyio
+async def test_prometheus_metrics(authed_client):
+    payload = {"full_url": "https://example.com/metrics", "custom_alias": "metrics"}
+    resp = await authed_client.post("/links/shorten", json=payload)
+    assert resp.status_code == status.HTTP_200_OK
+    await authed_client.get("/links/metrics", follow_redirects=False)
+    await authed_client.get("/links/metrics-missing", follow_redirects=False)
+
+    resp = await authed_client.get("/metrics")
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.headers["content-type"].startswith("text/plain")
+    body = resp.text
+    assert 'http_request_duration_seconds_bucket{le="0.001",method="GET",route="/links/{short_url}",status="307"}' in body
+    assert 'http_request_db_statements_count{route="/links/{short_url}"}' in body
+    assert 'redirects_total{result="ok"}' in body
+    assert 'redirects_total{result="not_found"}' in body
+    assert "db_statement_duration_seconds_count" in body
+
+
+# Test: Benchmark workload runs end to end against the app and reports every endpoint
+@pytest.mark.anyio
+async def test_benchmark_smoke(client):
+    from benchmarks.run import run_workload
+
+    report = await run_workload(client, links=30, requests=200, concurrency=4, seed_value=1)
+    assert report["meta"]["links"] == 30
+    assert set(report["endpoints"]) <= {"redirect", "stats", "search", "shorten"}
+    redirect = report["endpoints"]["redirect"]
+    assert redirect["errors"] == 0 and redirect["count"] > 100
+    assert redirect["p50_ms"] <= redirect["p95_ms"] <= redirect["p99_ms"]
+
+
+# Test: Rename and delete of another user's link are rejected, missing links are 404
+@pytest.mark.anyio
+async def test_write_ownership_errors(authed_client, db_session):
+    from src.models import Url
+
+    db_session.add(Url(
+        full_url="https://example.com/foreign", short_url="foreign",
+        creation_time=datetime.now(), creator_id=uuid.uuid4(),
+    ))
+    await db_session.commit()
+
+    assert (await authed_client.put("/links/foreign", params={"new_alias": "mine"})).status_code == 403
+    assert (await authed_client.put("/links/foreign", params={"new_alias": "bad alias!"})).status_code == 403
+    assert (await authed_client.delete("/links/foreign")).status_code == 403
+    assert (await authed_client.put("/links/missing", params={"new_alias": "mine"})).status_code == 404
+    assert (await authed_client.put("/links/missing", params={"new_alias": "bad alias!"})).status_code == 404
+
+    resp = await authed_client.post("/links/shorten", json={"full_url": "https://example.com", "custom_alias": "own"})
+    assert resp.status_code == 200
+    assert (await authed_client.put("/links/own", params={"new_alias": "own"})).status_code == 400
+    assert (await authed_client.put("/links/own", params={"new_alias": "foreign"})).status_code == 400
+    assert (await authed_client.put("/links/own", params={"new_alias": "bad alias!"})).status_code == 400
+    assert (await authed_client.get("/links/foreign", follow_redirects=False)).status_code == 307
+
+
+async def register_and_login(client, email: str) -> dict:
+    payload = {"email": email, "password": "string"}
+    resp = await client.post("/auth/register", json=payload)
+    assert resp.status_code == status.HTTP_201_CREATED
+    resp = await client.post("/auth/jwt/login", data={"username": email, "password": "string"})
+    assert resp.status_code == status.HTTP_200_OK
+    return {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+
+# Test: Authenticated requests resolve the user from cache after the first lookup
+@pytest.mark.anyio
+async def test_user_cache_skips_lookup(client, mocker):
+    import src.profiling as profiling
+    from src.auth.cache import user_cache
+
+    mocker.patch.object(profiling, "SQL_PROFILER_ENABLED", True)
+    user_cache.clear()
+    headers = await register_and_login(client, "cached@example.com")
+
+    first = await client.post("/links/shorten", json={"full_url": "https://example.com", "custom_alias": "u1"}, headers=headers)
+    second = await client.post("/links/shorten", json={"full_url": "https://example.com", "custom_alias": "u2"}, headers=headers)
+    assert first.status_code == second.status_code == status.HTTP_200_OK
+    # Второй запрос не загружает пользователя из БД
+    assert int(second.headers["X-DB-Statements"]) < int(first.headers["X-DB-Statements"])
+    assert user_cache.stats()["hits"] >= 1
+
+    resp = await client.delete(f"/links/{first.json()['short_url']}", headers=headers)
+    assert resp.status_code == status.HTTP_200_OK
+
+
+# Test: Updating a user drops it from the cache
+@pytest.mark.anyio
+async def test_user_cache_invalidated_on_update(client, monkeypatch):
+    from fastapi_users.db import SQLAlchemyUserDatabase
+    from fastapi_users.schemas import BaseUserUpdate
+    from src.auth.cache import UserCache, user_cache
+    from src.auth.users import UserManager
+    from src.invalidation import InvalidationBus, invalidation_bus
+    from src.models import User
+    from tests.conftest import TestAsyncSessionMaker
+
+    published = []
+
+    class FakeRedis:
+        async def publish(self, channel, message):
+            published.append((channel, message))
+
+    monkeypatch.setattr(invalidation_bus, "redis", FakeRedis())
+    await register_and_login(client, "update@example.com")
+    async with TestAsyncSessionMaker() as session:
+        manager = UserManager(SQLAlchemyUserDatabase(session, User))
+        user = await manager.get_by_email("update@example.com")
+        user_cache.set(user)
+        assert user_cache.get(user.id).is_active
+        other_worker = UserCache()
+        other_worker.set(user)
+
+        await manager.update(BaseUserUpdate(is_active=False), user, safe=False)
+        assert user_cache.get(user.id) is None
+
+    # Остальные воркеры получают рассылку и тоже вытесняют пользователя
+    assert published == [("invalidate:users", f'["{user.id}"]')]
+    other_bus = InvalidationBus()
+    other_bus.subscribe("users", other_worker.evict_local)
+    other_bus.dispatch(*published[0])
+    assert other_worker.get(user.id) is None
+
+
+# Test: Claims-only mode builds the user from the token without touching the DB
+@pytest.mark.anyio
+async def test_claims_only_token(client, mocker):
+    import src.profiling as profiling
+    from src.auth.cache import user_cache
+
+    mocker.patch.object(profiling, "SQL_PROFILER_ENABLED", True)
+    mocker.patch("src.auth.cache.AUTH_CLAIMS_ONLY", True)
+    user_cache.clear()
+    headers = await register_and_login(client, "claims@example.com")
+
+    resp = await client.post("/links/shorten", json={"full_url": "https://example.com", "custom_alias": "claims"}, headers=headers)
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.headers["X-DB-Statements"] == "1"
+    assert user_cache.stats()["size"] == 0
+
+
+# Test: Reuse mode returns the existing active code for the same URL and creator
+@pytest.mark.anyio
+async def test_shorten_reuse_existing(authed_client):
+    payload = {"full_url": "https://example.com/popular"}
+    first = await authed_client.post("/links/shorten", json=payload, params={"reuse_existing": True})
+    second = await authed_client.post("/links/shorten", json=payload, params={"reuse_existing": True})
+    assert first.status_code == second.status_code == status.HTTP_200_OK
+    assert first.json()["short_url"] == second.json()["short_url"]
+
+    # Без режима, с другим сроком жизни или с alias'ом создаётся новая ссылка
+    other = await authed_client.post("/links/shorten", json=payload)
+    assert other.json()["short_url"] != first.json()["short_url"]
+    expiring = {**payload, "expires_at": "2100-01-01 00:00"}
+    resp = await authed_client.post("/links/shorten", json=expiring, params={"reuse_existing": True})
+    assert resp.json()["short_url"] != first.json()["short_url"]
+
+    search = await authed_client.get("/links/search", params={"full_url": payload["full_url"]})
+    assert len(search.json()) == 3
+
+
+# Test: Retried requests with the same Idempotency-Key return the original response
+@pytest.mark.anyio
+async def test_shorten_idempotency_key(authed_client, db_session):
+    from sqlalchemy import func, select
+    from src.models import Url
+
+    payload = {"full_url": "https://example.com/retry"}
+    headers = {"Idempotency-Key": "req-1"}
+    first = await authed_client.post("/links/shorten", json=payload, headers=headers)
+    second = await authed_client.post("/links/shorten", json=payload, headers=headers)
+    assert first.status_code == second.status_code == status.HTTP_200_OK
+    assert first.json() == second.json()
+    count = await db_session.execute(select(func.count()).select_from(Url).where(Url.full_url == payload["full_url"]))
+    assert count.scalar_one() == 1
+
+    resp = await authed_client.post("/links/shorten", json={"full_url": "https://example.com/other"}, headers=headers)
+    assert resp.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+# Test: Anonymous clients sharing an Idempotency-Key get independent results
+@pytest.mark.anyio
+async def test_anonymous_idempotency_keys_scoped_by_client(client, test_app):
+    from httpx import ASGITransport, AsyncClient
+
+    async def shorten(address, full_url):
+        transport = ASGITransport(app=test_app, client=(address, 123))
+        async with AsyncClient(transport=transport, base_url="http://testserver") as peer:
+            return await peer.post(
+                "/links/shorten", json={"full_url": full_url}, headers={"Idempotency-Key": "same"}
+            )
+
+    first = await shorten("10.0.0.1", "https://example.com/a")
+    second = await shorten("10.0.0.2", "https://example.com/b")
+    third = await shorten("10.0.0.3", "https://example.com/a")
+    assert first.status_code == second.status_code == third.status_code == status.HTTP_200_OK
+    assert len({first.json()["short_url"], second.json()["short_url"], third.json()["short_url"]}) == 3
+
+    retry = await shorten("10.0.0.1", "https://example.com/a")
+    assert retry.json() == first.json()
+
+
+# Test: The sweeper drops idempotency keys past their TTL
+@pytest.mark.anyio
+async def test_sweeper_purges_idempotency_keys(authed_client, db_session):
+    from sqlalchemy import select, update
+    from src.models import IdempotencyKey
+    from src.sweeper import sweep_once
+
+    for key in ("old", "fresh"):
+        resp = await authed_client.post("/links/shorten", json={"full_url": "https://example.com"}, headers={"Idempotency-Key": key})
+        assert resp.status_code == status.HTTP_200_OK
+    await db_session.execute(
+        update(IdempotencyKey).where(IdempotencyKey.key == "old").values(created_at=datetime(2000, 1, 1))
+    )
+    await db_session.commit()
+
+    await sweep_once(pause=0)
+    keys = await db_session.execute(select(IdempotencyKey.key))
+    assert keys.scalars().all() == ["fresh"]
+
+
+# Test: Search matches equivalent URLs and is invalidated through any equivalent form
+@pytest.mark.anyio
+async def test_search_normalized_url(authed_client):
+    resp = await authed_client.post("/links/shorten", json={"full_url": "https://Example.com/page/?b=2&a=1", "custom_alias": "norm1"})
+    assert resp.status_code == status.HTTP_200_OK
+
+    search = await authed_client.get("/links/search", params={"full_url": "https://example.com/page?a=1&b=2"})
+    assert search.status_code == status.HTTP_200_OK
+    assert [item["short_url"] for item in search.json()] == ["norm1"]
+    assert search.json()[0]["full_url"] == "https://Example.com/page/?b=2&a=1"
+
+    # Новая ссылка в другой эквивалентной форме сбрасывает закэшированный результат поиска
+    resp = await authed_client.post("/links/shorten", json={"full_url": "HTTPS://EXAMPLE.COM:443/page?a=1&b=2", "custom_alias": "norm2"})
+    assert resp.status_code == status.HTTP_200_OK
+    search = await authed_client.get("/links/search", params={"full_url": "https://example.com/page/?a=1&b=2"})
+    assert sorted(item["short_url"] for item in search.json()) == ["norm1", "norm2"]
+
+
+# Test: Links can be found by host and path prefix with cursor pagination
+@pytest.mark.anyio
+async def test_search_by_domain(authed_client):
+    batch = [{"full_url": f"https://Example.com/campaign/2026/{i}"} for i in range(5)]
+    batch += [
+        {"full_url": "https://example.com/campaign/2025/x"},
+        {"full_url": "https://other.org/campaign/2026/y"},
+        {"full_url": "https://sub.example.com/campaign/2026/z"},
+    ]
+    resp = await authed_client.post("/links/shorten/batch", json=batch)
+    assert resp.status_code == status.HTTP_200_OK
+
+    urls, cursor = [], None
+    while True:
+        params = {"host": "example.com", "path_prefix": "/campaign/2026", "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        page = await authed_client.get("/links/search/domain", params=params)
+        assert page.status_code == status.HTTP_200_OK
+        urls += [item["full_url"] for item in page.json()]
+        cursor = page.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert urls == [f"https://Example.com/campaign/2026/{i}" for i in range(5)]
+
+    by_host = await authed_client.get("/links/search/domain", params={"host": "EXAMPLE.COM"})
+    assert len(by_host.json()) == 6
+    by_prefix = await authed_client.get("/links/search/domain", params={"path_prefix": "campaign/2026/"})
+    assert len(by_prefix.json()) == 7
+    resp = await authed_client.get("/links/search/domain")
+    assert resp.status_code == status.HTTP_400_BAD_REQUEST
+
+    # В url_path хранится ограниченное начало пути, более длинный префикс дочитывается по normalized_url
+    from src.url_keys import URL_PATH_MAX_LENGTH
+    long_path = "/long/" + "a" * URL_PATH_MAX_LENGTH
+    resp = await authed_client.post("/links/shorten/batch", json=[
+        {"full_url": f"https://long.example.com{long_path}/first"},
+        {"full_url": f"https://long.example.com{long_path}/second"},
+    ])
+    assert resp.status_code == status.HTTP_200_OK
+    by_long_prefix = await authed_client.get("/links/search/domain", params={"path_prefix": f"{long_path}/sec"})
+    assert [item["full_url"] for item in by_long_prefix.json()] == [f"https://long.example.com{long_path}/second"]
+    by_short_prefix = await authed_client.get("/links/search/domain", params={"path_prefix": "/long/"})
+    assert len(by_short_prefix.json()) == 2
+
+
+# Test: Users page through their own links with click counters
+@pytest.mark.anyio
+async def test_my_links(authed_client, db_session):
+    from src.models import Url
+
+    for i in range(5):
+        resp = await authed_client.post("/links/shorten", json={"full_url": f"https://example.com/{i}", "custom_alias": f"mine{i}"})
+        assert resp.status_code == status.HTTP_200_OK
+    db_session.add(Url(full_url="https://example.com", short_url="notmine", creation_time=datetime.now(), creator_id=uuid.uuid4()))
+    await db_session.commit()
+    for _ in range(2):
+        await authed_client.get("/links/mine3", follow_redirects=False)
+
+    links, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = await authed_client.get("/links/mine", params=params)
+        assert page.status_code == status.HTTP_200_OK
+        links += page.json()
+        cursor = page.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert [link["short_url"] for link in links] == [f"mine{i}" for i in reversed(range(5))]
+    assert {link["short_url"]: link["access_count"] for link in links}["mine3"] == 2
+
+
+# Test: Listing own links requires authentication
+@pytest.mark.anyio
+async def test_my_links_anonymous(client):
+    resp = await client.get("/links/mine")
+    assert resp.status_code == status.HTTP_403_FORBIDDEN
+
+
+# Test: Click logs are exported as CSV and NDJSON for a link and for all of the user's links
+@pytest.mark.anyio
+async def test_clicks_export(authed_client, db_session):
+    import csv
+    import io
+    import json
+    from sqlalchemy import select
+    from src.export import export_link_clicks
+    from src.models import Url
+
+    for alias in ("exp1", "exp2"):
+        resp = await authed_client.post("/links/shorten", json={"full_url": f"https://example.com/{alias}", "custom_alias": alias})
+        assert resp.status_code == status.HTTP_200_OK
+    for _ in range(3):
+        await authed_client.get("/links/exp1", follow_redirects=False)
+    await authed_client.get("/links/exp2", follow_redirects=False)
+
+    resp = await authed_client.get("/links/exp1/clicks/export")
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.headers["content-type"].startswith("text/csv")
+    rows = list(csv.reader(io.StringIO(resp.text)))
+    assert rows[0] == ["short_url", "full_url", "access_time"]
+    assert [row[0] for row in rows[1:]] == ["exp1"] * 3
+
+    resp = await authed_client.get("/links/mine/clicks/export", params={"format": "ndjson"})
+    assert resp.status_code == status.HTTP_200_OK
+    clicks = [json.loads(line) for line in resp.text.splitlines()]
+    assert sorted(click["short_url"] for click in clicks) == ["exp1", "exp1", "exp1", "exp2"]
+
+    # Мелкие куски с keyset-переходом между ними дают ту же выгрузку
+    url_id = (await db_session.execute(select(Url.id).where(Url.short_url == "exp1"))).scalar_one()
+    chunks = [chunk async for chunk in export_link_clicks(url_id, "ndjson", chunk_size=2)]
+    assert len(chunks) == 2
+    assert sum(len(chunk.splitlines()) for chunk in chunks) == 3
+
+    # Выгрузка пользователя читает переходы всех ссылок одним keyset-запросом, а не по запросу на ссылку
+    from src.export import export_user_clicks
+    user_id = (await db_session.execute(select(Url.creator_id).where(Url.short_url == "exp1"))).scalar_one()
+    chunks = [chunk async for chunk in export_user_clicks(user_id, "ndjson", chunk_size=10)]
+    assert len(chunks) == 1
+    assert [json.loads(line)["short_url"] for line in chunks[0].splitlines()] == ["exp1"] * 3 + ["exp2"]
+    chunks = [chunk async for chunk in export_user_clicks(user_id, "ndjson", chunk_size=3)]
+    assert [len(chunk.splitlines()) for chunk in chunks] == [3, 1]
+
+    assert (await authed_client.get("/links/missing/clicks/export")).status_code == status.HTTP_404_NOT_FOUND
+
+
+# Test: Exporting clicks requires authentication
+@pytest.mark.anyio
+async def test_clicks_export_anonymous(client):
+    assert (await client.get("/links/mine/clicks/export")).status_code == status.HTTP_403_FORBIDDEN
+    assert (await client.get("/links/any/clicks/export")).status_code == status.HTTP_403_FORBIDDEN
+
+
+# Test: Bulk import validates rows, reports conflicts and makes links resolvable
+@pytest.mark.anyio
+async def test_bulk_import(authed_client, test_user):
+    resp = await authed_client.post("/links/shorten", json={"full_url": "https://example.com", "custom_alias": "taken"})
+    assert resp.status_code == status.HTTP_200_OK
+
+    body = "\n".join([
+        "full_url,alias,expires_at",
+        "https://example.com/1,imp1,",
+        "not a url,imp2,",
+        "https://example.com/3,taken,",
+        "https://example.com/4,imp1,",
+        "https://example.com/5,,2100-01-01 00:00",
+        "https://example.com/6,imp6,2100-02-31 00:00",
+        "",
+    ])
+    resp = await authed_client.post("/admin/imports", params={"format": "csv"}, content=body)
+    assert resp.status_code == status.HTTP_403_FORBIDDEN
+
+    test_user.is_superuser = True
+    resp = await authed_client.post("/admin/imports", params={"format": "csv", "source": "legacy.csv"}, content=body)
+    assert resp.status_code == status.HTTP_200_OK
+    job = resp.json()
+    assert (job["status"], job["rows_processed"], job["imported"], job["conflicts"], job["invalid"]) == ("completed", 6, 2, 2, 2)
+
+    progress = await authed_client.get(f"/admin/imports/{job['job_id']}")
+    assert progress.json()["imported"] == 2
+    errors = (await authed_client.get(f"/admin/imports/{job['job_id']}/errors")).json()
+    assert [(error["line_no"], error["short_url"]) for error in errors] == [(2, None), (3, "taken"), (4, "imp1"), (6, None)]
+
+    assert (await authed_client.get("/links/imp1", follow_redirects=False)).status_code == 307
+    mine = (await authed_client.get("/links/mine")).json()
+    assert {link["full_url"] for link in mine} >= {"https://example.com/1", "https://example.com/5"}
+    found = await authed_client.get("/links/search/domain", params={"host": "example.com", "path_prefix": "/5"})
+    assert len(found.json()) == 1
+
+
+# Test: A generated code that collides with an existing alias is reissued, not reported as a conflict
+@pytest.mark.anyio
+async def test_bulk_import_reissues_colliding_generated_code(authed_client, mocker):
+    import json
+    from src import bulk_import
+
+    resp = await authed_client.post("/links/shorten", json={"full_url": "https://example.com", "custom_alias": "taken"})
+    assert resp.status_code == status.HTTP_200_OK
+
+    async def source():
+        yield json.dumps({"full_url": "https://example.com/gen"})
+        yield json.dumps({"full_url": "https://example.com/own", "alias": "taken"})
+
+    mocker.patch.object(bulk_import.code_generator, "next_codes", side_effect=[["taken"], ["fresh"]])
+    summary = await bulk_import.run_import(source(), "ndjson", job_id="reissue")
+    assert (summary["imported"], summary["conflicts"]) == (1, 1)
+    resp = await authed_client.get("/links/fresh", follow_redirects=False)
+    assert resp.headers["location"] == "https://example.com/gen"
+
+
+# Test: An interrupted import resumes from the last committed batch without duplicates
+@pytest.mark.anyio
+async def test_bulk_import_resume(db_session, mocker):
+    import json
+    from sqlalchemy import func, select
+    from src import bulk_import
+    from src.models import Url
+
+    lines = [json.dumps({"full_url": f"https://example.com/r{i}", "alias": f"res{i}"}) for i in range(5)]
+
+    async def source():
+        for line in lines:
+            yield line
+
+    merge = bulk_import._merge
+    calls = 0
+
+    async def failing_merge(*args):
+        nonlocal calls
+        calls += 1
+        if calls == 2:
+            raise RuntimeError("обрыв соединения")
+        return await merge(*args)
+
+    mocker.patch.object(bulk_import, "_merge", failing_merge)
+    with pytest.raises(RuntimeError):
+        await bulk_import.run_import(source(), "ndjson", job_id="resume", batch_size=2)
+    job = (await bulk_import._reload("resume"))
+    assert (job.status, job.rows_processed, job.imported) == ("failed", 2, 2)
+
+    summary = await bulk_import.run_import(source(), "ndjson", job_id="resume", batch_size=2)
+    assert (summary["status"], summary["rows_processed"], summary["imported"], summary["conflicts"]) == ("completed", 5, 5, 0)
+    count = await db_session.execute(select(func.count()).select_from(Url).where(Url.short_url.like("res%")))
+    assert count.scalar_one() == 5
+
+
+# Test: Under high DB latency writes are shed with 429 + Retry-After, stats with 503, redirects still pass
+@pytest.mark.anyio
+async def test_admission_sheds_writes_on_db_latency(authed_client, monkeypatch):
+    from src import admission
+
+    resp = await authed_client.post("/links/shorten", json={"full_url": "https://example.com", "custom_alias": "shed"})
+    assert resp.status_code == status.HTTP_200_OK
+
+    monkeypatch.setattr(admission, "db_latency", lambda: 1.0)
+    resp = await authed_client.post("/links/shorten", json={"full_url": "https://example.com"})
+    assert resp.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert resp.headers["Retry-After"] == "10"
+    resp = await authed_client.get("/links/shed/stats")
+    assert resp.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert resp.headers["Retry-After"] == "4"
+    resp = await authed_client.get("/links/shed", follow_redirects=False)
+    assert resp.status_code == status.HTTP_307_TEMPORARY_REDIRECT
+
+    stats = (await authed_client.get("/monitoring/admission")).json()
+    assert stats["rejected"] == {"write": 1, "stats": 1}
+
+
+# Test: Per-client token buckets limit writes; Redis errors fall back to local buckets
+@pytest.mark.anyio
+async def test_admission_rate_limits_writes_per_client(client, monkeypatch):
+    from src import admission
+
+    class FailingRedis:
+        async def eval(self, *args):
+            raise ConnectionError("redis недоступен")
+
+    monkeypatch.setitem(admission.admission_controller.policies, admission.WRITE, admission.ClassPolicy(4, 0, 0.5, 2))
+    monkeypatch.setattr(admission.admission_controller.buckets, "redis", FailingRedis())
+    for _ in range(2):
+        resp = await client.post("/links/shorten", json={"full_url": "https://example.com"})
+        assert resp.status_code == status.HTTP_200_OK
+    resp = await client.post("/links/shorten", json={"full_url": "https://example.com"})
+    assert resp.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert resp.headers["Retry-After"] == "2"
+    assert (await client.get("/links/search", params={"full_url": "https://example.com"})).status_code == 200
+
+
+# Test: Token buckets live in Redis, one bucket per route class and client
+@pytest.mark.anyio
+async def test_admission_token_bucket_in_redis(client, monkeypatch):
+    from src import admission
+
+    keys = []
+
+    class FakeRedis:
+        async def eval(self, script, numkeys, key, rate, burst):
+            keys.append((key, rate, burst))
+            return b"0" if len(keys) == 1 else b"2.5"
+
+    monkeypatch.setattr(admission.admission_controller.buckets, "redis", FakeRedis())
+    resp = await client.post("/links/shorten", json={"full_url": "https://example.com"})
+    assert resp.status_code == status.HTTP_200_OK
+    resp = await client.post("/links/shorten", json={"full_url": "https://example.com"})
+    assert resp.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert resp.headers["Retry-After"] == "3"
+    policy = admission.POLICIES[admission.WRITE]
+    assert keys[0] == ("admission:write:127.0.0.1", policy.rate, policy.burst)
+
+
+# Test: Behind a proxy anonymous idempotency keys use the same client key as admission control
+@pytest.mark.anyio
+async def test_anonymous_idempotency_keys_follow_admission_client_header(client, monkeypatch):
+    from src import admission
+
+    monkeypatch.setattr(admission, "ADMISSION_CLIENT_HEADER", "x-forwarded-for")
+    responses = [
+        await client.post(
+            "/links/shorten", json={"full_url": "https://example.com/a"},
+            headers={"Idempotency-Key": "same", "X-Forwarded-For": address},
+        )
+        for address in ("10.0.0.1", "10.0.0.2", "10.0.0.1")
+    ]
+    assert [resp.status_code for resp in responses] == [status.HTTP_200_OK] * 3
+    assert responses[0].json() != responses[1].json()
+    assert responses[2].json() == responses[0].json()
+
+
+# Test: No endpoint blocks the event loop (check_cache used to call time.sleep(3))
+@pytest.mark.anyio
+async def test_endpoints_do_not_block_event_loop(authed_client):
+    from src.loop_monitor import loop_lag_probe
+
+    resp = await authed_client.post("/links/shorten", json={"full_url": "https://example.com/loop", "custom_alias": "loop"})
+    assert resp.status_code == status.HTTP_200_OK
+    requests = [
+        ("GET", "/links/check_cache"),
+        ("POST", "/links/shorten"),
+        ("GET", "/links/loop"),
+        ("GET", "/links/loop/stats"),
+        ("GET", "/links/search"),
+        ("GET", "/links/mine"),
+        ("GET", "/links/expired/stats"),
+        ("GET", "/monitoring/loop"),
+    ]
+    for method, url in requests:
+        async with loop_lag_probe() as probe:
+            if method == "POST":
+                resp = await authed_client.post(url, json={"full_url": "https://example.com/loop"})
+            else:
+                resp = await authed_client.get(url, params={"full_url": "https://example.com/loop"})
+        assert resp.status_code < 500, url
+        assert probe.max_lag() < 0.2, f"{method} {url} заблокировал цикл событий на {probe.max_lag():.3f} с"
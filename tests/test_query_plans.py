@@ -0,0 +1,193 @@
+import ast
+import re
+from contextlib import contextmanager
+from pathlib import Path
+
+import pytest
+from fastapi import status
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from tests.conftest import TestAsyncSessionMaker, test_engine
+
+# Полный проход по таблице или индексу в выводе EXPLAIN QUERY PLAN SQLite
+FULL_SCAN = re.compile(r"\bSCAN (?!CONSTANT ROW)(\w+)")
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "src" / "migrations" / "versions"
+# Таблица пользователей описана fastapi-users и создана исходной миграцией, её индексы здесь не сверяются
+UNTRACKED_TABLES = {"user"}
+
+
+@contextmanager
+def capture_statements():
+    # Перехватываем все запросы, которые ручки отправляют в БД
+    captured = []
+
+    def listener(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            captured.append((statement, parameters))
+
+    event.listen(Engine, "before_cursor_execute", listener)
+    try:
+        yield captured
+    finally:
+        event.remove(Engine, "before_cursor_execute", listener)
+
+
+async def full_scans(statements) -> list[tuple[str, str]]:
+    scans = []
+    async with test_engine.connect() as conn:
+        for statement, parameters in statements:
+            plan = (await conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)).all()
+            scans.extend((statement, row[-1]) for row in plan if FULL_SCAN.search(row[-1]))
+    return scans
+
+
+async def seed(client):
+    batch = [
+        {"full_url": f"https://example.com/{i % 50}", "custom_alias": f"seed{i}",
+         "expires_at": "1970-01-01 00:00" if i % 3 == 0 else None}
+        for i in range(300)
+    ]
+    resp = await client.post("/links/shorten/batch", json=batch)
+    assert resp.status_code == status.HTTP_200_OK
+    for i in range(1, 20):
+        await client.get(f"/links/seed{i}", follow_redirects=False)
+
+
+async def seed_archive():
+    from datetime import datetime
+    from src.models import ArchivedLink
+
+    async with TestAsyncSessionMaker() as session:
+        session.add_all([
+            ArchivedLink(
+                url_id=i, full_url=f"https://example.com/{i}", short_url=f"archived{i}",
+                creation_time=datetime(1969, 1, 1), expires_at=datetime(1970, 1, 1, i % 24),
+                access_count=i, purged_at=datetime.now(),
+            )
+            for i in range(1, 30)
+        ])
+        await session.commit()
+
+
+# Test: Hot router queries are served by indexes, not full scans
+@pytest.mark.anyio
+async def test_router_queries_use_indexes(authed_client):
+    await seed(authed_client)
+    await seed_archive()
+
+    with capture_statements() as statements:
+        await authed_client.post("/links/shorten", json={"full_url": "https://example.com", "custom_alias": "plan"})
+        await authed_client.post("/links/shorten", json={"full_url": "https://example.com"})
+        await authed_client.post(
+            "/links/shorten", json={"full_url": "https://example.com/7"},
+            params={"reuse_existing": True}, headers={"Idempotency-Key": "plan"},
+        )
+        await authed_client.get("/links/search", params={"full_url": "https://example.com/7"})
+        await authed_client.get("/links/plan", follow_redirects=False)
+        await authed_client.get("/links/search/domain", params={"host": "example.com", "path_prefix": "/1", "limit": 5})
+        page = await authed_client.get("/links/search/domain", params={"path_prefix": "/1", "limit": 5})
+        await authed_client.get(
+            "/links/search/domain", params={"path_prefix": "/1", "limit": 5, "cursor": page.headers["X-Next-Cursor"]}
+        )
+        await authed_client.get("/links/seed1/stats")
+        page = await authed_client.get("/links/mine", params={"limit": 10})
+        await authed_client.get("/links/mine", params={"limit": 10, "cursor": page.headers["X-Next-Cursor"]})
+        page = await authed_client.get("/links/expired/stats", params={"limit": 10})
+        await authed_client.get(
+            "/links/expired/stats", params={"limit": 10, "cursor": page.headers["X-Next-Cursor"]}
+        )
+        page = await authed_client.get("/links/expired/archive", params={"limit": 10})
+        await authed_client.get(
+            "/links/expired/archive", params={"limit": 10, "cursor": page.headers["X-Next-Cursor"]}
+        )
+        await authed_client.put("/links/plan", params={"new_alias": "plan2"})
+        await authed_client.delete("/links/plan2")
+
+    assert statements
+    assert await full_scans(statements) == []
+
+
+def _literal(node):
+    # Значение аргумента миграции: строка, список строк или sa.text('...')
+    if isinstance(node, ast.Call) and getattr(node.func, "attr", None) == "text":
+        return _literal(node.args[0])
+    if isinstance(node, ast.List):
+        return tuple(_literal(element) for element in node.elts)
+    return ast.literal_eval(node)
+
+
+def _index_definition(table: str, columns, options: dict) -> tuple:
+    where = options.get("postgresql_where")
+    return (
+        table,
+        tuple(columns),
+        tuple(options.get("postgresql_include") or ()),
+        where.replace(f"{table}.", "") if where else None,
+        options.get("postgresql_using") or None,
+    )
+
+
+def migration_indexes() -> dict[str, tuple]:
+    # Индексы после upgrade() всех ревизий по цепочке down_revision. Миграции разбираются статически:
+    # op.create_index / op.drop_index и колонки с index=True в op.create_table в порядке следования
+    upgrades = {}
+    for path in MIGRATIONS_DIR.glob("*.py"):
+        tree = ast.parse(path.read_text(encoding="utf-8"))
+        names = {
+            node.targets[0].id: ast.literal_eval(node.value)
+            for node in tree.body
+            if isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Name)
+            and node.targets[0].id in ("revision", "down_revision")
+        }
+        upgrade = next(node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name == "upgrade")
+        upgrades[names["down_revision"]] = (names["revision"], upgrade)
+
+    indexes = {}
+    revision = None
+    while revision in upgrades:
+        revision, upgrade = upgrades[revision]
+        calls = sorted(
+            (node for node in ast.walk(upgrade) if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+             and isinstance(node.func.value, ast.Name) and node.func.value.id == "op"),
+            key=lambda node: (node.lineno, node.col_offset),
+        )
+        for call in calls:
+            if call.func.attr == "create_index":
+                name, table, columns = (_literal(arg) for arg in call.args[:3])
+                options = {keyword.arg: _literal(keyword.value) for keyword in call.keywords}
+                indexes[name] = _index_definition(table, columns, options)
+            elif call.func.attr == "drop_index":
+                indexes.pop(_literal(call.args[0]))
+            elif call.func.attr == "create_table":
+                for column in call.args[1:]:
+                    keywords = {keyword.arg: keyword.value for keyword in getattr(column, "keywords", [])}
+                    if "index" in keywords and _literal(keywords["index"]):
+                        table, name = _literal(call.args[0]), _literal(column.args[0])
+                        indexes[f"ix_{table}_{name}"] = _index_definition(table, [name], {})
+    return {name: index for name, index in indexes.items() if index[0] not in UNTRACKED_TABLES}
+
+
+def model_indexes() -> dict[str, tuple]:
+    from sqlalchemy.dialects import postgresql
+    from src.database import Base
+
+    indexes = {}
+    for table in Base.metadata.sorted_tables:
+        if table.name in UNTRACKED_TABLES:
+            continue
+        for index in table.indexes:
+            options = dict(index.dialect_options["postgresql"])
+            if options.get("where") is not None:
+                options["where"] = str(options["where"].compile(dialect=postgresql.dialect()))
+            indexes[index.name] = _index_definition(
+                table.name, [column.name for column in index.columns],
+                {f"postgresql_{key}": value for key, value in options.items()},
+            )
+    return indexes
+
+
+# Test: Migrations create exactly the indexes the models declare (columns, INCLUDE, partial predicate, method)
+def test_migrations_match_model_indexes():
+    assert migration_indexes() == model_indexes()
@@ -0,0 +1,44 @@
+import pytest
+from fastapi import status
+
+import src.profiling as profiling
+
+# Бюджет SQL-запросов на ручку: рост числа запросов - регрессия (например, N+1)
+BUDGETS = [
+    ("post", "/links/shorten", {"json": {"full_url": "https://example.com/b", "custom_alias": "budget"}}, 1),
+    ("post", "/links/shorten", {"json": {"full_url": "https://example.com/b"}}, 2),
+    ("post", "/links/shorten/batch", {"json": [{"full_url": f"https://example.com/{i}"} for i in range(20)]}, 1),
+    ("get", "/links/budget", {"follow_redirects": False}, 5),
+    ("get", "/links/budget/stats", {}, 1),
+    ("get", "/links/budget/stats/timeseries", {}, 1),
+    ("get", "/links/search", {"params": {"full_url": "https://example.com/b"}}, 1),
+    ("get", "/links/expired/stats", {}, 1),
+    ("get", "/links/expired/archive", {}, 1),
+    ("get", "/links/mine", {}, 1),
+    ("put", "/links/budget", {"params": {"new_alias": "budget2"}}, 1),
+    ("put", "/links/budget2", {"params": {"new_alias": "budget3"}}, 1),
+    ("delete", "/links/budget3", {}, 1),
+]
+
+
+@pytest.fixture
+def sql_profiler(monkeypatch):
+    monkeypatch.setattr(profiling, "SQL_PROFILER_ENABLED", True)
+
+
+# Test: Every endpoint stays within its SQL statement budget
+@pytest.mark.anyio
+async def test_endpoint_statement_budgets(authed_client, sql_profiler):
+    for method, url, kwargs, budget in BUDGETS:
+        resp = await getattr(authed_client, method)(url, **kwargs)
+        assert resp.status_code < status.HTTP_400_BAD_REQUEST, (method, url, resp.text)
+        statements = int(resp.headers[profiling.STATEMENTS_HEADER])
+        assert statements <= budget, f"{method.upper()} {url}: {statements} запросов при бюджете {budget}"
+        assert float(resp.headers[profiling.DB_TIME_HEADER]) >= 0
+
+
+# Test: Profiler headers are absent unless the profiler is enabled
+@pytest.mark.anyio
+async def test_profiler_disabled_by_default(client):
+    resp = await client.get("/links/expired/stats")
+    assert profiling.STATEMENTS_HEADER not in resp.headers
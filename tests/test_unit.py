@@ -1,4 +1,5 @@
-from src.router import valid_url
+import pytest
+from src.validation import valid_url
 
 
 def test_validate_url_accepts_valid_urls():
@@ -9,3 +10,363 @@ def test_validate_url_accepts_valid_urls():
 def test_validate_url_rejects_invalid_urls():
     assert valid_url("") is False
     assert valid_url("?https://example.com?") is False
+
+
+def test_lookup_cache_evicts_least_recently_used():
+    from src.lookup_cache import LinkLookupCache, LinkEntry, MISSING
+
+    cache = LinkLookupCache(max_size=2)
+    cache._set_local("a", LinkEntry(1, "https://a.com", None))
+    cache._set_local("b", None)
+    cache._get_local("a")
+    cache._set_local("c", LinkEntry(3, "https://c.com", None))
+
+    assert cache._get_local("b") is MISSING
+    assert cache._get_local("a").full_url == "https://a.com"
+    assert cache._get_local("c").id == 3
+
+
+def test_lookup_cache_tombstone_blocks_stale_set():
+    import asyncio
+    from src.invalidation import InvalidationBus
+    from src.lookup_cache import LinkLookupCache, LinkEntry, MISSING
+
+    cache = LinkLookupCache(tombstone_ttl=10)
+    stale = LinkEntry(1, "https://a.com", None)
+    # Ссылку удалили между чтением из БД и записью в кэш
+    asyncio.run(cache.invalidate("a"))
+    asyncio.run(cache.set("a", stale))
+    assert asyncio.run(cache.get("a")) is MISSING
+    # Промах после инвалидации видит надгробие и может его заменить
+    entry, seen = asyncio.run(cache.lookup("a"))
+    assert entry is MISSING
+    asyncio.run(cache.set("a", None, seen))
+    assert asyncio.run(cache.get("a")) is None
+    assert cache.stale_sets == 1
+
+    # Вытеснение, пришедшее от другого воркера, тоже оставляет надгробие
+    bus = InvalidationBus()
+    bus.subscribe("links", cache.evict_local)
+    cache._set_local("b", LinkEntry(2, "https://b.com", None))
+    bus.dispatch(b"invalidate:links", b'["b"]')
+    assert cache._get_local("b") is MISSING
+    assert bus.stats()["received"] == 1
+
+
+def test_cache_key_ignores_session_argument():
+    from src.cache import key_by
+
+    builder = key_by("short_url")
+    key1 = builder(None, "prefix:stats", kwargs={"short_url": "abc", "session": object()})
+    key2 = builder(None, "prefix:stats", kwargs={"short_url": "abc", "session": object()})
+    assert key1 == key2
+    assert key1 != builder(None, "prefix:stats", kwargs={"short_url": "abd", "session": object()})
+
+
+def test_aggregate_clicks_collapses_batch_per_link():
+    from datetime import datetime
+    from src.counters import aggregate_clicks
+
+    clicks = [
+        {"url_id": 2, "access_time": datetime(2025, 1, 1, 10)},
+        {"url_id": 1, "access_time": datetime(2025, 1, 1, 12)},
+        {"url_id": 2, "access_time": datetime(2025, 1, 1, 11)},
+    ]
+    assert aggregate_clicks(clicks) == [
+        {"url_id": 1, "access_count": 1, "last_access": datetime(2025, 1, 1, 12)},
+        {"url_id": 2, "access_count": 2, "last_access": datetime(2025, 1, 1, 11)},
+    ]
+
+
+def test_feistel_permutation_is_bijective():
+    from src.codegen import FeistelPermutation
+
+    permutation = FeistelPermutation(62 ** 2, "key")
+    assert sorted(permutation(value) for value in range(62 ** 2)) == list(range(62 ** 2))
+    assert [permutation(value) for value in range(5)] != list(range(5))
+
+
+def test_code_generator_has_no_default_scramble_key(monkeypatch, caplog):
+    from src.codegen import build_code_generator, CounterCodeGenerator, RandomCodeGenerator
+
+    monkeypatch.delenv("SHORT_CODE_GENERATOR", raising=False)
+    monkeypatch.delenv("SHORT_CODE_SCRAMBLE_KEY", raising=False)
+    # Без ключа коды из счётчика шли бы по порядку, поэтому выдаются случайные
+    assert isinstance(build_code_generator(), RandomCodeGenerator)
+    assert "SHORT_CODE_SCRAMBLE_KEY" in caplog.text
+
+    monkeypatch.setenv("SHORT_CODE_SCRAMBLE_KEY", "secret")
+    generator = build_code_generator()
+    assert isinstance(generator, CounterCodeGenerator)
+    assert generator.permutation is not None
+
+
+def test_encode_base62_fixed_length():
+    from src.codegen import encode_base62
+
+    assert encode_base62(0, 4) == "0000"
+    assert encode_base62(61, 4) == "000z"
+    assert encode_base62(62, 4) == "0010"
+    with pytest.raises(ValueError):
+        encode_base62(62 ** 4, 4)
+
+
+def test_partitions_created_ahead_and_retired_by_retention():
+    from datetime import datetime
+    from src.partitions import months_to_create, partition_ddl, partitions_to_retire
+
+    now = datetime(2025, 11, 15)
+    assert months_to_create(now, 2) == [datetime(2025, 11, 1), datetime(2025, 12, 1), datetime(2026, 1, 1)]
+    assert months_to_create(now, 0, since=datetime(2025, 9, 20)) == [
+        datetime(2025, 9, 1), datetime(2025, 10, 1), datetime(2025, 11, 1)
+    ]
+    assert partition_ddl(datetime(2025, 12, 1)).endswith(
+        "queries_p202512 PARTITION OF queries FOR VALUES FROM ('2025-12-01') TO ('2026-01-01')"
+    )
+
+    names = ["queries_p202508", "queries_p202509", "queries_p202510", "queries_default"]
+    assert partitions_to_retire(names, now, 2) == ["queries_p202508"]
+    assert partitions_to_retire(names, now, 0) == []
+
+
+def test_partition_coverage():
+    from datetime import datetime
+    from src.partitions import months_covered
+
+    now = datetime(2025, 11, 15)
+    assert months_covered(["queries_p202511", "queries_p202512", "queries_p202602"], now) == 1
+    assert months_covered(["queries_p202510", "queries_default"], now) == -1
+
+
+def test_engine_options_from_environment(monkeypatch):
+    from src.database import engine_options, InstrumentedAsyncPool
+
+    monkeypatch.setenv("DB_POOL_SIZE", "3")
+    monkeypatch.setenv("DB_POOL_PRE_PING", "0")
+    monkeypatch.setenv("DB_PREPARED_STATEMENT_CACHE_SIZE", "0")
+    options = engine_options("postgresql+asyncpg://user:pass@db/urls")
+    assert options["poolclass"] is InstrumentedAsyncPool
+    assert options["pool_size"] == 3
+    assert options["pool_pre_ping"] is False
+    assert options["connect_args"]["prepared_statement_cache_size"] == 0
+    assert engine_options("sqlite+aiosqlite:///./test.db") == {}
+
+
+def test_pool_metrics_count_waits_and_timeouts():
+    import sqlite3
+    from sqlalchemy import exc
+    from sqlalchemy.pool import QueuePool
+    from src.database import PoolMetricsMixin, pool_metrics
+
+    pool_class = type("MeteredPool", (PoolMetricsMixin, QueuePool), {})
+    pool = pool_class(lambda: sqlite3.connect(":memory:"), pool_size=1, max_overflow=0, timeout=0.01)
+    checkouts, timeouts = pool_metrics.checkouts, pool_metrics.timeouts
+
+    connection = pool.connect()
+    with pytest.raises(exc.TimeoutError):
+        pool.connect()
+    connection.close()
+
+    assert pool_metrics.checkouts == checkouts + 1
+    assert pool_metrics.timeouts == timeouts + 1
+
+
+# Test: SQL statements executed inside a request are attributed to that request
+def test_request_db_stats_listener():
+    from sqlalchemy import create_engine, text
+    from src.metrics import RequestDbStats, request_db_stats
+
+    engine = create_engine("sqlite://")
+    stats = RequestDbStats()
+    token = request_db_stats.set(stats)
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT 2"))
+    finally:
+        request_db_stats.reset(token)
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 3"))
+
+    assert stats.statements == 2
+    assert stats.duration > 0
+
+
+# Test: Only statements of request handlers feed the admission latency signal, background work does not
+def test_db_latency_ignores_background_statements(monkeypatch):
+    from sqlalchemy import create_engine, text
+    from src import metrics
+
+    latency = metrics.LatencyEwma(alpha=1.0)
+    monkeypatch.setattr(metrics, "db_statement_latency", latency)
+    engine = create_engine("sqlite://")
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    assert latency.value() == 0
+
+    token = metrics.request_db_stats.set(metrics.RequestDbStats())
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    finally:
+        metrics.request_db_stats.reset(token)
+    assert latency.value() > 0
+
+
+# Test: Statements differing only in values or IN-list length share a shape
+def test_statement_shape_and_repeats():
+    from src.profiling import repeated_shapes, statement_shape
+
+    assert statement_shape("SELECT * FROM urls WHERE id IN (?, ?, ?)") == "SELECT * FROM urls WHERE id IN (?)"
+    assert statement_shape("SELECT  *\n FROM urls LIMIT 10") == "SELECT * FROM urls LIMIT N"
+    shapes = {
+        "SELECT * FROM urls WHERE id IN ($1, $2)": 3,
+        "SELECT * FROM urls WHERE id IN ($1)": 3,
+        "SELECT 1": 1,
+    }
+    assert repeated_shapes(shapes, 5) == {"SELECT * FROM urls WHERE id IN (?)": 6}
+    assert repeated_shapes(shapes, 6) == {}
+
+
+# Test: Benchmark helpers - Zipf skew, nearest-rank percentiles and baseline comparison
+def test_benchmark_workload_helpers():
+    import random
+    from benchmarks.workload import ZipfSampler, compare, percentile
+
+    sampler = ZipfSampler(100, 1.1, random.Random(1))
+    samples = [sampler.sample() for _ in range(5000)]
+    assert all(0 <= s < 100 for s in samples)
+    assert samples.count(0) > samples.count(10) > samples.count(90)
+
+    assert percentile([1, 2, 3, 4], 0.5) == 2
+    assert percentile([1, 2, 3, 4], 0.99) == 4
+    assert percentile([], 0.5) == 0.0
+
+    baseline = {"endpoints": {"redirect": {"p50_ms": 10, "p95_ms": 20, "p99_ms": 30, "throughput_rps": 100, "errors": 0}}}
+    ok = {"endpoints": {"redirect": {"count": 500, "p50_ms": 11, "p95_ms": 20, "p99_ms": 36, "throughput_rps": 90, "errors": 0}}}
+    assert compare(ok, baseline, 0.25) == []
+    slow = {"endpoints": {"redirect": {"count": 500, "p50_ms": 10, "p95_ms": 40, "p99_ms": 30, "throughput_rps": 50, "errors": 0}}}
+    assert len(compare(slow, baseline, 0.25)) == 2
+    assert compare(slow, baseline, 0.25, min_samples=1000) == ["redirect: throughput_rps 50 < 75.00"]
+
+
+# Test: Equivalent URLs normalize to one canonical form
+def test_normalize_url():
+    from src.url_keys import normalize_url, prefix_upper_bound, url_columns, URL_PATH_MAX_LENGTH
+
+    assert normalize_url("HTTPS://Example.COM:443/a/?b=2&a=1") == "https://example.com/a?a=1&b=2"
+    assert normalize_url("http://example.com") == "http://example.com/"
+    assert normalize_url("http://Ex.com:8080/x") == "http://ex.com:8080/x"
+    assert normalize_url("http://[::1]:80/x/") == "http://[::1]/x"
+    assert normalize_url("https://example.com/Path#Frag") == "https://example.com/Path#Frag"
+    assert url_columns("https://EXAMPLE.com/") == url_columns("https://example.com")
+    assert len(url_columns("https://example.com")["full_url_hash"]) == 32
+    columns = url_columns("https://Sub.Example.com:8080/a/b/?x=1")
+    assert (columns["url_host"], columns["url_path"]) == ("sub.example.com", "/a/b")
+    assert prefix_upper_bound("/a/b") == "/a/c"
+    # Колонки из btree-индексов ограничены по длине
+    assert len(url_columns("https://example.com/" + "p" * 10000)["url_path"]) == URL_PATH_MAX_LENGTH
+
+
+# Test: Indexes on urls never carry unbounded URL columns, a long URL must not overflow a btree row
+def test_url_indexes_skip_unbounded_columns():
+    from src.models import Url
+
+    for index in Url.__table__.indexes:
+        columns = [column.name for column in index.columns] + list(index.dialect_options["postgresql"]["include"] or [])
+        assert not {"full_url", "normalized_url"} & set(columns), index.name
+
+
+# Test: A quoted CSV field spanning several lines is imported as one record
+def test_csv_import_keeps_multiline_quoted_fields():
+    import asyncio
+    from src.bulk_import import iter_records
+
+    async def lines():
+        for line in ['full_url,alias', '"https://example.com/a?note=line one', 'line two",multi', '', 'https://example.com/b,"b"']:
+            yield line
+
+    async def collect():
+        return [record async for record in iter_records(lines(), "csv")]
+
+    assert asyncio.run(collect()) == [
+        (1, {"full_url": "https://example.com/a?note=line one\nline two", "custom_alias": "multi"}, None),
+        (2, {"full_url": "https://example.com/b", "custom_alias": "b"}, None),
+    ]
+
+
+# Test: Admission control classifies routes before routing and limits per-client tokens locally
+def test_admission_classify_and_local_buckets():
+    from src.admission import EXPORT, REDIRECT, STATS, WRITE, TokenBuckets, classify
+
+    assert classify("GET", "/links/abc123") == REDIRECT
+    assert classify("GET", "/links/abc123/stats") == STATS
+    assert classify("GET", "/links/search") == STATS
+    assert classify("GET", "/links/mine") == STATS
+    assert classify("GET", "/links/expired/stats") == STATS
+    assert classify("POST", "/links/shorten") == WRITE
+    assert classify("DELETE", "/links/abc123") == WRITE
+    assert classify("GET", "/links/abc123/clicks/export") == EXPORT
+    assert classify("GET", "/links/mine/clicks/export") == EXPORT
+    assert classify("POST", "/auth/jwt/login") is None
+    assert classify("GET", "/metrics") is None
+
+    buckets = TokenBuckets()
+    assert buckets._take_local(WRITE, "1.1.1.1", 1.0, 2) == 0
+    assert buckets._take_local(WRITE, "1.1.1.1", 1.0, 2) == 0
+    assert 0 < buckets._take_local(WRITE, "1.1.1.1", 1.0, 2) <= 1
+    assert buckets._take_local(WRITE, "2.2.2.2", 1.0, 2) == 0
+    assert buckets._take_local(STATS, "1.1.1.1", 1.0, 2) == 0
+
+
+# Test: The concurrency limiter hands a released slot to the first waiter and times out the rest
+@pytest.mark.anyio
+async def test_admission_concurrency_limiter():
+    import anyio
+    from src.admission import ConcurrencyLimiter
+
+    limiter = ConcurrencyLimiter(1)
+    assert await limiter.acquire(0)
+    assert not await limiter.acquire(0)
+    assert not await limiter.acquire(0.01)
+
+    results = []
+
+    async def waiter():
+        results.append(await limiter.acquire(1))
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(waiter)
+        await anyio.sleep(0.01)
+        limiter.release()
+    assert results == [True]
+    assert limiter.in_flight == 1
+    limiter.release()
+    assert limiter.in_flight == 0
+
+
+# Test: The loop watchdog captures the stack of a call that blocks the event loop
+@pytest.mark.anyio
+async def test_loop_monitor_captures_blocking_stack():
+    import time
+    import anyio
+    from src.loop_monitor import LoopMonitor
+
+    monitor = LoopMonitor(interval=0.01, threshold=0.05)
+
+    def blocking_handler():
+        time.sleep(0.3)
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(monitor.run)
+        await anyio.sleep(0.05)
+        blocking_handler()
+        await anyio.sleep(0.05)
+        tg.cancel_scope.cancel()
+
+    assert monitor.blocked_total == 1
+    assert "blocking_handler" in monitor.blocks[0]["stack"]
+    assert monitor.max_lag() >= 0.25
+    stats = monitor.stats()
+    assert stats["lag_max"] == monitor.max_lag()
+    assert stats["lag_p50"] < 0.05